@@ -1,20 +1,19 @@
 from pypdf import PdfReader
 import datetime
 import sys
-for file in sys.argv:
+# Prints an author + year name for each PDF file given, e.g. python PDFreader.py report1.pdf report2.pdf
+# Only the metadata is read, not the pages (see harvest_metadata.py for whole folders)
+for file in sys.argv[1:]:
     print(file)
     with open (file, "rb") as f:
         reader = PdfReader(f)
-        number_of_pages = len(reader.pages)
-        page = reader.pages[0]
         meta = reader.metadata
-        text = page.extract_text()# Write your code here :-)
-        line = text.split("\n")
-        filename = meta.author + meta.creation_date.strftime('%Y')
+        author = meta.author if meta is not None and meta.author else 'Unknown'
+        year = meta.creation_date.strftime('%Y') if meta is not None and meta.creation_date is not None else ''
+        filename = author + year
         print(filename)
 
 #print(meta.author)
 #print(meta.creation_date)
 #print(meta.title)
 #print(meta.creation_date.year)
-
@@ -0,0 +1,199 @@
+# Harvests the metadata of every PDF file in one or more folders (and their subfolders) into a CSV or JSON lines catalog
+# Only the document information dictionary, the XMP metadata and the page tree count are read, the pages themselves
+# (their content streams) are never touched, so each file takes milliseconds whatever its size
+# Files are read on a pool of worker processes and each row is written as soon as its file is done, in the order files finish
+# Usage:
+# python harvest_metadata.py folder [folder ...] -o catalog.csv
+# python harvest_metadata.py folder -o catalog.jsonl --no-hash -w 8
+
+import argparse
+import csv
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from multiprocessing import Pool
+
+pdf_file_pattern = '*.pdf'
+hash_block_size = 1024 * 1024 # bytes read at a time when hashing
+files_per_task = 16 # files sent to a worker at once, reading the metadata of one file is too quick to be worth sending alone
+progress_every = 1000 # files
+# Problems are recorded in the error column rather than logged for every file, set when this module is imported so worker processes have it too
+logging.getLogger('pypdf').setLevel(logging.ERROR)
+
+columns = ['path', 'filename', 'size', 'modified', 'sha256', 'pages', 'pdf_version', 'encrypted',
+           'title', 'author', 'subject', 'keywords', 'creator', 'producer', 'creation_date', 'modification_date',
+           'xmp_title', 'xmp_creator', 'xmp_create_date', 'xmp_modify_date', 'error']
+
+def find_pdf_files(folders, pattern = pdf_file_pattern):
+    """
+    Finds the PDF files in folders and their subfolders, or the files themselves if given.
+
+    Returns:
+    pdf_paths (generator): The path of each PDF file, in the order the folders list them.
+    """
+    for folder in folders:
+        if not os.path.isdir(folder):
+            yield folder
+            continue
+        for current_folder, subfolders, filenames in os.walk(folder):
+            subfolders.sort()
+            for filename in sorted(filenames):
+                if fnmatch.fnmatch(filename.lower(), pattern):
+                    yield os.path.join(current_folder, filename)
+
+def file_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as pdf_file:
+        for block in iter(lambda: pdf_file.read(hash_block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def as_text(value):
+    # Metadata dates as ISO 8601 text, lists (e.g. XMP creators) joined with semicolons
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return '; '.join(as_text(item) for item in value)
+    if isinstance(value, dict):
+        # XMP language alternatives, e.g. {'x-default': 'Title'}
+        return as_text(value.get('x-default', next(iter(value.values()), None)))
+    return str(value).strip()
+
+def read_metadata(path, with_hash = True):
+    """
+    Reads the metadata of one PDF file without reading its pages.
+
+    Parameters:
+    path (str): The path of the PDF file.
+    with_hash (bool): Whether to hash the file (which does read all of it).
+
+    Returns:
+    row (dict): A value for each of columns, the error column says what could not be read.
+    """
+    from pypdf import PdfReader # imported here so only the worker processes load it
+
+    row = dict.fromkeys(columns, '')
+    row['path'] = path
+    row['filename'] = os.path.basename(path)
+    errors = []
+    try:
+        stat = os.stat(path)
+        row['size'] = stat.st_size
+        row['modified'] = datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat()
+        if with_hash:
+            row['sha256'] = file_hash(path)
+        # An open file rather than a path, as given a path pypdf reads the whole file into memory first
+        with open(path, 'rb') as pdf_file:
+            reader = PdfReader(pdf_file, strict = False)
+            row['pdf_version'] = reader.pdf_header[len('%PDF-'):]
+            row['encrypted'] = reader.is_encrypted
+            if reader.is_encrypted:
+                # Many PDF files are encrypted with an empty password just to restrict printing or copying
+                reader.decrypt('')
+            # The page count from the root of the page tree, rather than by loading every page
+            # (indexing rather than get, as get leaves the count as an indirect object when it is stored as one)
+            pages = reader.trailer['/Root']['/Pages']
+            row['pages'] = int(pages['/Count']) if '/Count' in pages else len(reader.pages)
+            metadata = reader.metadata
+            if metadata is not None:
+                for column, attribute in (('title', 'title'), ('author', 'author'), ('subject', 'subject'), ('creator', 'creator'), ('producer', 'producer'),
+                                          ('creation_date', 'creation_date'), ('modification_date', 'modification_date')):
+                    try:
+                        row[column] = as_text(getattr(metadata, attribute))
+                    except Exception as error: # e.g. badly formed dates
+                        errors.append(f'{column}: {error}')
+                row['keywords'] = as_text(metadata.get('/Keywords'))
+            try:
+                xmp = reader.xmp_metadata
+            except Exception as error:
+                xmp = None
+                errors.append(f'XMP: {error}')
+            if xmp is not None:
+                for column, attribute in (('xmp_title', 'dc_title'), ('xmp_creator', 'dc_creator'), ('xmp_create_date', 'xmp_create_date'), ('xmp_modify_date', 'xmp_modify_date')):
+                    try:
+                        row[column] = as_text(getattr(xmp, attribute))
+                    except Exception as error:
+                        errors.append(f'{column}: {error}')
+    except Exception as error:
+        errors.append(f'{type(error).__name__}: {error}')
+    row['error'] = '; '.join(errors)
+    return row
+
+def read_metadata_with_hash(path):
+    return read_metadata(path, True)
+
+def read_metadata_without_hash(path):
+    return read_metadata(path, False)
+
+class CSVCatalogWriter:
+    def __init__(self, output_file):
+        self.writer = csv.DictWriter(output_file, fieldnames = columns)
+        self.writer.writeheader()
+
+    def write_row(self, row):
+        self.writer.writerow(row)
+
+class JSONLinesCatalogWriter:
+    # One JSON object per line, so the catalog can be read (and written) a file at a time
+    def __init__(self, output_file):
+        self.output_file = output_file
+
+    def write_row(self, row):
+        self.output_file.write(json.dumps(row, ensure_ascii = False) + '\n')
+
+def harvest(pdf_paths, writer, workers = 1, with_hash = True):
+    """
+    Reads the metadata of PDF files and writes a row for each as it is read.
+
+    Parameters:
+    pdf_paths (iterable): The paths of the PDF files.
+    writer (CSVCatalogWriter or JSONLinesCatalogWriter): Where to write the rows.
+    workers (int): The number of worker processes to use, 1 reads the files in this process.
+    with_hash (bool): Whether to include the SHA-256 hash of each file.
+
+    Returns:
+    file_count (int): The number of files read.
+    failed_count (int): The number of files with errors.
+    """
+    function = read_metadata_with_hash if with_hash else read_metadata_without_hash
+    file_count, failed_count = 0, 0
+    start = time.perf_counter()
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        rows = pool.imap_unordered(function, pdf_paths, chunksize = files_per_task) if pool is not None else map(function, pdf_paths)
+        for row in rows:
+            writer.write_row(row)
+            file_count = file_count + 1
+            failed_count = failed_count + bool(row['error'])
+            if file_count % progress_every == 0:
+                print(f'{file_count} files ({file_count / (time.perf_counter() - start):.0f} per second)', file = sys.stderr, flush = True)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return file_count, failed_count
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Write the metadata (title, author, dates, page count, size and hash) of every PDF file in folders to a catalog.')
+    parser.add_argument('folders', nargs = '+', help = 'folders to look through (including subfolders), or PDF files')
+    parser.add_argument('-o', '--output', required = True, help = 'catalog file to write, .csv for CSV, otherwise JSON lines')
+    parser.add_argument('-w', '--workers', type = int, default = os.cpu_count() or 1, help = 'number of files to read at once (default: number of processor cores)')
+    parser.add_argument('--no-hash', action = 'store_true', help = 'do not hash the files (hashing reads every byte of every file)')
+    parser.add_argument('--pattern', default = pdf_file_pattern, help = f'filename pattern of PDF files (default: {pdf_file_pattern})')
+    parsed = parser.parse_args(arguments)
+
+    start = time.perf_counter()
+    with open(parsed.output, 'w', newline = '', encoding = 'utf-8') as output_file:
+        writer = CSVCatalogWriter(output_file) if parsed.output.lower().endswith('.csv') else JSONLinesCatalogWriter(output_file)
+        file_count, failed_count = harvest(find_pdf_files(parsed.folders, parsed.pattern.lower()), writer, parsed.workers, not parsed.no_hash)
+    print(f'Catalogued {file_count} files in {time.perf_counter() - start:.1f} seconds, {failed_count} with errors (see the error column)')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
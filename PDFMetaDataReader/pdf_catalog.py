@@ -0,0 +1,325 @@
+# Persistent catalog of a PDF library in an SQLite database, keyed by the SHA-256 hash of each file's contents
+# Holds the metadata and page count of each distinct document (see harvest_metadata.py), a canonical filename made from
+# its first author, year and title (as PDFreader.py does with the author and year), and every path it is found at
+# Updates only read the files which are new or whose size or modification time has changed,
+# and renaming, linking and finding duplicate files work from the catalog alone without opening any PDF files
+# Usage:
+# python pdf_catalog.py update "C:\path\to\library"              (add new and changed files, forget removed ones)
+# python pdf_catalog.py duplicates -o duplicates.csv               (files with the same contents)
+# python pdf_catalog.py link "C:\path\to\tidy_library" --dry-run   (a link to one copy of each document, named by its canonical filename)
+# python pdf_catalog.py rename --dry-run                           (rename the files in place to their canonical filenames)
+# All take --catalog to use a catalog other than pdf_catalog.sqlite in the current folder
+
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import sys
+import time
+from multiprocessing import Pool
+
+from harvest_metadata import columns, find_pdf_files, read_metadata_with_hash, files_per_task, pdf_file_pattern
+
+catalog_filename = 'pdf_catalog.sqlite'
+commit_every = 500 # files, so an interrupted update keeps most of the files already done without committing after every file
+title_words = 6 # words of the title kept in canonical filenames
+unknown_author = 'Unknown'
+unknown_year = 'nd'
+
+document_columns = [column for column in columns if column not in ('path', 'filename', 'modified', 'sha256')]
+column_types = {'size': 'INTEGER', 'pages': 'INTEGER', 'encrypted': 'INTEGER'} # the rest are text
+
+# Canonical filenames
+
+author_separator_regex = re.compile(r';| and |&')
+filename_word_regex = re.compile(r'\w+')
+
+def first_author_surname(authors):
+    """
+    The surname of the first author, e.g. 'Smith, J.; Jones, K.' -> 'Smith', 'John Smith and Kate Jones' -> 'Smith'.
+    """
+    first_author = author_separator_regex.split(authors)[0].strip()
+    if ',' in first_author:
+        surname = first_author.split(',')[0]
+    else:
+        surname = first_author.split()[-1] if first_author.split() else ''
+    return '-'.join(filename_word_regex.findall(surname))
+
+def canonical_filename(document):
+    """
+    Makes a filename from the first author, year and start of the title of a document, e.g. Smith_2021_Antimicrobial_resistance_in_primary_care.pdf
+
+    Parameters:
+    document (dict): The metadata of the document, with the keys in columns.
+
+    Returns:
+    filename (str): The filename, using the XMP metadata where the document information has no author, date or title.
+    """
+    author = first_author_surname(document.get('author') or document.get('xmp_creator') or '') or unknown_author
+    date = document.get('creation_date') or document.get('xmp_create_date') or ''
+    year = date[:4] if date[:4].isdigit() else unknown_year
+    words = filename_word_regex.findall(document.get('title') or document.get('xmp_title') or '')[:title_words]
+    if not words:
+        # Without a title, documents by the same author in the same year are told apart by their hash
+        words = [document['sha256'][:8]] if document.get('sha256') else []
+    return '_'.join([author, year] + words) + '.pdf'
+
+# Catalog
+
+class PDFCatalog:
+    """
+    An SQLite database with a row for each distinct document (by content hash) and for each file path.
+    """
+    def __init__(self, catalog_path):
+        self.connection = sqlite3.connect(catalog_path)
+        self.connection.executescript(f'''
+            CREATE TABLE IF NOT EXISTS documents (sha256 TEXT PRIMARY KEY, {", ".join(column + " " + column_types.get(column, "TEXT") for column in document_columns)}, canonical_filename TEXT);
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, sha256 TEXT, size INTEGER, mtime_ns INTEGER);
+            CREATE INDEX IF NOT EXISTS files_by_hash ON files (sha256);
+        ''')
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, folders, workers = 1, pattern = pdf_file_pattern):
+        """
+        Brings the catalog up to date with the PDF files in folders, only reading files which are new or have changed.
+        Files catalogued under these folders which are no longer there are removed, and documents with no files left are forgotten.
+
+        Parameters:
+        folders (list): The folders to look through (including subfolders).
+        workers (int): The number of files to read at once.
+        pattern (str): The filename pattern of PDF files.
+
+        Returns:
+        counts (dict): The number of files found, read (new or changed), removed and with errors.
+        """
+        catalogued = {path: (size, mtime_ns) for path, size, mtime_ns in self.connection.execute('SELECT path, size, mtime_ns FROM files')}
+        stats = {}
+        for path in find_pdf_files([os.path.abspath(folder) for folder in folders], pattern):
+            try:
+                stats[path] = os.stat(path)
+            except FileNotFoundError:
+                # Removed (or moved) since the folder was listed, so treated as if it had never been found
+                continue
+        changed_paths = [path for path, stat in stats.items() if catalogued.get(path) != (stat.st_size, stat.st_mtime_ns)]
+        prefixes = tuple(os.path.join(os.path.abspath(folder), '') for folder in folders)
+        removed_paths = [path for path in catalogued if path not in stats and (path.startswith(prefixes) or path in map(os.path.abspath, folders))]
+        counts = {'found': len(stats), 'read': 0, 'removed': len(removed_paths), 'errors': 0}
+        with self.connection:
+            self.connection.executemany('DELETE FROM files WHERE path = ?', ((path,) for path in removed_paths))
+
+        pool = Pool(workers) if workers > 1 and changed_paths else None
+        try:
+            rows = pool.imap_unordered(read_metadata_with_hash, changed_paths, chunksize = files_per_task) if pool is not None else map(read_metadata_with_hash, changed_paths)
+            for row in rows:
+                if not row['sha256']:
+                    # Could not even be read, so try again next time
+                    counts['errors'] = counts['errors'] + 1
+                    continue
+                counts['errors'] = counts['errors'] + bool(row['error'])
+                self.add_file(row, stats[row['path']])
+                counts['read'] = counts['read'] + 1
+                if counts['read'] % commit_every == 0:
+                    self.connection.commit()
+        finally:
+            if pool is not None:
+                pool.terminate()
+            self.connection.commit()
+        with self.connection:
+            self.connection.execute('DELETE FROM documents WHERE sha256 NOT IN (SELECT sha256 FROM files)')
+        return counts
+
+    def add_file(self, row, stat):
+        # The same contents always give the same metadata, so a document already catalogued from another copy is kept as it is
+        self.connection.execute(f'INSERT OR IGNORE INTO documents (sha256, {", ".join(document_columns)}, canonical_filename) '
+                                f'VALUES ({", ".join("?" * (len(document_columns) + 2))})',
+                                [row['sha256']] + [row[column] if row[column] != '' else None for column in document_columns] + [canonical_filename(row)])
+        self.connection.execute('INSERT OR REPLACE INTO files (path, sha256, size, mtime_ns) VALUES (?, ?, ?, ?)',
+                                (row['path'], row['sha256'], stat.st_size, stat.st_mtime_ns))
+
+    def duplicates(self):
+        """
+        Returns:
+        duplicates (list): (sha256, canonical_filename, paths) for each document found at more than one path.
+        """
+        groups = {}
+        for sha256, path in self.connection.execute('SELECT sha256, path FROM files WHERE sha256 IN '
+                                                    '(SELECT sha256 FROM files GROUP BY sha256 HAVING COUNT(*) > 1) ORDER BY sha256, path'):
+            groups.setdefault(sha256, []).append(path)
+        names = self.canonical_filenames(groups)
+        return [(sha256, names[sha256], paths) for sha256, paths in groups.items()]
+
+    def find(self, sha256):
+        """
+        Returns:
+        paths (list): The paths of the files with this content hash.
+        """
+        return [path for (path,) in self.connection.execute('SELECT path FROM files WHERE sha256 = ? ORDER BY path', (sha256,))]
+
+    def canonical_filenames(self, hashes = None):
+        """
+        Returns:
+        names (dict): The canonical filename of each document (or of each of hashes), with the start of the hash added
+                      where different documents would otherwise have the same name.
+        """
+        names = {}
+        documents_by_name = {}
+        for sha256, name in self.connection.execute('SELECT sha256, canonical_filename FROM documents'):
+            names[sha256] = name
+            documents_by_name.setdefault(name.lower(), []).append(sha256)
+        for clashing in documents_by_name.values():
+            if len(clashing) > 1:
+                for sha256 in clashing:
+                    stem, extension = os.path.splitext(names[sha256])
+                    names[sha256] = f'{stem}_{sha256[:8]}{extension}'
+        return names if hashes is None else {sha256: names[sha256] for sha256 in hashes}
+
+    def plan_links(self, target_folder):
+        """
+        Plans a link in target_folder to one copy of each document, named by its canonical filename.
+
+        Returns:
+        links (list): (existing path, link path) pairs.
+        """
+        names = self.canonical_filenames()
+        links = []
+        for sha256, path in self.connection.execute('SELECT sha256, MIN(path) FROM files GROUP BY sha256 ORDER BY sha256'):
+            links.append((path, os.path.join(target_folder, names[sha256])))
+        return links
+
+    def plan_renames(self):
+        """
+        Plans renaming every file in its own folder to its canonical filename. Copies of a document in the same folder are numbered.
+
+        Returns:
+        renames (list): (old path, new path) pairs, leaving out files which already have their canonical filename.
+        """
+        names = self.canonical_filenames()
+        taken = {}
+        renames = []
+        for path, sha256 in self.connection.execute('SELECT path, sha256 FROM files ORDER BY path'):
+            folder = os.path.dirname(path)
+            stem, extension = os.path.splitext(names[sha256])
+            new_path = os.path.join(folder, names[sha256])
+            copy_number = 1
+            while taken.get(new_path.lower(), path) != path:
+                copy_number = copy_number + 1
+                new_path = os.path.join(folder, f'{stem}_{copy_number}{extension}')
+            taken[new_path.lower()] = path
+            if new_path != path:
+                renames.append((path, new_path))
+        return renames
+
+    def rename(self, renames):
+        """
+        Renames files as planned by plan_renames, updating the catalog to match.
+        Files are moved aside to temporary names first, so that files swapping names do not overwrite each other.
+
+        Returns:
+        failed (list): (old path, new path, error) for the renames which could not be done.
+        """
+        failed = []
+        moved = []
+        for old_path, new_path in renames:
+            temporary_path = old_path + '.renaming'
+            try:
+                os.rename(old_path, temporary_path)
+                moved.append((old_path, temporary_path, new_path))
+            except OSError as error:
+                failed.append((old_path, new_path, str(error)))
+        for old_path, temporary_path, new_path in moved:
+            if os.path.exists(new_path):
+                os.rename(temporary_path, old_path)
+                failed.append((old_path, new_path, 'a file with the new name already exists'))
+                continue
+            os.rename(temporary_path, new_path)
+            with self.connection:
+                self.connection.execute('UPDATE files SET path = ? WHERE path = ?', (new_path, old_path))
+        return failed
+
+def link_files(links):
+    """
+    Makes links as planned by plan_links, hard links where possible (they look like ordinary files) and symbolic links otherwise.
+
+    Returns:
+    failed (list): (existing path, link path, error) for the links which could not be made.
+    """
+    failed = []
+    for path, link_path in links:
+        os.makedirs(os.path.dirname(link_path), exist_ok = True)
+        if os.path.lexists(link_path):
+            failed.append((path, link_path, 'already exists'))
+            continue
+        try:
+            os.link(path, link_path)
+        except OSError:
+            try:
+                os.symlink(path, link_path)
+            except OSError as error:
+                failed.append((path, link_path, str(error)))
+    return failed
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Keep a catalog of a PDF library by content hash, find duplicate files and rename or link files by author, year and title.')
+    parser.add_argument('--catalog', default = catalog_filename, help = f'the catalog database (default: {catalog_filename})')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    update_parser = commands.add_parser('update', help = 'add new and changed PDF files in folders to the catalog')
+    update_parser.add_argument('folders', nargs = '+')
+    update_parser.add_argument('-w', '--workers', type = int, default = os.cpu_count() or 1, help = 'number of files to read at once (default: number of processor cores)')
+    update_parser.add_argument('--pattern', default = pdf_file_pattern, help = f'filename pattern of PDF files (default: {pdf_file_pattern})')
+    duplicates_parser = commands.add_parser('duplicates', help = 'list files with the same contents')
+    duplicates_parser.add_argument('-o', '--output', help = 'CSV file to write the duplicates to (default: print them)')
+    link_parser = commands.add_parser('link', help = 'link one copy of each document into a folder under its canonical filename')
+    link_parser.add_argument('target_folder')
+    link_parser.add_argument('--dry-run', action = 'store_true', help = 'only print the links which would be made')
+    rename_parser = commands.add_parser('rename', help = 'rename the files in place to their canonical filenames')
+    rename_parser.add_argument('--dry-run', action = 'store_true', help = 'only print the renames which would be done')
+    parsed = parser.parse_args(arguments)
+    if parsed.command == 'update':
+        for folder in parsed.folders:
+            # Otherwise every file catalogued under a mistyped (or unplugged) folder would be removed from the catalog
+            if not os.path.isdir(folder) and not os.path.isfile(folder):
+                parser.error(f'{folder} does not exist')
+
+    catalog = PDFCatalog(parsed.catalog)
+    try:
+        if parsed.command == 'update':
+            start = time.perf_counter()
+            counts = catalog.update(parsed.folders, parsed.workers, parsed.pattern.lower())
+            print(f'Found {counts["found"]} files, read {counts["read"]} new or changed files and removed {counts["removed"]} '
+                  f'in {time.perf_counter() - start:.1f} seconds ({counts["errors"]} with errors)')
+        elif parsed.command == 'duplicates':
+            duplicates = catalog.duplicates()
+            if parsed.output is not None:
+                with open(parsed.output, 'w', newline = '', encoding = 'utf-8') as output_file:
+                    csv_writer = csv.writer(output_file)
+                    csv_writer.writerow(['sha256', 'canonical_filename', 'path'])
+                    csv_writer.writerows([sha256, name, path] for sha256, name, paths in duplicates for path in paths)
+            else:
+                for sha256, name, paths in duplicates:
+                    print(name)
+                    for path in paths:
+                        print('    ' + path)
+            print(f'{len(duplicates)} documents have more than one copy ({sum(len(paths) - 1 for sha256, name, paths in duplicates)} extra files)')
+        elif parsed.command == 'link':
+            links = catalog.plan_links(parsed.target_folder)
+            failed = [] if parsed.dry_run else link_files(links)
+            for path, link_path in links:
+                print(f'{path} -> {link_path}')
+            for path, link_path, error in failed:
+                print(f'Could not link {path} to {link_path}: {error}')
+        elif parsed.command == 'rename':
+            renames = catalog.plan_renames()
+            failed = [] if parsed.dry_run else catalog.rename(renames)
+            for old_path, new_path in renames:
+                print(f'{old_path} -> {new_path}')
+            for old_path, new_path, error in failed:
+                print(f'Could not rename {old_path} to {new_path}: {error}')
+    finally:
+        catalog.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
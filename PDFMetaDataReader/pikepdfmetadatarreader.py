@@ -1,11 +1,16 @@
+import sys
 import pikepdf
 
-#Open PDF with pikepdf
-pdf = pikepdf.Pdf.open('webpage.pdf')
+# Prints the metadata of each PDF file given, e.g. python pikepdfmetadatarreader.py webpage.pdf
+for filename in sys.argv[1:]:
+    print(filename)
 
-#Extract metadata from PDF
-pdf_info = pdf.docinfo
+    #Open PDF with pikepdf
+    with pikepdf.Pdf.open(filename) as pdf:
 
-#Print out the metadata
-for key, value in pdf_info.items():
-    print(key, ':', value)
+        #Extract metadata from PDF
+        pdf_info = pdf.docinfo
+
+        #Print out the metadata
+        for key, value in pdf_info.items():
+            print(key, ':', value)
@@ -0,0 +1,195 @@
+# Grammar based fuzzer for the Ovid line parser in bib_converter_run.py
+# Generates random Ovid lines (search terms with wildcards and quotes, and/or/adjN, brackets, field lists, line numbers,
+# record counts, subject headings and combinations of earlier lines), some of them broken on purpose, and reports:
+# - exceptions other than ParseError from Phrase (lines which cannot be parsed should raise ParseError)
+# - exceptions other than ExportError from exporting parsed lines to each database (ExportError is raised for searches a database has no equivalent for)
+# - lines whose time grows faster than linearly when they are repeated (joined with or) or nested in more brackets
+# Findings are written to a JSON file with the seed, so they can be reproduced with --seed
+# Usage:
+# python fuzz_parser.py                        (1000 lines, random seed)
+# python fuzz_parser.py --lines 20000 --seed 7
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import traceback
+
+benchmarks_folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_folder)) # bib_converter
+from bib_converter_run import Phrase, ParseError, ExportError, TranslationContext, target_databases, field_mappings_from_ovid, max_bracket_depth
+
+default_lines = 1000
+default_output = 'fuzz_findings.json'
+max_depth = 4 # of brackets in generated lines
+broken_fraction = 0.2 # of generated lines which are broken on purpose (brackets or quotes removed or added)
+scaling_checks = 20 # the slowest lines for their length are checked for super-linear time
+scaling_factors = (1, 2, 4, 8)
+max_scaling_exponent = 1.5 # a little above linear to allow for timing noise on small lines
+
+words = ('cancer', 'tumo?r', 'neoplas*', 'child*', 'infan$', 'p#ediatric', 'group A', 'strep*', 'vaccin*', 'immuni#ation', 'screen$3',
+         'covid-19', 'sars-cov-2', 'health care', 'o\'brien', 'and/or', '37 weeks', 'x', '2021')
+subject_headings = ('Neoplasms', 'Streptococcus pyogenes', 'Mass Screening', 'Vaccination Hesitancy', 'Influenza, Human')
+
+def random_term(generator):
+    if generator.random() < 0.25:
+        return '"' + ' '.join(generator.choice(words) for i in range(generator.randint(1, 3))) + '"'
+    return ' '.join(generator.choice(words) for i in range(generator.randint(1, 2)))
+
+def random_operator(generator):
+    return generator.choice(('and', 'or', 'or', f'adj{generator.randint(1, 10)}', 'adj', 'not'))
+
+def random_condition(generator, depth = 0):
+    # condition := term | condition operator condition | (condition)
+    choice = generator.random()
+    if depth < max_depth and choice < 0.25:
+        return '(' + random_condition(generator, depth + 1) + ')'
+    if depth < max_depth and choice < 0.6:
+        parts = [random_condition(generator, depth + 1)]
+        for i in range(generator.randint(1, 4)):
+            parts.extend([random_operator(generator), random_condition(generator, depth + 1)])
+        return ' '.join(parts)
+    return random_term(generator)
+
+def random_fields(generator):
+    fields = generator.sample(list(field_mappings_from_ovid) + ['sh', 'pt', 'xx'], generator.randint(1, 3))
+    return '.' + ','.join(fields) + generator.choice(('.', ''))
+
+def random_line(generator, line_number):
+    """
+    Returns:
+    line (str): A random Ovid line, possibly with its line number and record count.
+    condition (str): The search string in the line, None for subject headings and combinations of earlier lines.
+    """
+    condition = None
+    kind = generator.random()
+    if kind < 0.1:
+        body = generator.choice(('exp ', '', '*', 'exp *')) + generator.choice(subject_headings) + '/'
+    elif kind < 0.2:
+        if generator.random() < 0.5:
+            body = f'{generator.choice(("or", "and"))}/1-{max(line_number - 1, 2)}'
+        else:
+            body = f' {random_operator(generator)} '.join(str(generator.randint(1, max(line_number, 2))) for i in range(generator.randint(2, 5)))
+    else:
+        condition = random_condition(generator)
+        body = condition + random_fields(generator) if generator.random() < 0.7 else condition
+    if generator.random() < broken_fraction:
+        body = break_line(generator, body)
+    prefix = generator.choice((f'{line_number}     ', f'{line_number}. ', ''))
+    suffix = generator.choice((f' ({generator.randint(0, 999999)})', ''))
+    return prefix + body + suffix, condition
+
+def break_line(generator, body):
+    # Removes or adds a bracket or quote somewhere
+    position = generator.randint(0, len(body))
+    if generator.random() < 0.5:
+        return body[:position] + generator.choice('()"') + body[position:]
+    removable = [index for index, character in enumerate(body) if character in '()"']
+    if not removable:
+        return body + ')'
+    index = generator.choice(removable)
+    return body[:index] + body[index + 1:]
+
+def check_line(line):
+    """
+    Parses a line and exports it to every database.
+
+    Returns:
+    seconds (float): The time taken.
+    problems (list): Descriptions of any unexpected exceptions (not ParseError or ExportError, which are expected for bad or unsupported lines).
+    """
+    problems = []
+    start = time.perf_counter()
+    try:
+        phrase = Phrase(line)
+    except ParseError:
+        return time.perf_counter() - start, problems
+    except Exception:
+        return time.perf_counter() - start, ['parse: ' + traceback.format_exc(limit = -3)]
+    for to_database in target_databases:
+        try:
+            phrase.export(to_database, TranslationContext())
+        except ExportError:
+            continue # a search the database has no equivalent for, reported to the user rather than a defect
+        except Exception:
+            problems.append(f'export to {to_database}: ' + traceback.format_exc(limit = -3))
+    return time.perf_counter() - start, problems
+
+def scaling_exponent(make_line, factors = scaling_factors, repeats = 3):
+    """
+    Times lines made bigger by each factor.
+
+    Returns:
+    exponent (float): How fast the time grows with the factor (1 is linear, 2 quadratic), or None if too fast to time.
+    """
+    seconds = []
+    for factor in factors:
+        line = make_line(factor)
+        seconds.append(min(check_line(line)[0] for repeat in range(repeats)))
+    if seconds[0] <= 0:
+        return None
+    return math.log(seconds[-1] / seconds[0]) / math.log(factors[-1] / factors[0])
+
+def check_scaling(condition):
+    """
+    Checks whether a search string takes more than linear time as it is repeated or nested.
+
+    Returns:
+    exponents (dict): The growth exponent for repeating the string (joined with or) and for nesting it in brackets.
+    """
+    return {
+        'repeated': scaling_exponent(lambda factor: ' or '.join(['(' + condition + ')'] * factor * 20) + '.tw.'),
+        'nested': scaling_exponent(lambda factor: '(' * (factor * (max_bracket_depth // 10)) + condition
+                                   + ' or x)' * (factor * (max_bracket_depth // 10)) + '.tw.'),
+    }
+
+def fuzz(line_count, seed):
+    """
+    Returns:
+    findings (list): The lines with unexpected exceptions or super-linear time, with what was found.
+    """
+    generator = random.Random(seed)
+    findings = []
+    timed_lines = []
+    for line_number in range(1, line_count + 1):
+        line, condition = random_line(generator, line_number)
+        seconds, problems = check_line(line)
+        if problems:
+            findings.append({'line': line, 'problems': problems})
+        if condition is not None:
+            timed_lines.append((seconds / len(line), line, condition))
+    # The slowest lines for their length are the most likely to hide super-linear behaviour
+    for seconds_per_character, line, condition in sorted(timed_lines, reverse = True)[:scaling_checks]:
+        exponents = check_scaling(condition)
+        slow = [f'time grows with size to the power {exponent:.2f} when {name}'
+                for name, exponent in exponents.items() if exponent is not None and exponent > max_scaling_exponent]
+        if slow:
+            findings.append({'line': line, 'problems': slow})
+    return findings
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Fuzz the Ovid line parser of bib_converter_run.py with generated lines.')
+    parser.add_argument('--lines', type = int, default = default_lines, help = f'number of lines to generate (default: {default_lines})')
+    parser.add_argument('--seed', type = int, help = 'random seed, to repeat an earlier run (default: random)')
+    parser.add_argument('-o', '--output', default = os.path.join(benchmarks_folder, default_output), help = 'JSON file to write any findings to')
+    parsed = parser.parse_args(arguments)
+    seed = parsed.seed if parsed.seed is not None else random.randrange(2 ** 32)
+
+    start = time.perf_counter()
+    findings = fuzz(parsed.lines, seed)
+    print(f'Checked {parsed.lines} lines (seed {seed}) in {time.perf_counter() - start:.1f} seconds, {len(findings)} findings')
+    if findings:
+        with open(parsed.output, 'w', encoding = 'utf-8') as output_file:
+            json.dump({'seed': seed, 'lines': parsed.lines, 'findings': findings}, output_file, indent = 1)
+        for finding in findings[:10]:
+            print(finding['line'])
+            for problem in finding['problems']:
+                print('    ' + problem.strip().replace('\n', '\n    '))
+        print(f'All findings written to {parsed.output}')
+    return 1 if findings else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
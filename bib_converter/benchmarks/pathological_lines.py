@@ -0,0 +1,30 @@
+# Generators of unusually large or awkward Ovid lines for benchmarking and fuzzing bib_converter_run.py
+# Each takes a size and returns a line, so the time taken can be compared across sizes to find parts of
+# the parser or exports which take more than linear time as lines get longer
+
+def deep_nesting(size):
+    # (((a or b) or b) or b) ... with size levels of brackets
+    return '1     ' + '(' * size + 'tumo?r*' + ' or cancer)' * size + '.tw,kf.'
+
+def many_quotes(size):
+    # "phrase 0 words" or "phrase 1 words" ...
+    return '2     (' + ' or '.join(f'"phrase {i} word?"' for i in range(size)) + ').tw.'
+
+def long_or_list(size):
+    # A long list of alternatives, as when searching for many drug or place names
+    return '3     (' + ' or '.join(f'term{i}*' for i in range(size)) + ').ti,ab.'
+
+def many_adj(size):
+    # word0 adj1 word1 adj2 word2 ...
+    return '4     (' + ' '.join(f'word{i} adj{i % 9 + 1}' for i in range(size)) + ' final).tw.'
+
+def long_numbered_combination(size):
+    # A line combining many earlier lines
+    return f'5     or/1-{size}'
+
+generators = {'deep_nesting': deep_nesting, 'many_quotes': many_quotes, 'long_or_list': long_or_list, 'many_adj': many_adj,
+              'long_numbered_combination': long_numbered_combination}
+
+# The sizes each generator is timed at, each double the last, deep_nesting is kept within the parser's bracket limit
+scaling_sizes = {'deep_nesting': (12, 24, 48, 96)}
+default_scaling_sizes = (250, 500, 1000, 2000)
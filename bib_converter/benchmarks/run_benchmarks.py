@@ -0,0 +1,184 @@
+# Benchmarks for bib_converter_run.py
+# Times parsing and exporting each line of the strategies in the strategies folder (realistic Ovid MEDLINE strategies)
+# to each database, and checks that generated pathological lines (see pathological_lines.py) take time in proportion to their length
+# Compares with a stored baseline so parser changes can be checked for slow-downs
+# Usage:
+# python run_benchmarks.py --save-baseline     (before making a change)
+# python run_benchmarks.py                     (after, compares with the baseline and exits with 1 if anything got slower or grew faster than linearly)
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+benchmarks_folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_folder)) # bib_converter
+from bib_converter_run import parse_line, export_line, target_databases
+from pathological_lines import generators, scaling_sizes, default_scaling_sizes
+
+strategies_foldername = 'strategies'
+baseline_filename = 'baseline.json'
+default_repeats = 5 # each line is timed this many times and the fastest time kept
+default_tolerance = 0.2 # slow-downs of more than this fraction compared with the baseline are reported as regressions
+max_scaling_exponent = 1.3 # time growing faster than size to this power is reported as super-linear (1 is linear, 2 quadratic)
+
+def read_strategies(folder):
+    lines = []
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith('.txt'):
+            with open(os.path.join(folder, filename), 'r', encoding = 'utf-8') as strategy_file:
+                lines.extend(line for line in strategy_file.readlines() if line.strip())
+    return lines
+
+def fastest(function, repeats):
+    """
+    Returns:
+    seconds (float): The fastest time of repeats calls of the function.
+    result: The result of the last call.
+    """
+    seconds = None
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    return seconds, result
+
+def time_line(line, repeats):
+    """
+    Times parsing a line and exporting it to each database.
+
+    Returns:
+    parse_seconds (float): The time to parse the line.
+    export_seconds (dict): The time to export the line to each database, missing for lines which could not be parsed.
+    failures (list): The databases the line could not be exported to, or ['parse'] if it could not be parsed.
+    """
+    parse_seconds, (phrase, warningline) = fastest(lambda: parse_line(line), repeats)
+    if phrase is None:
+        return parse_seconds, {}, ['parse']
+    export_seconds = {}
+    failures = []
+    for to_database in target_databases:
+        export_seconds[to_database], (output, warningline) = fastest(lambda: export_line(line, phrase, to_database), repeats)
+        if output.startswith('Could not export'):
+            failures.append(to_database)
+    return parse_seconds, export_seconds, failures
+
+def summarise(seconds):
+    # Nearest-rank percentiles of the sorted times
+    ordered = sorted(seconds)
+    return {'p50_ms': ordered[math.ceil(0.5 * len(ordered)) - 1] * 1000, 'p95_ms': ordered[math.ceil(0.95 * len(ordered)) - 1] * 1000, 'max_ms': ordered[-1] * 1000}
+
+def benchmark_strategies(lines, repeats):
+    """
+    Returns:
+    measurements (dict): Parse and per database export latency percentiles over the lines, plus the lines which failed.
+    """
+    parse_times = []
+    export_times = {to_database: [] for to_database in target_databases}
+    failures = []
+    for line in lines:
+        parse_seconds, export_seconds, line_failures = time_line(line, repeats)
+        parse_times.append(parse_seconds)
+        for to_database, seconds in export_seconds.items():
+            export_times[to_database].append(seconds)
+        failures.extend(f'{failure}: {line.strip()}' for failure in line_failures)
+    measurements = {'parse': summarise(parse_times)}
+    for to_database in target_databases:
+        measurements['export_' + to_database] = summarise(export_times[to_database])
+    return {'lines': len(lines), 'latency': measurements, 'failures': failures}
+
+def benchmark_scaling(repeats):
+    """
+    Times each pathological line generator at doubling sizes.
+
+    Returns:
+    scaling (dict): For each generator, the seconds to parse and export to every database at each size,
+                    and the exponent of the growth in time from the smallest to the largest size (1 is linear).
+    """
+    scaling = {}
+    for name, generator in generators.items():
+        sizes = scaling_sizes.get(name, default_scaling_sizes)
+        seconds = []
+        for size in sizes:
+            line = generator(size)
+            line_seconds, result = fastest(lambda: time_line(line, 1), repeats)
+            seconds.append(line_seconds)
+        exponent = math.log(seconds[-1] / seconds[0]) / math.log(sizes[-1] / sizes[0]) if seconds[0] > 0 else None
+        scaling[name] = {'sizes': list(sizes), 'seconds': seconds, 'exponent': exponent, 'failures': time_line(generator(sizes[-1]), 1)[2]}
+    return scaling
+
+def compare(results, baseline, tolerance):
+    """
+    Compares latencies with a baseline, printing the change for each.
+
+    Returns:
+    regressions (list): The names of the latencies which were slower than the baseline by more than tolerance.
+    """
+    regressions = []
+    print('\nLatency per line, changes are against the baseline, positive is faster')
+    print(f'{"":20} {"p50 ms":>9} {"change":>8} {"p95 ms":>9} {"change":>8}')
+    for name, latency in results['strategies']['latency'].items():
+        previous = baseline.get('strategies', {}).get('latency', {}).get(name)
+        changes = []
+        for key in ('p50_ms', 'p95_ms'):
+            changes.append(1 - latency[key] / previous[key] if previous and previous.get(key) else None)
+        show = [f'{change:+8.1%}' if change is not None else f'{"-":>8}' for change in changes]
+        print(f'{name:20} {latency["p50_ms"]:9.3f} {show[0]} {latency["p95_ms"]:9.3f} {show[1]}')
+        if any(change is not None and change < -tolerance for change in changes):
+            regressions.append(name)
+    return regressions
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark bib_converter_run.py on realistic and pathological Ovid lines and compare with a baseline.')
+    parser.add_argument('--strategies', default = os.path.join(benchmarks_folder, strategies_foldername), help = 'folder of strategy text files to time')
+    parser.add_argument('--repeats', type = int, default = default_repeats, help = f'times to run each line, the fastest is kept (default: {default_repeats})')
+    parser.add_argument('--no-scaling', action = 'store_true', help = 'skip timing the pathological lines')
+    parser.add_argument('--baseline', default = os.path.join(benchmarks_folder, baseline_filename), help = 'baseline results file')
+    parser.add_argument('--save-baseline', action = 'store_true', help = 'save these results as the baseline instead of comparing with it')
+    parser.add_argument('--tolerance', type = float, default = default_tolerance, help = f'fraction slower than the baseline counted as a regression (default: {default_tolerance})')
+    parser.add_argument('-o', '--output', help = 'also write the results to this JSON file')
+    parsed = parser.parse_args(arguments)
+    repeats = max(parsed.repeats, 1)
+
+    lines = read_strategies(parsed.strategies)
+    print(f'Timing {len(lines)} strategy lines', flush = True)
+    results = {'python': sys.version.split()[0], 'strategies': benchmark_strategies(lines, repeats)}
+    super_linear = []
+    if not parsed.no_scaling:
+        print('Timing pathological lines', flush = True)
+        results['scaling'] = benchmark_scaling(repeats)
+        print(f'\n{"generator":28} {"sizes":>20} {"largest ms":>11} {"exponent":>9}')
+        for name, scaling in results['scaling'].items():
+            exponent = scaling['exponent']
+            print(f'{name:28} {str(scaling["sizes"][0]) + "-" + str(scaling["sizes"][-1]):>20} {scaling["seconds"][-1] * 1000:11.2f} '
+                  f'{exponent if exponent is not None else float("nan"):9.2f}')
+            if exponent is not None and exponent > max_scaling_exponent:
+                super_linear.append(name)
+
+    if parsed.output is not None:
+        with open(parsed.output, 'w', encoding = 'utf-8') as output_file:
+            json.dump(results, output_file, indent = 1)
+    baseline = {}
+    if not parsed.save_baseline and os.path.exists(parsed.baseline):
+        with open(parsed.baseline, 'r', encoding = 'utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, parsed.tolerance)
+    if parsed.save_baseline:
+        with open(parsed.baseline, 'w', encoding = 'utf-8') as baseline_file:
+            json.dump(results, baseline_file, indent = 1)
+        print(f'\nSaved baseline to {parsed.baseline}')
+    elif not baseline:
+        print(f'\nNo baseline at {parsed.baseline} to compare with, run with --save-baseline first')
+    for failure in results['strategies']['failures']:
+        print(f'Could not translate ({failure})')
+    for name in super_linear:
+        print(f'{name}: time grows with size to the power {results["scaling"][name]["exponent"]:.2f}, more than {max_scaling_exponent}')
+    for name in regressions:
+        print(f'{name}: slower than the baseline by more than {parsed.tolerance:.0%}')
+    return 1 if super_linear or regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
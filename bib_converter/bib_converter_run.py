@@ -4,7 +4,9 @@
 # Ask classes to emit translations at their level
 # Each object can be initialised with an Ovid string (to be refactored later)
 # and has an export method taking the target database name 
-# Hold warnings for each line in a global variable to be emitted alongside the outputs
+# Search strings are split into tokens and parsed in a single pass (see FieldConditionParser)
+# Warnings for each line are collected in a TranslationContext passed down through the exports, to be emitted alongside the outputs
+# (nothing is shared between translations, so lines can be translated on several threads at once, see translation_service.py)
 # Command line operation, takes a plain text file with a search strategy and a output type
 # Outputs a file with an attempted translation and another file of generated warnings
 
@@ -13,7 +15,10 @@
 # Rejects solo 'adj' from Ovid as this is a null operator
 # Currently doesn't support multiple field search conditions
 
+import csv
+import os
 import re
+from functools import lru_cache
 
 # User customisable parameters
 
@@ -54,35 +59,120 @@ optionals = {'EBSCO': '#', 'Cochrane': '?', 'WoS': '$', 'Scopus': '*', 'Proquest
 mandatories = {'EBSCO': '?', 'Cochrane': '?', #Warning for Cochrane
                 'WoS': '?', 'Scopus': '?', 'Proquest': '?' }
 
-
-operator_regex = r'[^"]*?(?:[^"]*["][^"]*["][^"]*)*?\s(and|or|adj\d+)\s' #Operator must be preceded by an even number of quotes
-# Use re.match instead of re.search to force starting at the start of the string
+max_inlined_query_length = 100000 # characters, lines referring to earlier lines are left numbered rather than written out longer than this
+untranslated_placeholders = ('<WILDCARD ERROR>', 'Unmapped subject heading ', 'Could not export: ', 'Could not parse: ') # written in place of what could not be translated
+translation_cache_size = 100000 # parsed lines and (line, database) translations kept, strategies adapted from each other share many lines
+
+
+# Translation tables
+# The mappings above are looked up once per database and kept in a TranslationTable, rather than for every term and field translated
+# Call build_translation_tables() after changing the mappings while running
+
+class TranslationTable:
+    # Everything needed to translate to one database
+    def __init__(self, to_database):
+        self.to_database = to_database
+        self.fields = {field_item: mappings[to_database] for field_item, mappings in field_mappings_from_ovid.items() if to_database in mappings}
+        self.combine_fields = field_combine_functions[to_database]
+        self.query_reference = query_mapping[to_database]
+        self.adj = adj_mapping[to_database]
+        if to_database in optionals:
+            # Ovid ? (optional character) and # (mandatory character) to this database's wildcards, swapped in one pass with str.translate
+            self.wildcards = str.maketrans({'?': optionals[to_database], '#': mandatories[to_database]})
+        else:
+            self.wildcards = None # wildcards are not supported
+
+def build_translation_tables():
+    global translation_tables
+    translation_tables = {to_database: TranslationTable(to_database) for to_database in adj_mapping}
+    if 'translate_line' in globals():
+        # Translations made with the old mappings
+        translate_line.cache_clear()
+
+build_translation_tables()
+
+
+# Tokenizer and parser for Ovid search strings (the part of a line before any field list)
+# Operators are only recognised in lower case, outside quotes and separated from terms by spaces or brackets
+# Precedence (tightest first): adjN, and, or - brackets override it
+# Each token is read once and the tree is built as the tokens are read, so parsing takes time in proportion to the length of the line
+
+token_regex = re.compile(r'\s*(?:(?P<open>\()|(?P<close>\))|(?P<quoted>"[^"]*")|(?P<unquoted>[^\s()"]+)|(?P<unmatchedquote>"))')
+operator_regex = re.compile(r'(and|or|adj\d+)$')
+operator_name_regex = re.compile(r'\d+$') # adj5 -> adj
+operator_precedence = {'or': 1, 'and': 2, 'adj': 3}
+highest_precedence = max(operator_precedence.values())
+max_bracket_depth = 100 # brackets nested deeper than this are reported rather than parsed, as each level of brackets is parsed (and exported) by recursing
+
+class ParseError(ValueError):
+    # Raised for search strings which cannot be parsed, with the position (from 0) of the problem in the line
+    def __init__(self, message, position):
+        super().__init__(f'{message} at character {position + 1}')
+        self.position = position
+
+class ExportError(ValueError):
+    # Raised for searches which parse but have no equivalent in the database being exported to, after warning why
+    pass
+
+def tokenize(input_string, offset = 0):
+    """
+    Splits an Ovid search string into tokens.
+
+    Parameters:
+    input_string (str): The search string.
+    offset (int): The position of input_string in the line, added to the token positions for error messages.
+
+    Returns:
+    tokens (list): (kind, text, start, end) tuples, kind is open, close, operator or term (quoted or unquoted text, which may contain wildcards).
+    """
+    tokens = []
+    position = 0
+    while position < len(input_string):
+        match = token_regex.match(input_string, position)
+        if match is None:
+            break # only whitespace left
+        kind = match.lastgroup
+        start, end = match.start(kind), match.end(kind)
+        if kind == 'unmatchedquote':
+            raise ParseError('Unmatched quote', start + offset)
+        if kind == 'unquoted' and operator_regex.match(match.group(kind)):
+            kind = 'operator'
+        elif kind in ('quoted', 'unquoted'):
+            kind = 'term'
+        tokens.append((kind, match.group(match.lastgroup), start + offset, end + offset))
+        position = end
+    return tokens
 
 
 # Class hierarchy (bottom up)
 
+class TranslationContext:
+    # What is collected while translating one line to one database
+    def __init__(self):
+        self.warnings = []
+    def warn(self, message):
+        self.warnings.append(message)
+
+
 class StringCondition:
     def __init__(self, input_string, from_database = 'Ovid'):
         self.input_string = input_string
-        self.parsed_string = re.sub(f'\?', '<OPTIONAL>', self.input_string)
-        self.parsed_string = re.sub(f'#', '<MANDATORY>', self.parsed_string)
+        self.has_optional = '?' in input_string
+        self.has_mandatory = '#' in input_string
         if self.input_string[0] == '"':
             self.quoted = True
         else:
             self.quoted = False
-    def export(self, to_database):
-        global warnings
-        if to_database == 'PubMed' and re.findall(f'<', self.parsed_string):
-            warnings = warnings.append('Wildcards could not be mapped as unsupported in PubMed for string ' + self.input_string)
+    def export(self, to_database, context = None):
+        context = context if context is not None else TranslationContext()
+        wildcards = translation_tables[to_database].wildcards
+        if wildcards is None and (self.has_optional or self.has_mandatory):
+            context.warn('Wildcards could not be mapped as unsupported in ' + to_database + ' for string ' + self.input_string)
             return '<WILDCARD ERROR>'
-        if to_database == 'PubMed':
-            temp_for_export = self.parsed_string
-        else:
-            temp_for_export = re.sub(f'<OPTIONAL>', optionals[to_database], self.parsed_string)
-            if to_database == 'Cochrane' and re.findall(f'<MANDATORY>', temp_for_export):
-                warnings = warnings.append('Mandatory wildcard converted to optional as unsupported in Cochrane for string ' + self.input_string)
-            temp_for_export = re.sub(f'<MANDATORY>', mandatories[to_database], temp_for_export)
-        if re.findall(f' ', temp_for_export) and not self.quoted:
+        if to_database == 'Cochrane' and self.has_mandatory:
+            context.warn('Mandatory wildcard converted to optional as unsupported in Cochrane for string ' + self.input_string)
+        temp_for_export = self.input_string.translate(wildcards) if wildcards is not None else self.input_string
+        if ' ' in temp_for_export and not self.quoted:
             temp_for_export = '"' + temp_for_export + '"'
         return temp_for_export
 
@@ -91,143 +181,205 @@ class Operator:
     # And/Or/adjX
     def __init__(self, input_string, from_database = 'Ovid'):
         self.input_string = input_string
-        self.is_adj = bool(re.findall('adj', input_string))
+        self.is_adj = 'adj' in input_string
         if self.is_adj:
             # Do not accept 'adj' on its own from Ovid
             self.proximity_ovid = int(input_string[3:])
-    def export(self, to_database):
+    def export(self, to_database, context = None):
         if self.is_adj:
-            return adj_mapping[to_database](self.proximity_ovid)
+            return translation_tables[to_database].adj(self.proximity_ovid)
         else:
             return self.input_string
 
 
 
 class OperatorCombinedFieldCondition:
-    def __init__(self, left_string, operator_string, right_string):
-        self.left = FieldCondition(left_string)
-        self.operator = Operator(operator_string)
-        self.right = FieldCondition(right_string)
-    def export(self, to_database):
-        left_export = self.left.export(to_database)
-        operator_export = self.operator.export(to_database)
-        right_export = self.right.export(to_database)
-        return left_export + ' ' + operator_export + ' ' + right_export
+    def __init__(self, left, operator, right):
+        # Built by FieldConditionParser from an already parsed left FieldCondition, Operator and right FieldCondition
+        self.left = left
+        self.operator = operator
+        self.right = right
+    def export(self, to_database, context = None):
+        # Long lists (a or b or c ...) are parsed into a chain down the left, so follow it in a loop rather than recursing
+        chain = [self]
+        while chain[-1].left.type == 'operatorcombinedinput':
+            chain.append(chain[-1].left.condition)
+        exports = [chain[-1].left.export(to_database, context)]
+        for condition in reversed(chain):
+            operator_export = condition.operator.export(to_database, context)
+            right_export = condition.right.export(to_database, context)
+            exports.extend([operator_export, right_export])
+        return ' '.join(exports)
 
 
 class FieldCondition:
     # This can be bracketed or otherwise
-    def __init__(self, input_string, from_database = 'Ovid'):
-        stripped_input = input_string.strip()
-        def FindPairedBracket(string):
-            # Ignore brackets in quotes
-            depthCounter = 0
-            quoted = False
-            for n, i in enumerate(string):
-                if i == '"':
-                    quoted = not quoted
-                if not quoted: 
-                    if i == '(':
-                        depthCounter = depthCounter + 1
-                    elif i == ')':
-                        depthCounter = depthCounter - 1
-                        if depthCounter == 0:
-                            return n
-            return None
-        if stripped_input[0] == '(':
-            matching_bracket_location = FindPairedBracket(stripped_input)
-            if matching_bracket_location + 1 == len(stripped_input):
-                #input is entirely in a pair of brackets
-                self.type = 'bracketedinput'
-                self.condition = FieldCondition(stripped_input[1:-1])
-            else:
-                # operator combination of stuff
-                left_string = stripped_input[:matching_bracket_location + 1]
-                remaining_string = stripped_input[matching_bracket_location + 1:]
-                self.type = 'operatorcombinedinput'
-                operator_location = re.match(operator_regex, remaining_string)
-                right_string = remaining_string[operator_location.end(1):]
-                operator_string = remaining_string[operator_location.start(1):operator_location.end(1)].strip()
-                self.condition = OperatorCombinedFieldCondition(left_string, operator_string, right_string)
-        else:
-            if re.match(operator_regex, stripped_input):
-                self.type = 'operatorcombinedinput'
-                operator_location = re.match(operator_regex, stripped_input)
-                left_string = stripped_input[:operator_location.start(1)]
-                operator_string = stripped_input[operator_location.start(1):operator_location.end(1)].strip()
-                right_string = stripped_input[operator_location.end(1):]
-                self.condition = OperatorCombinedFieldCondition(left_string, operator_string, right_string)
-            else:
-                self.type = 'stringcondition'
-                self.condition = StringCondition(stripped_input)
-    def export(self, to_database):
+    def __init__(self, input_string, from_database = 'Ovid', offset = 0):
+        parsed = FieldConditionParser(input_string, offset).parse()
+        self.type = parsed.type
+        self.condition = parsed.condition
+    @classmethod
+    def from_parts(cls, condition_type, condition):
+        # Makes a FieldCondition from an already parsed condition without parsing a string
+        field_condition = cls.__new__(cls)
+        field_condition.type = condition_type
+        field_condition.condition = condition
+        return field_condition
+    def export(self, to_database, context = None):
         if self.type == 'bracketedinput':
-            return '(' + self.condition.export(to_database) + ')'
+            return '(' + self.condition.export(to_database, context) + ')'
         elif self.type == 'operatorcombinedinput':
-            return self.condition.export(to_database)
+            return self.condition.export(to_database, context)
         elif self.type == 'stringcondition':
-            return self.condition.export(to_database)
+            return self.condition.export(to_database, context)
 
 
+class FieldConditionParser:
+    # Recursive descent parser building the FieldCondition tree for a search string from its tokens
+    def __init__(self, input_string, offset = 0):
+        self.input_string = input_string
+        self.offset = offset
+        self.tokens = tokenize(input_string, offset)
+        self.index = 0
+        self.depth = 0
+    def next_token(self):
+        if self.index < len(self.tokens):
+            return self.tokens[self.index]
+        return ('end', '', len(self.input_string) + self.offset, len(self.input_string) + self.offset)
+    def parse(self):
+        condition = self.parse_operators(1)
+        kind, text, start, end = self.next_token()
+        if kind == 'close':
+            raise ParseError('Unmatched closing bracket', start)
+        if kind != 'end':
+            raise ParseError(f'Expected and, or or adjN before "{text}"', start)
+        return condition
+    def parse_operators(self, precedence):
+        # Parses operands joined by operators of this precedence or higher, left to right
+        if precedence > highest_precedence:
+            return self.parse_operand()
+        left = self.parse_operators(precedence + 1)
+        while True:
+            kind, text, start, end = self.next_token()
+            if kind != 'operator' or operator_precedence[operator_name_regex.sub('', text)] != precedence:
+                return left
+            self.index = self.index + 1
+            right = self.parse_operators(precedence + 1)
+            left = FieldCondition.from_parts('operatorcombinedinput', OperatorCombinedFieldCondition(left, Operator(text), right))
+    def parse_operand(self):
+        kind, text, start, end = self.next_token()
+        if kind == 'open':
+            self.depth = self.depth + 1
+            if self.depth > max_bracket_depth:
+                raise ParseError(f'Brackets nested more than {max_bracket_depth} deep', start)
+            self.index = self.index + 1
+            condition = self.parse_operators(1)
+            if self.next_token()[0] != 'close':
+                raise ParseError('Missing closing bracket for the bracket', start)
+            self.index = self.index + 1
+            self.depth = self.depth - 1
+            return FieldCondition.from_parts('bracketedinput', condition)
+        if kind == 'term':
+            # Neighbouring terms make up one string condition, e.g. air condi?ioning*
+            while self.index + 1 < len(self.tokens) and self.tokens[self.index + 1][0] == 'term':
+                self.index = self.index + 1
+            self.index = self.index + 1
+            last_end = self.tokens[self.index - 1][3]
+            return FieldCondition.from_parts('stringcondition', StringCondition(self.input_string[start - self.offset:last_end - self.offset]))
+        if kind == 'operator':
+            raise ParseError(f'Expected a search term before "{text}"', start)
+        if kind == 'close':
+            raise ParseError('Expected a search term before the closing bracket', start)
+        raise ParseError('Expected a search term at the end', start)
+
+
+field_list_regex = re.compile(r'\.[\w,]+\.?$')
+pubmed_proximity_regex = re.compile(r'~(\d+) ')
+proximity_word_regex = re.compile(r'\w+(-\w+)*') # no spaces, quotes or wildcards
+
 class FieldSearchCondition:
-    def __init__(self, input_string, from_database = 'Ovid'):
+    def __init__(self, input_string, from_database = 'Ovid', offset = 0):
         if from_database == 'Ovid':
-            field_list = re.findall(r'\.[\w,]+\.?$', input_string)
+            field_list = field_list_regex.findall(input_string)
             if field_list:
                 field_list_string = field_list[0]
                 self.has_field_list = True
                 field_string = input_string[:-len(field_list_string)]
                 self.field_list = field_list_string.strip('.').split(',')
-                self.field_condition = FieldCondition(field_string)
+                self.field_condition = FieldCondition(field_string, offset = offset)
             else:
                 self.has_field_list = False
-                self.field_condition = FieldCondition(input_string)
-    def export(self, to_database):
-        global warnings
+                self.field_condition = FieldCondition(input_string, offset = offset)
+    def export(self, to_database, context = None):
+        context = context if context is not None else TranslationContext()
         if not self.has_field_list:
-            exported_field_condition = self.field_condition.export(to_database)
+            exported_field_condition = self.field_condition.export(to_database, context)
             return exported_field_condition
-        def map_field_item(field_item, to_database):
-            try:
-                to_field = field_mappings_from_ovid[field_item][to_database]
-            except KeyError:
-                warnings.append(f'Was not able to find an equivalent for {field_item} for {to_database}')
-                return None
-            return to_field
-        temp_mapped_field_items = [map_field_item(field_item, to_database) for field_item in self.field_list]
-        temp_mapped_field_items = [item for item in temp_mapped_field_items if item is not None]
-        exported_field_condition = self.field_condition.export(to_database)
-        if to_database == 'PubMed':
-            #Horrible hack to pull adjacency operators into the field items
-            proximities = re.findall(f'~(\d+) ', exported_field_condition)
-            if proximities:
-                exported_field_condition = re.sub(f'~(\d+) ', '', exported_field_condition)
-                greatest_proximity = max([int(proximity) for proximity in proximities])
-                temp_mapped_field_items = [item + ':~' + str(greatest_proximity) for item in temp_mapped_field_items]
-                #Ovid proximity search doesn't support wildcards so we have to strip them too
-                if re.findall(f'*', exported_field_condition):
-                    warnings.append(f'Ovid proximity search does not support wildcards in the string ' + exported_field_condition)
-        return field_combine_functions[to_database](temp_mapped_field_items, exported_field_condition)
+        table = translation_tables[to_database]
+        temp_mapped_field_items = []
+        for field_item in self.field_list:
+            if field_item in table.fields:
+                temp_mapped_field_items.append(table.fields[field_item])
+            else:
+                context.warn(f'Was not able to find an equivalent for {field_item} for {to_database}')
+        exported_field_condition = self.field_condition.export(to_database, context)
+        if to_database == 'PubMed' and pubmed_proximity_regex.search(exported_field_condition):
+            # PubMed proximity searches are a quoted phrase with the distance in the field tag, e.g. "cancer tumour"[tiab:~2],
+            # which can only be written for single words joined by adjN
+            words, greatest_proximity = proximity_words(self.field_condition)
+            if words is None:
+                context.warn('PubMed proximity search only supports single words without wildcards joined by adjN, not ' + exported_field_condition)
+                raise ExportError('Proximity search cannot be written for PubMed: ' + exported_field_condition)
+            exported_field_condition = '"' + ' '.join(words) + '"'
+            temp_mapped_field_items = [item + ':' + table.adj(greatest_proximity) for item in temp_mapped_field_items]
+        return table.combine_fields(temp_mapped_field_items, exported_field_condition)
+
+def proximity_words(field_condition):
+    """
+    Finds the words of a condition made only of single words joined by adjN, e.g. (cancer adj3 tumour adj2 growth).
+
+    Returns:
+    words (list): The words in order, or None if the condition has anything else (other operators, brackets inside it, phrases or wildcards).
+    greatest_proximity (int): The greatest Ovid adjN distance, or None.
+    """
+    while field_condition.type == 'bracketedinput':
+        # Brackets around the whole condition do not change it
+        field_condition = field_condition.condition
+    operands = []
+    proximities = []
+    while field_condition.type == 'operatorcombinedinput':
+        # Chains are parsed down the left, e.g. ((a adj b) adj c)
+        combined = field_condition.condition
+        if not combined.operator.is_adj:
+            return None, None
+        operands.append(combined.right)
+        proximities.append(combined.operator.proximity_ovid)
+        field_condition = combined.left
+    operands.append(field_condition)
+    if not proximities or any(operand.type != 'stringcondition' or not proximity_word_regex.fullmatch(operand.condition.input_string) for operand in operands):
+        return None, None
+    return [operand.condition.input_string for operand in reversed(operands)], max(proximities)
 
 class SubjectTerm:
     def __init__(self, input_string, from_database = 'Ovid'):
         self.input_string = input_string
         cleaned_input = input_string.strip('/')
-        if re.match('exp', cleaned_input):
+        if cleaned_input.startswith('exp '):
             self.explode = True
+            cleaned_input = cleaned_input[len('exp '):]
         else:
             self.explode = False
-        cleaned_input = cleaned_input.strip('exp ')
+        cleaned_input = cleaned_input.strip()
         if cleaned_input[0] == '*':
             self.focus = True
         else:
             self.focus = False
         cleaned_input = cleaned_input.strip('*')
         self.subject_text = cleaned_input
-    def export(self, to_database):
-        global warnings
+    def export(self, to_database, context = None):
+        context = context if context is not None else TranslationContext()
         if not to_database == 'PubMed':
-            warnings.append(f'Was not able to map subject heading for database ' + to_database + ' for string ' + self.input_string)
+            context.warn(f'Was not able to map subject heading for database ' + to_database + ' for string ' + self.input_string)
             return 'Unmapped subject heading ' + self.input_string
         elif to_database == 'PubMed':
             if self.focus == False:
@@ -239,97 +391,329 @@ class SubjectTerm:
             return self.subject_text + '[' + field + ']'
                             
 
+line_number_regex = re.compile(r'(\d+)(\.|  )')
+result_count_regex = re.compile(r'\(\d+\)$')
+combined_numbers_regex = re.compile(r'\d+(and|or|[\d /\(\)])+$')
+combined_range_regex = re.compile(r'(and|or)/(\d+(-\d+)?(, ?\d+(-\d+)?)*)$') # e.g. or/5-20 or or/1,3,5-7
+subject_term_regex = re.compile(r"[,\w *'-]+/$") # e.g. exp *Anti-Bacterial Agents/
+number_regex = re.compile(r'\d+')
+
+def split_line_number(cleaned_input):
+    # Clean off the 1. and the  
+    # Returns the line number (None if there isn't one) and the rest of the line
+    line_number_match = line_number_regex.match(cleaned_input)
+    if line_number_match is None:
+        return None, cleaned_input
+    return int(line_number_match[1]), cleaned_input[line_number_match.end():].strip()
+
 class Phrase:
     def __init__(self, input_string, from_database = 'Ovid'):
         cleaned_input = input_string.strip('\n')
         cleaned_input = cleaned_input.strip()
-        # Clean off the 1. and the  
-        line_number_match = re.match(r'\d+(\.|  )', cleaned_input)
-        if line_number_match is None:
-            pass
-        else:
-            cleaned_input = cleaned_input[line_number_match.end():].strip()
-        result_count_match = re.search(r'\(\d+\)$', cleaned_input)
+        self.line_number, cleaned_input = split_line_number(cleaned_input)
+        result_count_match = result_count_regex.search(cleaned_input)
         # check if it's a boolean combination of previous queries or a FieldCondition
         if result_count_match is None:
             pass
         else:
             cleaned_input = cleaned_input[:result_count_match.start()].strip()
-        print(cleaned_input)
-        if re.match(r'\d+(and|or|[\d /\(\)])+$', cleaned_input):
+        if combined_numbers_regex.match(cleaned_input):
             self.type = 'combinednumberedqueries'
             self.text = cleaned_input
-        elif re.match(r'(and|or)/', cleaned_input):
+        elif combined_range_regex.match(cleaned_input):
             self.type = 'combinednumberedqueries'
-            booleanmatch = re.match(r'(and|or)/', cleaned_input)
-            queryrange = cleaned_input[booleanmatch.end():]
-            queryrangemin = int(queryrange.split('-')[0])
-            queryrangemax = int(queryrange.split('-')[1])
-            operator = booleanmatch[0][:-1]
-            self.text = (' ' + operator + ' ').join([str(i) for i in range(queryrangemin, queryrangemax + 1)])
-        elif re.match(r'[,\w *]+/', cleaned_input):
+            booleanmatch = combined_range_regex.match(cleaned_input)
+            operator = booleanmatch[1]
+            numbers = []
+            for queryrange in booleanmatch[2].split(','):
+                queryrangemin = int(queryrange.split('-')[0])
+                queryrangemax = int(queryrange.split('-')[-1])
+                numbers.extend(range(queryrangemin, queryrangemax + 1))
+            self.text = (' ' + operator + ' ').join([str(i) for i in numbers])
+        elif subject_term_regex.match(cleaned_input):
             self.type = 'subjecttermquery'
             self.condition = SubjectTerm(cleaned_input)
         else:
             self.type = 'fieldsearchcondition'
-            self.condition = FieldSearchCondition(cleaned_input)
-    def export(self, to_database):
+            # Error positions are given in the original line
+            self.condition = FieldSearchCondition(cleaned_input, offset = max(input_string.find(cleaned_input), 0))
+        if self.type == 'combinednumberedqueries':
+            # The line numbers this line combines
+            self.references = [int(number) for number in number_regex.findall(self.text)]
+    def export(self, to_database, context = None):
         if self.type == 'fieldsearchcondition':
-            return self.condition.export(to_database)
+            return self.condition.export(to_database, context)
         elif self.type == 'subjecttermquery':
-            return self.condition.export(to_database)        
+            return self.condition.export(to_database, context)
         else:
             # Query mappings
-            return re.sub(r'\d+', query_mapping[to_database], self.text)
+            return number_regex.sub(translation_tables[to_database].query_reference, self.text)
 
 
 # Processing code
 
-def do_a_line(line, to_database):
-    #returns output, warningline
-    global warnings
-    warnings = []
+target_databases = list(adj_mapping) # the databases a strategy can be exported to
+
+def parse_line(line):
+    """
+    Parses a line of an Ovid search strategy, ready to export to any number of databases.
+
+    Parameters:
+    line (str): The line, as read from the strategy file.
+
+    Returns:
+    phrase (Phrase): The parsed line, or None if it could not be parsed.
+    warningline (str): The warnings for a line which could not be parsed, otherwise None.
+    """
     try:
         # Parse
         phrase = Phrase(line)
+    except ParseError as error:
+        return None, 'Error: could not parse: ' + line.strip('\n') + ' (' + str(error) + ')'
     except:
         # Error parsing the line
-        returnline = 'Could not parse: ' + line.strip('\n')
-        warningline = '; '.join(['Error: could not parse: ' + line.strip('\n')] + warnings)
-        return returnline, warningline
-    else: 
-        try:
-            export = phrase.export(to_database)
-        except:
-            # export failure
-            returnline = 'Could not export: ' + line.strip('\n')
-            warningline = '; '.join(['Error: could not export: ' + line.strip('\n')] + warnings)
-            return returnline, warningline
-        else:
-            warningline = '; '.join(warnings)
-            return export, warningline
-
-# Browsing for file copied from (https://stackoverflow.com/a/3579625/11732165)
-
-from tkinter import Tk     # from tkinter import Tk for Python 3.x
-from tkinter.filedialog import askopenfile, asksaveasfile
-from tkinter.simpledialog import askstring
-
-Tk().withdraw() # we don't want a full GUI, so keep the root window from appearing
-input_file = askopenfile() # show an "Open" dialog box and return the path to the selected file
-
-lines = input_file.readlines()
-input_file.close()
+        return None, 'Error: could not parse: ' + line.strip('\n')
+    return phrase, None
 
-to_database = askstring('Target database', 'Cochrane/WoS/EBSCO/Proquest/Scopus/PubMed')
+def export_line(line, phrase, to_database):
+    #returns output, warningline
+    context = TranslationContext()
+    try:
+        export = phrase.export(to_database, context)
+    except:
+        # export failure
+        returnline = 'Could not export: ' + line.strip('\n')
+        warningline = '; '.join(['Error: could not export: ' + line.strip('\n')] + context.warnings)
+        return returnline, warningline
+    else:
+        warningline = '; '.join(context.warnings)
+        return export, warningline
 
-done_lines = [do_a_line(line, to_database) for line in lines]
+def do_a_line(line, to_database):
+    #returns output, warningline
+    phrase, warningline = parse_line(line)
+    if phrase is None:
+        return 'Could not parse: ' + line.strip('\n'), warningline
+    return export_line(line, phrase, to_database)
+
+@lru_cache(maxsize = translation_cache_size)
+def parse_cached(line):
+    # Parsed lines are not changed by exporting them, so can be shared between strategies and threads
+    return parse_line(line)
+
+@lru_cache(maxsize = translation_cache_size)
+def translate_line(line, to_database):
+    """
+    Translates one line of a strategy to one database, keeping the result for repeat lines.
+
+    Returns:
+    output (str): The translated line.
+    warningline (str): The warnings for the line.
+    """
+    phrase, parse_warningline = parse_cached(line)
+    if phrase is None:
+        return 'Could not parse: ' + line.strip('\n'), parse_warningline
+    return export_line(line, phrase, to_database)
+
+def inline_line_references(lines, phrases, done_lines):
+    """
+    Writes out lines combining earlier lines (e.g. 1 and 2, or/5-20) as single queries, with the translation of each line
+    they refer to in place of its number, for databases (like PubMed) where a query has to stand on its own.
+    Each line is written out only once however many times it is referred to, so long strategies reusing big or/1-40 lines
+    at several levels do not take exponentially long.
+    Lines which cannot be written out (references to missing lines, lines referring to themselves through other lines,
+    or lines which could not be translated cleanly, with a warning or a placeholder in their output) keep their line numbers
+    and say why, with the warnings of the lines they refer to, in their warnings.
+
+    Parameters:
+    lines (list): The lines of the strategy.
+    phrases (list): The parsed Phrase for each line, None for lines which could not be parsed.
+    done_lines (list): The (output, warningline) of each line translated to one database.
+
+    Returns:
+    inlined_lines (list): The (output, warningline) of each line, with the references written out.
+    """
+    # Lines are referred to by their Ovid line numbers, or by position for lines without one
+    line_indexes = {}
+    line_numbers = []
+    duplicate_numbers = set()
+    for index, line in enumerate(lines):
+        line_number = split_line_number(line.strip())[0]
+        line_number = line_number if line_number is not None else index + 1
+        line_numbers.append(line_number)
+        if line_number in line_indexes:
+            duplicate_numbers.add(line_number)
+        else:
+            line_indexes[line_number] = index
+
+    def is_combined(index):
+        return phrases[index] is not None and phrases[index].type == 'combinednumberedqueries'
+
+    expanded = {} # the written out query for each line done so far, None if it could not be written out
+    problems = {} # why each line could not be written out
+    notes = {index: [] for index in range(len(lines))}
+    path = [] # the lines being written out, each referring to the next
+    for start in range(len(lines)):
+        # Depth first through the references, using a stack rather than recursing as chains of references can be long
+        stack = [start]
+        while stack:
+            index = stack[-1]
+            if index in expanded:
+                stack.pop()
+                continue
+            output, warningline = done_lines[index]
+            if not is_combined(index):
+                stack.pop()
+                if warningline or any(placeholder in output for placeholder in untranslated_placeholders):
+                    # Written out, its warning would be lost and a placeholder would stop the whole query from running
+                    expanded[index] = None
+                    problems[index] = warningline or 'not translated'
+                else:
+                    expanded[index] = output
+                continue
+            references = phrases[index].references
+            if index not in path:
+                path.append(index)
+            pending = [line_indexes[number] for number in references if number in line_indexes and line_indexes[number] not in expanded]
+            circular = [reference for reference in pending if reference in path]
+            if circular:
+                cycle = path[path.index(circular[0]):]
+                cycle_text = ' -> '.join(str(line_numbers[member]) for member in cycle + [cycle[0]])
+                for member in cycle:
+                    expanded[member] = None
+                    problems[member] = 'circular reference (' + cycle_text + ')'
+                continue
+            if pending:
+                stack.extend(pending)
+                continue
+            # Every line referred to has been written out (or could not be)
+            stack.pop()
+            path.remove(index)
+            missing = [number for number in references if number not in line_indexes]
+            failed = [number for number in references if number in line_indexes and expanded[line_indexes[number]] is None]
+            for number in dict.fromkeys(references):
+                if number in duplicate_numbers:
+                    notes[index].append(f'Line number {number} is used more than once, referring to the first')
+                if number in line_indexes and line_indexes[number] >= index:
+                    notes[index].append(f'Refers to line {number} which is not before it')
+            if missing:
+                problems[index] = 'refers to missing line ' + ', '.join(str(number) for number in dict.fromkeys(missing))
+                expanded[index] = None
+            elif failed:
+                problems[index] = 'refers to line ' + ', '.join(str(number) for number in dict.fromkeys(failed)) + ' which could not be written out'
+                # The warnings of lines which are not themselves combinations (those show their own problems)
+                reasons = [f'line {number}: {problems[line_indexes[number]]}' for number in dict.fromkeys(failed) if not is_combined(line_indexes[number])]
+                if reasons:
+                    problems[index] = problems[index] + ' (' + '; '.join(reasons) + ')'
+                expanded[index] = None
+            else:
+                inlined = number_regex.sub(lambda match: '(' + expanded[line_indexes[int(match[0])]] + ')', phrases[index].text)
+                if len(inlined) > max_inlined_query_length:
+                    problems[index] = f'longer than {max_inlined_query_length} characters when written out'
+                    expanded[index] = None
+                else:
+                    expanded[index] = inlined
+
+    inlined_lines = []
+    for index, (output, warningline) in enumerate(done_lines):
+        if not is_combined(index):
+            inlined_lines.append((output, warningline))
+            continue
+        line_warnings = ([warningline] if warningline else []) + notes[index]
+        if expanded[index] is None:
+            line_warnings.append('Line references not written out: ' + problems[index])
+        else:
+            output = expanded[index]
+        inlined_lines.append((output, '; '.join(line_warnings)))
+    return inlined_lines
+
+def do_lines(lines, to_databases, inline_references = False):
+    """
+    Translates a search strategy to several databases, parsing each line only once (and lines seen before not at all).
+
+    Parameters:
+    lines (list): The lines of the strategy.
+    to_databases (list): The names of the databases to translate to.
+    inline_references (bool): Whether to write out lines combining earlier lines as single queries (see inline_line_references).
+
+    Returns:
+    done_lines (dict): For each database, a list of (output, warningline) for each line.
+    """
+    done_lines = {to_database: [translate_line(line, to_database) for line in lines] for to_database in to_databases}
+    if inline_references:
+        phrases = [parse_cached(line)[0] for line in lines]
+        for to_database in to_databases:
+            done_lines[to_database] = inline_line_references(lines, phrases, done_lines[to_database])
+    return done_lines
+
+def read_database_names(text):
+    """
+    Reads the target databases typed at the prompt, e.g. 'WoS', 'WoS, Scopus' or 'all'.
+    Names are matched ignoring case, anything not recognised is kept as typed (and will fail to export).
+    """
+    if text.strip().lower() == 'all':
+        return list(target_databases)
+    known_names = {database.lower(): database for database in target_databases}
+    names = [name.strip() for name in text.split(',') if name.strip()]
+    return [known_names.get(name.lower(), name) for name in names]
+
+def write_translation(output_file, done_lines):
+    # Line-by-line translation followed by line-by-line warnings
+    output_file.writelines([done_line[0] + '\n' for done_line in done_lines])
+    output_file.writelines(['Warnings:\n'])
+    output_file.writelines([done_line[1] + '\n' for done_line in done_lines])
+
+def database_output_path(output_path, to_database):
+    # e.g. strategy.txt -> strategy_WoS.txt
+    stem, extension = os.path.splitext(output_path)
+    return f'{stem}_{to_database}{extension}'
+
+def write_combined_table(output_path, lines, done_lines):
+    """
+    Writes the translations for several databases side by side in a CSV file,
+    with a column of the original lines then a translation and a warnings column for each database.
+    """
+    with open(output_path, 'w', newline = '', encoding = 'utf-8') as output_file:
+        csv_writer = csv.writer(output_file)
+        csv_writer.writerow(['Ovid'] + [heading for to_database in done_lines for heading in (to_database, to_database + ' warnings')])
+        for line_number, line in enumerate(lines):
+            csv_writer.writerow([line.strip('\n')] + [text for to_database in done_lines for text in done_lines[to_database][line_number]])
+
+def run_with_prompts():
+    # Browsing for file copied from (https://stackoverflow.com/a/3579625/11732165)
+    from tkinter import Tk     # from tkinter import Tk for Python 3.x
+    from tkinter.filedialog import askopenfile, asksaveasfile, asksaveasfilename
+    from tkinter.messagebox import askyesno
+    from tkinter.simpledialog import askstring
+
+    Tk().withdraw() # we don't want a full GUI, so keep the root window from appearing
+    input_file = askopenfile() # show an "Open" dialog box and return the path to the selected file
+
+    lines = input_file.readlines()
+    input_file.close()
+
+    to_databases = read_database_names(askstring('Target database', 'Cochrane/WoS/EBSCO/Proquest/Scopus/PubMed\nSeparate several with commas, or type all for every database'))
+
+    inline_references = askyesno('Line references', 'Write out lines combining earlier lines (e.g. 1 and 2) as single queries?\nNo keeps the line numbers (e.g. #1 and #2)')
+
+    done_lines = do_lines(lines, to_databases, inline_references)
+
+    if len(to_databases) == 1:
+        output_file = asksaveasfile(defaultextension=".txt", filetypes=(("text file", "*.txt"),("All Files", "*.*") ))
+        write_translation(output_file, done_lines[to_databases[0]])
+        output_file.close()
+    elif askyesno('Output', 'Write one combined table (CSV) of all the databases?\nNo writes a separate file for each database'):
+        output_path = asksaveasfilename(defaultextension=".csv", filetypes=(("comma separated values", "*.csv"),("All Files", "*.*") ))
+        write_combined_table(output_path, lines, done_lines)
+    else:
+        output_path = asksaveasfilename(title = "Save output (the database name is added to each file name)", defaultextension=".txt", filetypes=(("text file", "*.txt"),("All Files", "*.*") ))
+        for to_database in to_databases:
+            with open(database_output_path(output_path, to_database), 'w') as output_file:
+                write_translation(output_file, done_lines[to_database])
+
+if __name__ == '__main__':
+    run_with_prompts()
 
-output_file = asksaveasfile(defaultextension=".txt", filetypes=(("text file", "*.txt"),("All Files", "*.*") ))
-output_file.writelines([done_line[0] + '\n' for done_line in done_lines])
-output_file.writelines(['Warnings:\n'])
-output_file.writelines([done_line[1] + '\n' for done_line in done_lines])
-output_file.close()
 # Tests
 
 """
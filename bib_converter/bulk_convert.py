@@ -0,0 +1,103 @@
+# Converts whole files or folders of Ovid search strategies without prompts, e.g. archived strategies for an audit
+# python bulk_convert.py strategies_folder -o translations_folder -d WoS,Scopus
+# python bulk_convert.py strategy1.txt strategy2.txt -o translations_folder -d all --separate --inline-references
+# Strategy files are read, translated and written one at a time, so folders of any size can be converted
+# The output folder mirrors the input folders, with a combined table (CSV) for each strategy file,
+# or with --separate a text file for each strategy file and database (as written by bib_converter_run.py)
+# Lines repeated between strategies are only translated once (see translate_line in bib_converter_run.py)
+
+import argparse
+import os
+import sys
+import time
+
+from bib_converter_run import do_lines, read_database_names, write_translation, database_output_path, write_combined_table
+
+default_extension = '.txt'
+
+def find_strategy_files(paths, extension = default_extension):
+    """
+    Finds the strategy files to convert, looking through folders (and their subfolders) for files ending in extension.
+
+    Parameters:
+    paths (list): Strategy files and folders.
+    extension (str): The file extension of strategy files in folders.
+
+    Returns:
+    strategy_files (generator): (path, relative_path) for each file, relative_path being the path to write its outputs to under the output folder.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, subfolders, filenames in os.walk(path):
+                subfolders.sort()
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(extension.lower()):
+                        file_path = os.path.join(folder, filename)
+                        yield file_path, os.path.relpath(file_path, path)
+        else:
+            yield path, os.path.basename(path)
+
+def convert_files(strategy_files, to_databases, inline_references = False):
+    """
+    Translates strategy files one at a time.
+
+    Parameters:
+    strategy_files (iterable): (path, relative_path) for each file, as from find_strategy_files.
+    to_databases (list): The names of the databases to translate to.
+    inline_references (bool): Whether to write out lines combining earlier lines as single queries.
+
+    Returns:
+    conversions (generator): (path, relative_path, lines, done_lines) for each file, done_lines as from do_lines.
+    """
+    for path, relative_path in strategy_files:
+        with open(path, 'r', encoding = 'utf-8-sig', errors = 'replace') as input_file:
+            lines = input_file.readlines()
+        yield path, relative_path, lines, do_lines(lines, to_databases, inline_references)
+
+def write_conversion(output_folder, relative_path, lines, done_lines, separate = False):
+    """
+    Writes the translations of one strategy file under the output folder.
+
+    Returns:
+    output_paths (list): The paths of the files written.
+    """
+    stem = os.path.join(output_folder, os.path.splitext(relative_path)[0])
+    os.makedirs(os.path.dirname(stem) or '.', exist_ok = True)
+    if not separate:
+        write_combined_table(stem + '.csv', lines, done_lines)
+        return [stem + '.csv']
+    output_paths = []
+    for to_database in done_lines:
+        output_path = database_output_path(stem + '.txt', to_database)
+        with open(output_path, 'w', encoding = 'utf-8') as output_file:
+            write_translation(output_file, done_lines[to_database])
+        output_paths.append(output_path)
+    return output_paths
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Translate files or folders of Ovid search strategies to other databases.')
+    parser.add_argument('paths', nargs = '+', help = 'strategy files or folders of them')
+    parser.add_argument('-o', '--output', required = True, help = 'folder to write the translations to')
+    parser.add_argument('-d', '--databases', default = 'all', help = 'databases to translate to, separated by commas, or all (default: all)')
+    parser.add_argument('--separate', action = 'store_true', help = 'write a text file for each database instead of one combined table (CSV)')
+    parser.add_argument('--inline-references', action = 'store_true', help = 'write out lines combining earlier lines (e.g. 1 and 2) as single queries')
+    parser.add_argument('--extension', default = default_extension, help = f'extension of strategy files in folders (default: {default_extension})')
+    parsed = parser.parse_args(arguments)
+
+    to_databases = read_database_names(parsed.databases)
+    if not to_databases:
+        parser.error('no databases given')
+    start = time.perf_counter()
+    file_count, line_count, failed_count = 0, 0, 0
+    for path, relative_path, lines, done_lines in convert_files(find_strategy_files(parsed.paths, parsed.extension), to_databases, parsed.inline_references):
+        write_conversion(parsed.output, relative_path, lines, done_lines, parsed.separate)
+        file_count = file_count + 1
+        line_count = line_count + len(lines)
+        failed_count = failed_count + sum(output.startswith(('Could not parse', 'Could not export'))
+                                          for to_database in done_lines for output, warningline in done_lines[to_database])
+    print(f'Translated {line_count} lines from {file_count} files to {len(to_databases)} databases in {time.perf_counter() - start:.1f} seconds '
+          f'({failed_count} translations failed, see the warnings)')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
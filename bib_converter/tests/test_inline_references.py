@@ -0,0 +1,32 @@
+# Tests of writing out lines which combine earlier lines (e.g. 1 or 2) as single queries
+# Run with python -m pytest from the bib_converter folder
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bib_converter_run import do_lines
+
+def inlined(lines, to_database):
+    return do_lines(lines, [to_database], inline_references = True)[to_database]
+
+def test_lines_written_out():
+    output, warningline = inlined(['1.  exp Vaccines/', '2.  flu.ti.', '3.  1 or 2'], 'PubMed')[2]
+    assert output == '(Vaccines[MeSH]) or (flu[ti])'
+    assert warningline == ''
+
+def test_unmapped_subject_heading_not_written_out():
+    output, warningline = inlined(['1.  exp Vaccines/', '2.  flu.ti.', '3.  1 or 2'], 'Scopus')[2]
+    assert 'Unmapped subject heading' not in output
+    assert 'refers to line 1 which could not be written out' in warningline
+    assert 'Was not able to map subject heading' in warningline
+
+def test_wildcard_placeholder_not_written_out():
+    output, warningline = inlined(['1.  influenza.tw.', '2.  wom#n.tw.', '3.  1 or 2'], 'PubMed')[2]
+    assert '<WILDCARD ERROR>' not in output
+    assert 'Wildcards could not be mapped' in warningline
+
+def test_other_lines_still_written_out():
+    lines = ['1.  exp Vaccines/', '2.  flu.ti.', '3.  influenza.tw.', '4.  2 or 3']
+    assert inlined(lines, 'Scopus')[3] == ('(TITLE(flu)) or (TITLE-ABS(influenza))', '')
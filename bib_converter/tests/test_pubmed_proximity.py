@@ -0,0 +1,60 @@
+# Tests of writing Ovid adjN proximity searches for PubMed, which only has proximity searches of a quoted phrase of single words
+# Run with python -m pytest from the bib_converter folder
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from bib_converter_run import ExportError, TranslationContext, parse_line, translate_line
+
+def check_not_exported(line):
+    output, warningline = translate_line(line, 'PubMed')
+    assert output.startswith('Could not export')
+    assert 'PubMed proximity search only supports single words' in warningline
+
+def test_two_words():
+    assert translate_line('(cancer adj3 tumour).tw.', 'PubMed') == ('"cancer tumour"[tiab:~2]', '')
+
+def test_two_words_without_brackets():
+    assert translate_line('cancer adj3 tumour.tw.', 'PubMed') == ('"cancer tumour"[tiab:~2]', '')
+
+def test_nested_brackets():
+    assert translate_line('((cancer adj2 tumour)).tw.', 'PubMed') == ('"cancer tumour"[tiab:~1]', '')
+
+def test_three_words_uses_greatest_distance():
+    output, warningline = translate_line('(covid-19 adj3 tumour adj2 growth).ti,ab.', 'PubMed')
+    assert output == '"covid-19 tumour growth"[ti:~2] OR "covid-19 tumour growth"[ab:~2]'
+
+def test_multiple_words():
+    check_not_exported('(breast cancer adj3 screening).tw.')
+
+def test_quoted_phrase():
+    check_not_exported('("breast cancer" adj3 screening).tw.')
+
+def test_boolean_operand():
+    check_not_exported('((cancer or tumour) adj2 growth).tw.')
+
+def test_bracketed_operand():
+    check_not_exported('(cancer adj2 (tumour or growth)).tw.')
+
+def test_boolean_around_proximity():
+    check_not_exported('((cancer adj2 tumour) or growth).tw.')
+
+def test_boolean_after_proximity():
+    check_not_exported('(cancer adj2 tumour and growth).tw.')
+
+def test_wildcard():
+    check_not_exported('(canc* adj3 tumour).tw.')
+
+def test_other_databases_unchanged():
+    output, warningline = translate_line('(breast cancer adj3 screening).tw.', 'Scopus')
+    assert not output.startswith('Could not export')
+
+def test_refusal_raises_export_error():
+    # So that the fuzzer can tell refusals from defects
+    phrase, warningline = parse_line('(canc* adj3 tumour).tw.')
+    with pytest.raises(ExportError):
+        phrase.export('PubMed', TranslationContext())
@@ -0,0 +1,119 @@
+# Local web service translating Ovid search strategies in batches, for tools (or other people) which translate strategies all day
+# Runs on this computer only by default: python translation_service.py [--port 8765]
+# POST /translate with a JSON body:
+#   {"lines": ["1     exp Neoplasms/", "2     (GAS adj5 infect*).tw,kf."], "databases": ["WoS", "Scopus"]}
+#   ("strategy" can be given instead of "lines" as one string with a line per line of the strategy, and "databases" can be "all")
+#   add "inline_references": true to write out lines combining earlier lines (e.g. 1 and 2) as single queries
+# Response:
+#   {"results": {"WoS": [{"line": ..., "output": ..., "warnings": ...}, ...], "Scopus": [...]}}
+# GET /databases lists the databases that can be translated to
+# Translations are cached by (line, database) (see translation_cache_size in bib_converter_run.py), so repeat lines - very common as strategies are adapted from each other - are not translated again
+
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bib_converter_run import parse_cached, translate_line, inline_line_references, target_databases
+
+default_host = '127.0.0.1' # only reachable from this computer
+default_port = 8765
+max_request_bytes = 10 * 1024 * 1024
+
+def translate_batch(request):
+    """
+    Translates the lines of a request to each of its databases.
+
+    Parameters:
+    request (dict): The JSON request body, see the top of this file.
+
+    Returns:
+    response (dict): The JSON response body.
+    """
+    if not isinstance(request, dict):
+        raise ValueError('The request must be a JSON object')
+    if 'lines' in request:
+        lines = request['lines']
+    elif 'strategy' in request:
+        lines = str(request['strategy']).splitlines()
+    else:
+        raise ValueError('The request needs "lines" (a list of strategy lines) or "strategy" (the strategy as one string)')
+    if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+        raise ValueError('"lines" must be a list of strings')
+    databases = request.get('databases', 'all')
+    if databases == 'all':
+        databases = target_databases
+    if isinstance(databases, str):
+        databases = [databases]
+    if not isinstance(databases, list) or not all(isinstance(database, str) for database in databases):
+        raise ValueError('"databases" must be a database name, a list of them or "all"')
+    unknown = [database for database in databases if database not in target_databases]
+    if unknown:
+        raise ValueError(f'Unknown databases {unknown}, choose from {target_databases}')
+    inline_references = request.get('inline_references', False)
+    if not isinstance(inline_references, bool):
+        raise ValueError('"inline_references" must be true or false')
+    results = {}
+    for to_database in databases:
+        done_lines = [translate_line(line, to_database) for line in lines]
+        if inline_references:
+            # Depends on the whole strategy, so is not cached line by line
+            done_lines = inline_line_references(lines, [parse_cached(line)[0] for line in lines], done_lines)
+        results[to_database] = [{'line': line, 'output': output, 'warnings': warningline} for line, (output, warningline) in zip(lines, done_lines)]
+    return {'results': results}
+
+class TranslationRequestHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/databases':
+            self.send_json(200, {'databases': target_databases})
+        else:
+            self.send_json(404, {'error': 'Not found, POST to /translate or GET /databases'})
+
+    def do_POST(self):
+        if self.path != '/translate':
+            self.send_json(404, {'error': 'Not found, POST to /translate'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length < 0:
+                # Reading a negative length would wait for the client to close the connection
+                raise ValueError(f'Content-Length must not be negative, not {length}')
+            if length > max_request_bytes:
+                self.send_json(413, {'error': f'Requests are limited to {max_request_bytes} bytes'})
+                return
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            response = translate_batch(request)
+        except (ValueError, UnicodeDecodeError) as error: # includes badly formed JSON
+            self.send_json(400, {'error': str(error)})
+            return
+        self.send_json(200, response)
+
+def make_server(host = default_host, port = default_port):
+    """
+    Creates the server, each request is handled on its own thread. Call serve_forever() on it to start handling requests.
+    """
+    return ThreadingHTTPServer((host, port), TranslationRequestHandler)
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Serve translations of Ovid search strategies as JSON over HTTP.')
+    parser.add_argument('--host', default = default_host, help = f'address to listen on (default: {default_host}, only this computer)')
+    parser.add_argument('--port', type = int, default = default_port, help = f'port to listen on (default: {default_port})')
+    parsed = parser.parse_args(arguments)
+    server = make_server(parsed.host, parsed.port)
+    print(f'Translating at http://{parsed.host}:{server.server_address[1]}/translate, stop with Ctrl+C')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
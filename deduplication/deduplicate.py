@@ -0,0 +1,353 @@
+# Deduplication of bibliographic exports using the Leeds method (developed in EndNote, see dedup_exploration.R)
+# Author, title, journal, year and pages are normalised once for each record, then every rule of the cascade is checked
+# in a single pass: each rule keeps a hash index of the keys seen so far, and a record matching an earlier record's key
+# joins its cluster (union-find), so the whole export is deduplicated in time proportional to its size
+# Rules are skipped for records missing any part of the rule's key (rather than treating missing values as matching)
+# Optionally, near-identical titles (typos, punctuation, a word changed) are also matched using MinHash signatures with LSH banding
+# Usage:
+# python deduplicate.py export1.ris export2.txt -o duplicates.csv
+# python deduplicate.py export.ris -o duplicates.csv --rules 1-8,10 --near-titles
+# The output has a row for each record with its cluster, whether it is the record to keep (the first of its cluster)
+# and the record and rule which linked it to its cluster
+
+import argparse
+import csv
+import re
+import sys
+import time
+import unicodedata
+from array import array
+from functools import lru_cache
+from operator import itemgetter
+
+from read_references import read_references
+
+# Rules of the Leeds method, in order, as the fields making up each key
+rules = {
+    '1': ('author', 'year', 'title', 'journal'),
+    '2': ('author', 'year', 'title', 'pages'),
+    '3': ('title', 'journal', 'pages'),
+    '4': ('title', 'year', 'pages'),
+    '5': ('title', 'pages'),
+    '6': ('author', 'year', 'journal', 'pages'),
+    '7': ('author', 'year', 'title'),
+    '8': ('author', 'year', 'journal'),
+    '9': ('author', 'year'),
+    '10': ('year', 'title'),
+}
+default_rules = ['1', '2', '3', '4', '5', '6', '7', '8', '10'] # author + year alone (9) links too many different papers by the same authors to use without checking
+near_title_rule = 'near title'
+
+# Near-identical title matching
+shingle_length = 4 # characters
+signature_length = 32 # MinHash values for each title
+bands = 8 # LSH bands of signature_length // bands values, titles sharing any band (and their year) are compared
+default_near_title_threshold = 0.8 # estimated Jaccard similarity of the title shingles
+max_bucket_comparisons = 20 # a title is compared with at most this many earlier titles sharing a band, so very common titles do not take quadratic time
+signature_batch_size = 2000 # titles hashed at once
+
+# Normalisation
+
+separators_regex = re.compile(r'[\W_]+') # punctuation and spaces
+initials_regex = re.compile(r'[A-Z]{1,3}')
+pages_regex = re.compile(r'^([A-Za-z]*)(\d+)\s*[-‐-―]+\s*([A-Za-z]*)(\d+)')
+single_page_regex = re.compile(r'^([A-Za-z]*\d+)')
+
+def simplify(text):
+    """
+    Lower case without accents or punctuation and with single spaces, e.g. 'Évaluation: the "STEC" study.' -> 'evaluation the stec study'.
+    """
+    if not text.isascii():
+        text = ''.join(character for character in unicodedata.normalize('NFKD', text) if not unicodedata.combining(character))
+    return separators_regex.sub(' ', text.lower()).strip()
+
+def normalise_title(title):
+    return simplify(title) or None if title else None
+
+@lru_cache(maxsize = 100000) # journals repeat a lot
+def normalise_journal(journal):
+    if not journal:
+        return None
+    journal = simplify(journal)
+    if journal.startswith('the '):
+        journal = journal[len('the '):]
+    return journal or None
+
+@lru_cache(maxsize = 100000) # so do authors
+def normalise_author(author):
+    """
+    A single author as surname and first initial, e.g. 'Smith, John' -> 'smith j', 'Smith JA' -> 'smith j', 'John Smith' -> 'smith j'.
+    """
+    author = author.strip()
+    if ',' in author:
+        surname, given_names = author.split(',', 1)
+    else:
+        parts = author.split()
+        if len(parts) > 1 and initials_regex.fullmatch(parts[-1]):
+            surname, given_names = ' '.join(parts[:-1]), parts[-1] # MEDLINE style, Smith JA
+        elif parts:
+            surname, given_names = parts[-1], ' '.join(parts[:-1])
+        else:
+            return ''
+    initial = given_names.strip()[:1]
+    initial = initial.lower() if initial.isascii() and initial.isalpha() else simplify(given_names)[:1]
+    return simplify(surname) + (' ' + initial if initial else '')
+
+def normalise_authors(authors):
+    authors = [author for author in (normalise_author(author) for author in authors) if author]
+    return '; '.join(authors) or None
+
+def normalise_pages(pages):
+    """
+    Page ranges written in full, e.g. '203 - 5' -> '203-205', 'S12-5' -> 's12-s15', 'e1234' -> 'e1234', missing -> None.
+    """
+    if not pages:
+        return None
+    pages = pages.strip()
+    match = pages_regex.match(pages)
+    if match:
+        prefix, start, end_prefix, end = match.groups()
+        if len(end) < len(start):
+            end = start[:len(start) - len(end)] + end # 203-5 -> 203-205
+        if prefix.lower() == end_prefix.lower() or not end_prefix:
+            return f'{prefix.lower()}{start}-{prefix.lower()}{end}' if start != end else f'{prefix.lower()}{start}'
+        return f'{prefix.lower()}{start}-{end_prefix.lower()}{end}'
+    match = single_page_regex.match(pages)
+    return match[1].lower() if match else simplify(pages) or None # e.g. roman numerals
+
+def normalise(reference):
+    """
+    Returns:
+    keys (dict): The normalised author, year, title, journal and pages of a Reference, None where missing.
+    """
+    return {'author': normalise_authors(reference.authors), 'year': reference.year, 'title': normalise_title(reference.title),
+            'journal': normalise_journal(reference.journal or reference.journal_abbreviation), 'pages': normalise_pages(reference.pages)}
+
+# Clustering
+
+class UnionFind:
+    """
+    Clusters of record numbers, the root of each cluster being its first (lowest numbered) record.
+    """
+    def __init__(self):
+        self.parent = array('q')
+
+    def add(self):
+        self.parent.append(len(self.parent))
+        return len(self.parent) - 1
+
+    def find(self, record):
+        parent = self.parent
+        while parent[record] != record:
+            parent[record] = parent[parent[record]] # path halving
+            record = parent[record]
+        return record
+
+    def union(self, first, second):
+        """
+        Returns:
+        merged_root (int): The root of the later cluster, now part of the earlier one, or None if the records were already in the same cluster.
+        """
+        first_root, second_root = self.find(first), self.find(second)
+        if first_root == second_root:
+            return None
+        first_root, second_root = min(first_root, second_root), max(first_root, second_root)
+        self.parent[second_root] = first_root
+        return second_root
+
+class NearTitleIndex:
+    """
+    MinHash signatures of title shingles, banded so titles sharing a band can be found without comparing every pair of titles.
+    """
+    def __init__(self, threshold = default_near_title_threshold):
+        import numpy as np
+        self.np = np
+        generator = np.random.default_rng(0)
+        # Multiply-shift hash functions, (a * h + b) >> 32 with a odd
+        self.multipliers = generator.integers(0, 1 << 63, signature_length, dtype = np.uint64) * np.uint64(2) + np.uint64(1)
+        self.increments = generator.integers(0, 1 << 63, signature_length, dtype = np.uint64)
+        self.threshold = threshold
+        self.band_bytes = 4 * signature_length // bands
+        self.buckets = [{} for band in range(bands)] # band of signature and year: record number, or a list of them once there are more than one
+        self.signatures = {} # record number: signature as bytes
+
+    def signatures_of(self, titles):
+        """
+        Returns:
+        signatures (numpy.ndarray): A row of signature_length MinHash values (32 bit) for each title.
+        """
+        np = self.np
+        # Each title padded with spaces (so the first and last words make shingles of their own), as code points end to end
+        padded_titles = [f' {title} '.ljust(shingle_length) for title in titles]
+        codes = np.frombuffer(''.join(padded_titles).encode('utf-32-le'), dtype = np.uint32).astype(np.uint64)
+        lengths = np.array([len(padded_title) for padded_title in padded_titles])
+        title_starts = np.cumsum(lengths) - lengths
+        shingle_counts = lengths - shingle_length + 1
+        shingle_starts = np.cumsum(shingle_counts) - shingle_counts
+        # The position in codes of each shingle of each title
+        positions = np.repeat(title_starts - shingle_starts, shingle_counts) + np.arange(shingle_counts.sum())
+        hashes = codes[positions]
+        for offset in range(1, shingle_length):
+            hashes = (hashes * np.uint64(1000003)) ^ codes[positions + offset]
+        hashes = (hashes * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32) # mixed down to 32 bits
+        # Each hash function in turn over every shingle (one row at a time stays in the processor cache), keeping the smallest for each title
+        signatures = np.empty((len(titles), signature_length), dtype = np.uint32)
+        values = np.empty_like(hashes)
+        for function in range(signature_length):
+            np.multiply(hashes, self.multipliers[function], out = values)
+            values += self.increments[function]
+            values >>= np.uint64(32)
+            signatures[:, function] = np.minimum.reduceat(values, shingle_starts)
+        return signatures
+
+    def similarity(self, signature_bytes, other_signature_bytes):
+        np = self.np
+        return (np.frombuffer(signature_bytes, dtype = np.uint32) == np.frombuffer(other_signature_bytes, dtype = np.uint32)).mean()
+
+    def find_and_add(self, record, signature_bytes, year):
+        """
+        Finds earlier records with near-identical titles (and the same year), then adds this record.
+
+        Returns:
+        matches (list): The record numbers of the matching earlier records.
+        """
+        matches = []
+        compared = set()
+        year_bytes = str(year).encode()
+        band_bytes = self.band_bytes
+        for band, buckets in enumerate(self.buckets):
+            band_key = signature_bytes[band * band_bytes:(band + 1) * band_bytes] + year_bytes
+            bucket = buckets.get(band_key)
+            if bucket is None:
+                buckets[band_key] = record
+                continue
+            if not isinstance(bucket, list):
+                bucket = buckets[band_key] = [bucket]
+            for other in bucket[-max_bucket_comparisons:]:
+                if other not in compared:
+                    compared.add(other)
+                    if self.similarity(signature_bytes, self.signatures[other]) >= self.threshold:
+                        matches.append(other)
+            bucket.append(record)
+        self.signatures[record] = signature_bytes
+        return matches
+
+    def link(self, titles, clusters, links, rule_counts):
+        """
+        Links records with near-identical titles, in the order of the records.
+
+        Parameters:
+        titles (list): (record, normalised title, year) for each record to compare, all with a year.
+        clusters (UnionFind), links (dict), rule_counts (dict): As returned by deduplicate, updated with the links found.
+        """
+        for batch_start in range(0, len(titles), signature_batch_size):
+            batch = titles[batch_start:batch_start + signature_batch_size]
+            signatures = self.signatures_of([title for record, title, year in batch])
+            for (record, title, year), signature in zip(batch, signatures):
+                for earlier in self.find_and_add(record, signature.tobytes(), year):
+                    merged_root = clusters.union(earlier, record)
+                    if merged_root is not None:
+                        links[merged_root] = (earlier if merged_root == record else record, near_title_rule)
+                        rule_counts[near_title_rule] = rule_counts[near_title_rule] + 1
+
+def deduplicate(references, rule_names = default_rules, near_titles = False, near_title_threshold = default_near_title_threshold):
+    """
+    Finds the duplicate records of an export in one pass (and a second over the titles of the records left, for near-identical titles).
+
+    Parameters:
+    references (iterable): The Reference of each record, in order.
+    rule_names (list): The rules of the Leeds method to use, in order (keys of rules).
+    near_titles (bool): Whether to also link records with near-identical titles and the same year (requires numpy).
+    near_title_threshold (float): The estimated similarity of titles to count as near-identical, from 0 to 1.
+
+    Returns:
+    clusters (UnionFind): The cluster of each record (by number, from 0).
+    links (dict): For each record joining the cluster of an earlier record, (record it matched, rule name) for the rule which joined it (the first in order).
+    Every record but the first of each cluster has a link.
+    rule_counts (dict): The number of records each rule linked.
+    """
+    clusters = UnionFind()
+    rule_keys = [(rule_name, itemgetter(*rules[rule_name]), {}) for rule_name in rule_names]
+    links = {}
+    rule_counts = dict.fromkeys(list(rule_names) + ([near_title_rule] if near_titles else []), 0)
+    unlinked_titles = [] # titles of the records not linked by any rule, for near-identical titles
+    for reference in references:
+        record = clusters.add()
+        keys = normalise(reference)
+        for rule_name, rule_key, index in rule_keys:
+            key = rule_key(keys)
+            if None in key:
+                continue # missing values never match
+            earlier = index.setdefault(key, record)
+            if earlier != record:
+                merged_root = clusters.union(earlier, record)
+                if merged_root is not None:
+                    # The record itself the first time, an earlier cluster it also matches after that
+                    links[merged_root] = (earlier if merged_root == record else record, rule_name)
+                    rule_counts[rule_name] = rule_counts[rule_name] + 1
+        if near_titles and record not in links and keys['title'] is not None and keys['year'] is not None:
+            # Records already linked are left out, as their titles match an earlier record which is compared instead,
+            # and so are records without a year, as with the other rules a missing year never matches
+            unlinked_titles.append((record, keys['title'], keys['year']))
+    if near_titles:
+        NearTitleIndex(near_title_threshold).link(unlinked_titles, clusters, links, rule_counts)
+    return clusters, links, rule_counts
+
+def read_rule_names(text):
+    """
+    Reads a list of rules such as '1-8,10'.
+    """
+    rule_names = []
+    for part in text.split(','):
+        first, _, last = part.strip().partition('-')
+        rule_names.extend(str(number) for number in range(int(first), int(last or first) + 1))
+    unknown = [rule_name for rule_name in rule_names if rule_name not in rules]
+    if unknown:
+        raise ValueError(f'Unknown rules {unknown}, the rules are numbered 1 to {len(rules)}')
+    return rule_names
+
+def read_exports(paths):
+    for path in paths:
+        for reference in read_references(path):
+            yield path, reference
+
+def write_duplicates(output_path, paths, clusters, links):
+    """
+    Writes a row for each record (reading the exports again, so the records do not need to be kept in memory).
+    """
+    with open(output_path, 'w', newline = '', encoding = 'utf-8') as output_file:
+        csv_writer = csv.writer(output_file)
+        csv_writer.writerow(['record', 'file', 'accession_number', 'first_author', 'year', 'title', 'cluster', 'keep', 'linked_to', 'rule'])
+        for record, (path, reference) in enumerate(read_exports(paths)):
+            cluster = clusters.find(record)
+            earlier, rule_name = links.get(record, (None, ''))
+            csv_writer.writerow([record + 1, path, reference.accession_number, reference.authors[0] if reference.authors else '', reference.year, reference.title,
+                                 cluster + 1, cluster == record, earlier + 1 if earlier is not None else '', rule_name])
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Find duplicate records in RIS or MEDLINE exports using the Leeds method.')
+    parser.add_argument('exports', nargs = '+', help = 'RIS or MEDLINE export files, deduplicated together')
+    parser.add_argument('-o', '--output', required = True, help = 'CSV file to write a row for each record to')
+    parser.add_argument('--rules', default = ','.join(default_rules), help = f'rules of the Leeds method to use, e.g. 1-10 (default: {",".join(default_rules)})')
+    parser.add_argument('--near-titles', action = 'store_true', help = 'also link records with near-identical titles in the same year')
+    parser.add_argument('--threshold', type = float, default = default_near_title_threshold, help = f'similarity of near-identical titles, 0 to 1 (default: {default_near_title_threshold})')
+    parsed = parser.parse_args(arguments)
+    try:
+        rule_names = read_rule_names(parsed.rules)
+    except ValueError as error:
+        parser.error(str(error))
+
+    start = time.perf_counter()
+    clusters, links, rule_counts = deduplicate((reference for path, reference in read_exports(parsed.exports)), rule_names, parsed.near_titles, parsed.threshold)
+    record_count = len(clusters.parent)
+    print(f'Read {record_count} records, {record_count - len(links)} unique, in {time.perf_counter() - start:.1f} seconds')
+    for rule_name, count in rule_counts.items():
+        if rule_name == near_title_rule:
+            print(f'Near-identical title + year: {count} duplicates')
+        else:
+            print(f'Rule {rule_name} ({" + ".join(rules[rule_name])}): {count} duplicates')
+    write_duplicates(parsed.output, parsed.exports, clusters, links)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
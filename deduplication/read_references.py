@@ -0,0 +1,241 @@
+# Streaming reader for bibliographic database exports in RIS or MEDLINE (PubMed and Ovid) tagged format,
+# to replace loading exports with revtools read_bibliography in dedup_exploration.R (slow on an 8.3K record export,
+# and picks up parts of keywords such as DNA as if they were tags)
+# Records are read a line at a time and yielded one by one as Reference objects, so memory use stays the same however long the export is
+# Usage:
+# python read_references.py export.ris -o references.parquet     (or .csv)
+# from read_references import read_references
+# for reference in read_references('export.txt'): ...
+
+import argparse
+import csv
+import re
+import sys
+
+parquet_batch_rows = 50000 # records collected before a row group is written to a Parquet file
+
+# A tag starts the line and is followed by a hyphen, anything else continues the value of the tag before it
+ris_tag_regex = re.compile(r'([A-Z][A-Z0-9])  -(?: (.*)|$)') # TI  - Title
+medline_tag_regex = re.compile(r'([A-Z][A-Z0-9]{1,3}) {0,3}- (.*)') # TI  - Title, PMID- 12345
+
+class Reference:
+    """
+    One record of an export, with the fields used for deduplicating. Tags not read into a field are kept in extra only when asked for.
+    """
+    __slots__ = ('record_type', 'authors', 'title', 'journal', 'journal_abbreviation', 'year', 'volume', 'issue', 'pages',
+                 'doi', 'issn', 'abstract', 'keywords', 'accession_number', 'extra')
+    list_fields = ('authors', 'keywords')
+
+    def __init__(self):
+        for field in self.__slots__:
+            setattr(self, field, None)
+        self.authors = []
+        self.keywords = []
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__ if field != 'extra'}
+
+    def __repr__(self):
+        return f'Reference({self.as_dict()!r})'
+
+fields = [field for field in Reference.__slots__ if field != 'extra']
+
+# Tags read into each field, the first tag found is kept for fields which are not lists
+ris_fields = {'TY': 'record_type', 'AU': 'authors', 'A1': 'authors', 'TI': 'title', 'T1': 'title', 'CT': 'title',
+              'JF': 'journal', 'JO': 'journal', 'T2': 'journal', 'JA': 'journal_abbreviation', 'J2': 'journal_abbreviation',
+              'PY': 'year', 'Y1': 'year', 'DA': 'year', 'VL': 'volume', 'IS': 'issue', 'DO': 'doi', 'SN': 'issn',
+              'AB': 'abstract', 'N2': 'abstract', 'KW': 'keywords', 'AN': 'accession_number'}
+# PubMed tags, then the Ovid tags which differ from them (Ovid uses two letter tags such as JN - journal, VO - volume, SH - subject heading)
+medline_fields = {'PT': 'record_type', 'FAU': 'authors', 'TI': 'title', 'JT': 'journal', 'TA': 'journal_abbreviation',
+                  'DP': 'year', 'YR': 'year', 'VI': 'volume', 'IP': 'issue', 'PG': 'pages', 'IS': 'issn',
+                  'AB': 'abstract', 'OT': 'keywords', 'MH': 'keywords', 'PMID': 'accession_number', 'UI': 'accession_number',
+                  'FA': 'authors', 'JN': 'journal', 'VO': 'volume', 'SH': 'keywords', 'KW': 'keywords', 'DO': 'doi'}
+
+year_regex = re.compile(r'(1[5-9]|20)\d\d')
+doi_regex = re.compile(r'(10\.\S+)\s*\[doi\]')
+bare_doi_regex = re.compile(r'10\.\S+') # Ovid gives DOIs as links, e.g. https://dx.doi.org/10.1016/...
+source_journal_regex = re.compile(r'(.+?)\.\s') # the journal at the start of a source, e.g. Lancet. 392(10151):1000-10, 2018
+
+def detect_format(path):
+    """
+    Works out whether a file is in RIS or MEDLINE format from its first tag.
+
+    Returns:
+    file_format (str): 'ris' or 'medline'.
+    """
+    with open(path, 'r', encoding = 'utf-8-sig', errors = 'replace') as export_file:
+        for line in export_file:
+            match = ris_tag_regex.match(line) or medline_tag_regex.match(line)
+            if match:
+                # RIS records start with their type, Ovid MEDLINE tags look like RIS tags but start with another tag
+                return 'ris' if match[1] == 'TY' else 'medline'
+    raise ValueError(f'No RIS or MEDLINE tags found in {path}')
+
+def read_tagged_lines(lines, tag_regex, end_tag = None):
+    """
+    Groups the lines of a tagged export into records.
+
+    Parameters:
+    lines (iterable): The lines of the export.
+    tag_regex (re.Pattern): Matches a line starting a tag, with the tag and value as its groups.
+    end_tag (str): The tag ending each record (ER for RIS), or None for records separated by blank lines (MEDLINE).
+
+    Returns:
+    records (generator): For each record, a list of [tag, value] pairs with continuation lines joined on to their values.
+    """
+    record = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        match = tag_regex.match(line)
+        if match:
+            tag, value = match[1], (match[2] or '').strip()
+            if tag == end_tag:
+                if record:
+                    yield record
+                record = []
+                continue
+            record.append([tag, value])
+        elif not line.strip():
+            if end_tag is None and record:
+                yield record
+                record = []
+        elif record:
+            # A continuation line (indented in MEDLINE, unindented wrapped text in some RIS exports)
+            record[-1][1] = (record[-1][1] + ' ' + line.strip()).strip()
+    if record:
+        yield record
+
+def make_reference(record, tag_fields, keep_extra = False):
+    """
+    Fills a Reference from the [tag, value] pairs of a record.
+    """
+    reference = Reference()
+    start_page, end_page = None, None
+    short_authors = []
+    source = None
+    extra = {} if keep_extra else None
+    for tag, value in record:
+        field = tag_fields.get(tag)
+        if field in Reference.list_fields:
+            if value:
+                getattr(reference, field).append(value)
+        elif field is not None:
+            if getattr(reference, field) is None and value:
+                setattr(reference, field, value)
+        elif tag == 'SP':
+            start_page = start_page or value
+        elif tag == 'EP':
+            end_page = end_page or value
+        elif tag in ('AID', 'LID') and reference.doi is None and doi_regex.match(value):
+            reference.doi = doi_regex.match(value)[1]
+        elif tag == 'AU' and tag_fields is medline_fields:
+            short_authors.append(value)
+        elif tag == 'SO' and tag_fields is medline_fields:
+            source = source or value
+        elif keep_extra:
+            extra.setdefault(tag, []).append(value)
+    if not reference.authors:
+        # Short MEDLINE author names (Smith J) are only used where there are no full names (FAU, or FA in Ovid)
+        reference.authors = short_authors
+    if reference.journal is None and source is not None and source_journal_regex.match(source):
+        # Ovid exports without a journal (JN) tag still have the source citation
+        reference.journal = source_journal_regex.match(source)[1]
+    if reference.doi is not None:
+        doi_match = bare_doi_regex.search(reference.doi)
+        reference.doi = doi_match[0] if doi_match else None
+    if start_page is not None:
+        reference.pages = start_page + ('-' + end_page if end_page else '')
+    if reference.year is not None:
+        year_match = year_regex.search(reference.year)
+        reference.year = int(year_match[0]) if year_match else None
+    reference.extra = extra
+    return reference
+
+def read_references(path, file_format = None, keep_extra = False):
+    """
+    Reads the records of an RIS or MEDLINE export one at a time.
+
+    Parameters:
+    path (str): The path of the export file.
+    file_format (str): 'ris' or 'medline', worked out from the file if not given.
+    keep_extra (bool): Whether to keep the tags not read into a field in the extra dictionary of each Reference (tag: list of values).
+
+    Returns:
+    references (generator): Yields a Reference for each record.
+    """
+    file_format = file_format or detect_format(path)
+    if file_format == 'ris':
+        tag_regex, end_tag, tag_fields = ris_tag_regex, 'ER', ris_fields
+    elif file_format == 'medline':
+        tag_regex, end_tag, tag_fields = medline_tag_regex, None, medline_fields
+    else:
+        raise ValueError(f'Unknown format {file_format}, use ris or medline')
+    with open(path, 'r', encoding = 'utf-8-sig', errors = 'replace') as export_file:
+        for record in read_tagged_lines(export_file, tag_regex, end_tag):
+            yield make_reference(record, tag_fields, keep_extra)
+
+def write_csv(references, output_path):
+    """
+    Writes references to a CSV file, with authors and keywords separated by semicolons.
+
+    Returns:
+    count (int): The number of references written.
+    """
+    count = 0
+    with open(output_path, 'w', newline = '', encoding = 'utf-8') as output_file:
+        csv_writer = csv.writer(output_file)
+        csv_writer.writerow(fields)
+        for reference in references:
+            csv_writer.writerow(['; '.join(value) if field in Reference.list_fields else value
+                                 for field, value in zip(fields, (getattr(reference, field) for field in fields))])
+            count = count + 1
+    return count
+
+def write_parquet(references, output_path):
+    """
+    Writes references to a Parquet file a batch at a time, with authors and keywords as lists.
+    Requires the pyarrow package (py -m pip install pyarrow).
+
+    Returns:
+    count (int): The number of references written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([(field, pa.list_(pa.string()) if field in Reference.list_fields else pa.int32() if field == 'year' else pa.string())
+                        for field in fields])
+    count = 0
+    with pq.ParquetWriter(output_path, schema) as parquet_writer:
+        batch = []
+        for reference in references:
+            batch.append(reference)
+            if len(batch) >= parquet_batch_rows:
+                parquet_writer.write_table(references_table(batch, schema))
+                count = count + len(batch)
+                batch = []
+        if batch:
+            parquet_writer.write_table(references_table(batch, schema))
+            count = count + len(batch)
+    return count
+
+def references_table(references, schema):
+    import pyarrow as pa
+    return pa.Table.from_arrays([pa.array([getattr(reference, field.name) for reference in references], type = field.type) for field in schema],
+                                schema = schema)
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Read an RIS or MEDLINE export and write its records to a Parquet or CSV file.')
+    parser.add_argument('export', help = 'the RIS or MEDLINE export file')
+    parser.add_argument('-o', '--output', required = True, help = 'file to write, .parquet for Parquet and CSV for anything else')
+    parser.add_argument('--format', choices = ['ris', 'medline'], help = 'format of the export (default: worked out from the file)')
+    parsed = parser.parse_args(arguments)
+
+    references = read_references(parsed.export, parsed.format)
+    if parsed.output.lower().endswith('.parquet'):
+        count = write_parquet(references, parsed.output)
+    else:
+        count = write_csv(references, parsed.output)
+    print(f'Wrote {count} records to {parsed.output}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
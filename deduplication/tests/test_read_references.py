@@ -0,0 +1,35 @@
+# Tests of reading Ovid MEDLINE and Embase exports, whose tags differ from PubMed's
+# Run with python -m pytest from the deduplication folder
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from read_references import detect_format, read_references
+
+ovid_export = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ovid_medline.txt')
+
+def test_ovid_detected_as_medline():
+    assert detect_format(ovid_export) == 'medline'
+
+def test_ovid_fields():
+    first, second = read_references(ovid_export)
+    assert first.authors == ['Smith, John', 'Jones, Anna B']
+    assert first.title == 'Screening for breast cancer with mammography in women aged 40 to 49: a randomised trial.'
+    assert first.journal == 'Lancet'
+    assert first.volume == '392'
+    assert first.issue == '10151'
+    assert first.pages == '1000-1010'
+    assert first.year == 2018
+    assert first.doi == '10.1016/S0140-6736(18)31234-5'
+    assert first.keywords == ['*Breast Neoplasms/di [Diagnosis]', 'Female', 'Humans', '*Mammography']
+    assert first.accession_number == '30234567'
+
+def test_ovid_journal_from_source():
+    first, second = read_references(ovid_export)
+    assert second.journal == 'Archives of Disease in Childhood'
+    assert second.volume == '104'
+    assert second.authors == ['Brown C']
+    assert second.doi == '10.1136/archdischild-2018-315123'
+    assert second.keywords == ['impetigo']
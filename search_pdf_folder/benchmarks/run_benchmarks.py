@@ -0,0 +1,210 @@
+# Benchmarks for search_in_files.py, run offline against synthetic PDF corpora (see synthetic_pdfs.py)
+# For each scenario (a corpus, a way of reading it and a set of terms) reports throughput, per-file latency percentiles
+# and peak Python memory, and compares them with a stored baseline so changes to process_file, extract_pages
+# or the term matching can be checked for speed-ups and slow-downs
+# Usage:
+# python run_benchmarks.py --save-baseline     (before making a change)
+# python run_benchmarks.py                     (after, compares with the baseline and exits with 1 if anything got slower)
+# python run_benchmarks.py --scenarios stored  (only the scenarios with stored in their name)
+# Corpora are generated into the corpora folder here the first time they are needed and reused afterwards
+
+# Modes:
+# extract - every file is read with pdfplumber and all matches returned (no text store)
+# stream - files are read a page at a time with a results limit, stopping early (no text store)
+# stored - the text comes from a warmed up text store, so this times the matching alone
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+benchmarks_folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_folder)) # search_pdf_folder
+import search_in_files
+import term_matching
+import text_store
+from synthetic_pdfs import generate_corpus, vocabulary, cross_page_phrase
+
+corpora_foldername = 'corpora'
+baseline_filename = 'baseline.json'
+default_repeats = 3 # each scenario is timed this many times and the fastest run kept
+default_tolerance = 0.1 # slow-downs of more than this fraction compared with the baseline are reported as regressions
+stream_results_limit = 3
+
+corpora = {
+    'small': dict(files = 5, pages_per_file = 4, words_per_page = 300, cross_page_matches = 2),
+    'many_files': dict(files = 40, pages_per_file = 2, words_per_page = 300, cross_page_matches = 1),
+    'long_reports': dict(files = 2, pages_per_file = 60, words_per_page = 300, cross_page_matches = 10),
+    'dense': dict(files = 5, pages_per_file = 4, words_per_page = 1200, cross_page_matches = 2),
+}
+
+cross_page_term = cross_page_phrase[0] + r'\W+' + cross_page_phrase[1]
+term_sets = {
+    'literals': ['cancer', 'prostate cancer', 'public health', 'vaccination', 'antimicrobial resistance', 'tuberculosis', 'sepsis', 'corona virus',
+                 cross_page_term],
+    'wildcards': [r'tumou?r', r'prostate\W+(\w+\W+){,3}cancer', r'\w+omas?\b', r'(child|children)\W+\w+\W+(health|outcome)',
+                  r'vaccin\w*\W+(\w+\W+){,5}(dose|adult)', r'\b\w*ic\b', r'(in|of)\W+\w+\W+(patients|children)', cross_page_term],
+    # A long list of literals, as when searching for many drug or place names, mostly not present in the text
+    'large_list': [f'{first} {second}' for first in vocabulary[:25] for second in vocabulary[25:45]] + [cross_page_term],
+}
+
+# (corpus, mode, term set) - extraction is slow so the reading modes use one term set and the stored mode all of them
+scenarios = [(corpus, mode, 'literals') for corpus in corpora for mode in ('extract', 'stream')] + \
+            [(corpus, 'stored', term_set) for corpus in corpora for term_set in term_sets]
+
+def scenario_name(corpus, mode, term_set):
+    return f'{corpus}/{mode}/{term_set}'
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile, e.g. percentile(latencies, 0.95).
+    """
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered) + 0.5), len(ordered)) - 1] if ordered else None
+
+def search_corpus(folder, pdf_filenames, terms, mode, store = None):
+    """
+    Searches each file of a corpus in this process, as a single worker of search_in_files.py would.
+
+    Returns:
+    latencies (list): The seconds taken by each file.
+    results (list): The results of all files.
+    """
+    term_matching.get_matcher.cache_clear() # each run builds the matcher, as each worker process does
+    store_folder = store.store_folder if store is not None else None
+    results_limit = stream_results_limit if mode == 'stream' else 0
+    latencies = []
+    results = []
+    for filename in pdf_filenames:
+        start = time.perf_counter()
+        file_results, store_entry = search_in_files.process_file(folder, filename, terms, results_limit, store_folder,
+                                                                 store.entry(filename) if store is not None else None)
+        latencies.append(time.perf_counter() - start)
+        results.extend(file_results)
+        if store is not None:
+            store.index[filename] = store_entry
+    return latencies, results
+
+def run_scenario(corpus, mode, term_set, repeats, measure_memory):
+    """
+    Times one scenario.
+
+    Returns:
+    measurements (dict): Throughput, latency percentiles, peak memory and result counts for the scenario.
+    """
+    folder = os.path.join(benchmarks_folder, corpora_foldername, corpus)
+    details = generate_corpus(folder, **corpora[corpus])
+    pdf_filenames = search_in_files.find_pdf_files(folder)
+    terms = term_sets[term_set]
+    store = None
+    if mode == 'stored':
+        store = text_store.TextStore(os.path.join(folder, search_in_files.text_store_foldername))
+        search_corpus(folder, pdf_filenames, terms, mode, store) # warm up the text store
+        store.save(store.index)
+    runs = [search_corpus(folder, pdf_filenames, terms, mode, store) for repeat in range(repeats)]
+    latencies, results = min(runs, key = lambda run: sum(run[0]))
+    total_seconds = sum(latencies)
+    measurements = {
+        'files': len(pdf_filenames), 'pages': details['pages'], 'terms': len(terms), 'results': len(results),
+        'seconds': total_seconds,
+        'pages_per_second': details['pages'] / total_seconds,
+        'files_per_second': len(pdf_filenames) / total_seconds,
+        'latency_p50_seconds': percentile(latencies, 0.5),
+        'latency_p95_seconds': percentile(latencies, 0.95),
+        'latency_max_seconds': max(latencies),
+    }
+    if mode != 'stream':
+        # Every planted phrase should be found even though it runs across a page break
+        found = sum(result.term == cross_page_term for result in results)
+        measurements['cross_page_matches_found'] = found
+        measurements['cross_page_matches_planted'] = details['planted_cross_page_phrases']
+    if measure_memory:
+        # A separate run as tracing memory slows everything down
+        tracemalloc.start()
+        search_corpus(folder, pdf_filenames, terms, mode, store)
+        measurements['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return measurements
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results with a baseline, printing the change for each scenario.
+
+    Returns:
+    regressions (list): The names of the scenarios which were slower (or used more memory) than the baseline by more than tolerance.
+    """
+    regressions = []
+    print('\nChanges are against the baseline, positive is better (faster or less memory)')
+    print(f'{"scenario":40} {"pages/s":>10} {"change":>8} {"p95 ms":>10} {"change":>8} {"peak MB":>9} {"change":>8}')
+    for name, measurements in results.items():
+        previous = baseline.get(name)
+        def change(key, higher_is_better):
+            if previous is None or previous.get(key) in (None, 0) or measurements.get(key) is None:
+                return None
+            ratio = measurements[key] / previous[key]
+            return ratio - 1 if higher_is_better else 1 - ratio
+        throughput_change = change('pages_per_second', True)
+        latency_change = change('latency_p95_seconds', False)
+        memory_change = change('peak_memory_bytes', False)
+        def show(value):
+            return f'{value:+8.1%}' if value is not None else f'{"-":>8}'
+        peak_memory = measurements.get('peak_memory_bytes')
+        memory_text = f'{peak_memory / 1e6:.1f}' if peak_memory is not None else '-'
+        print(f'{name:40} {measurements["pages_per_second"]:10.1f} {show(throughput_change)} {measurements["latency_p95_seconds"] * 1000:10.1f} {show(latency_change)} '
+              f'{memory_text:>9} {show(memory_change)}')
+        if any(value is not None and value < -tolerance for value in (throughput_change, latency_change, memory_change)):
+            regressions.append(name)
+    return regressions
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark search_in_files.py on synthetic PDF corpora and compare with a baseline.')
+    parser.add_argument('--scenarios', action = 'append', metavar = 'TEXT', help = 'only run scenarios whose name (corpus/mode/terms) contains this text (can be repeated)')
+    parser.add_argument('--repeats', type = int, default = default_repeats, help = f'times to run each scenario, the fastest is kept (default: {default_repeats})')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'skip the peak memory runs')
+    parser.add_argument('--baseline', default = os.path.join(benchmarks_folder, baseline_filename), help = 'baseline results file')
+    parser.add_argument('--save-baseline', action = 'store_true', help = 'save these results as the baseline instead of comparing with it')
+    parser.add_argument('--tolerance', type = float, default = default_tolerance, help = f'fraction slower than the baseline counted as a regression (default: {default_tolerance})')
+    parser.add_argument('-o', '--output', help = 'also write the results to this JSON file')
+    parsed = parser.parse_args(arguments)
+
+    results = {}
+    failures = []
+    for corpus, mode, term_set in scenarios:
+        name = scenario_name(corpus, mode, term_set)
+        if parsed.scenarios and not any(text in name for text in parsed.scenarios):
+            continue
+        print(f'Running {name}', flush = True)
+        measurements = run_scenario(corpus, mode, term_set, max(parsed.repeats, 1), not parsed.no_memory)
+        results[name] = measurements
+        if measurements.get('cross_page_matches_found') != measurements.get('cross_page_matches_planted'):
+            failures.append(name)
+
+    report = {'python': sys.version.split()[0], 'results': results}
+    if parsed.output is not None:
+        with open(parsed.output, 'w', encoding = 'utf-8') as output_file:
+            json.dump(report, output_file, indent = 1)
+    baseline = {}
+    if not parsed.save_baseline and os.path.exists(parsed.baseline):
+        with open(parsed.baseline, 'r', encoding = 'utf-8') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    regressions = compare(results, baseline, parsed.tolerance)
+    if parsed.save_baseline:
+        # Merge so that saving a subset of scenarios keeps the rest of the baseline
+        if os.path.exists(parsed.baseline):
+            with open(parsed.baseline, 'r', encoding = 'utf-8') as baseline_file:
+                report['results'] = dict(json.load(baseline_file)['results'], **results)
+        with open(parsed.baseline, 'w', encoding = 'utf-8') as baseline_file:
+            json.dump(report, baseline_file, indent = 1)
+        print(f'\nSaved baseline to {parsed.baseline}')
+    elif not baseline:
+        print(f'\nNo baseline at {parsed.baseline} to compare with, run with --save-baseline first')
+    for name in failures:
+        print(f'{name}: found {results[name]["cross_page_matches_found"]} of {results[name]["cross_page_matches_planted"]} matches planted across page breaks')
+    for name in regressions:
+        print(f'{name}: slower than the baseline by more than {parsed.tolerance:.0%}')
+    return 1 if failures or regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
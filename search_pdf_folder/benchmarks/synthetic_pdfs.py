@@ -0,0 +1,111 @@
+# Generates folders of synthetic PDF files for benchmarking search_in_files.py without needing real reports
+# The PDF files are written directly (one Helvetica text object per page) so no PDF library is needed,
+# and the same seed always gives the same files
+# A phrase is planted across page breaks (the last word of a page and the first word of the next)
+# so benchmarks can check matches that cross pages are still found
+
+import json
+import os
+import random
+
+vocabulary = ('the of and in to with for was were by on from patients study trial review cohort risk outcome health public '
+              'screening infection bacterial virus corona invasive child children adult mortality incidence prevalence '
+              'tumour tumor cancer carcinoma lymphoma melanoma prostate lung bowel breast vaccine vaccination dose '
+              'hospital admission surveillance antimicrobial resistance sepsis influenza measles tuberculosis').split()
+cross_page_phrase = ('interim', 'findings') # planted across page breaks, neither word is in the vocabulary so every match is a planted one
+corpus_details_filename = 'corpus.json'
+line_width = 90 #characters, roughly what fits across the page at 10 point
+
+def escape_pdf_string(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def write_pdf(path, pages, title):
+    """
+    Writes a minimal PDF file with a line of text per string.
+
+    Parameters:
+    path (str): The path of the PDF file to write.
+    pages (list): For each page, a list of lines of text (Latin-1 characters only).
+    title (str): The title metadata of the PDF file.
+    """
+    objects = [b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>', None] # the page tree is filled in once the pages are numbered
+    font_number, pages_number = 1, 2
+    page_numbers = []
+    for lines in pages:
+        content = 'BT /F1 10 Tf 40 800 Td 12 TL ' + ' '.join(f"({escape_pdf_string(line)}) '" for line in lines) + ' ET'
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content.encode('latin-1')))
+        objects.append(b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Contents %d 0 R /Resources << /Font << /F1 %d 0 R >> >> >>'
+                       % (pages_number, len(objects), font_number))
+        page_numbers.append(len(objects))
+    objects[pages_number - 1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % number for number in page_numbers), len(page_numbers))
+    objects.append(b'<< /Title (%s) >>' % escape_pdf_string(title).encode('latin-1'))
+    info_number = len(objects)
+    objects.append(b'<< /Type /Catalog /Pages %d 0 R >>' % pages_number)
+    catalog_number = len(objects)
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, pdf_object in enumerate(objects, start = 1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n%s\nendobj\n' % (number, pdf_object)
+    xref_offset = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    output += b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, catalog_number, info_number, xref_offset)
+    with open(path, 'wb') as pdf_file:
+        pdf_file.write(output)
+
+def make_page(generator, words_per_page):
+    words = [generator.choice(vocabulary) for i in range(words_per_page)]
+    lines = []
+    line = ''
+    for word in words:
+        if line and len(line) + len(word) + 1 > line_width:
+            lines.append(line)
+            line = word
+        else:
+            line = f'{line} {word}' if line else word
+    lines.append(line)
+    return lines
+
+def generate_corpus(folder, files, pages_per_file, words_per_page, seed = 0, cross_page_matches = 0):
+    """
+    Writes a folder of synthetic PDF files, unless the folder already holds the same corpus.
+
+    Parameters:
+    folder (str): The folder to write the files to (created if needed).
+    files (int): The number of PDF files.
+    pages_per_file (int): The number of pages in each file.
+    words_per_page (int): The number of words on each page (the text density).
+    seed (int): The random seed, the same seed always gives the same files.
+    cross_page_matches (int): The number of page breaks in each file to plant cross_page_phrase across.
+
+    Returns:
+    details (dict): The settings of the corpus plus its total pages and bytes and the number of planted cross-page phrases.
+    """
+    settings = {'files': files, 'pages_per_file': pages_per_file, 'words_per_page': words_per_page, 'seed': seed, 'cross_page_matches': cross_page_matches}
+    details_path = os.path.join(folder, corpus_details_filename)
+    if os.path.exists(details_path):
+        with open(details_path, 'r', encoding = 'utf-8') as details_file:
+            details = json.load(details_file)
+        if details['settings'] == settings:
+            return details
+    os.makedirs(folder, exist_ok = True)
+    for entry in os.scandir(folder):
+        if entry.name.endswith('.pdf'):
+            os.remove(entry.path) # from an older corpus with different settings
+    generator = random.Random(seed)
+    planted = 0
+    for file_number in range(files):
+        pages = [make_page(generator, words_per_page) for page_number in range(pages_per_file)]
+        for page_number in generator.sample(range(pages_per_file - 1), min(cross_page_matches, pages_per_file - 1)):
+            pages[page_number][-1] = pages[page_number][-1] + ' ' + cross_page_phrase[0]
+            pages[page_number + 1][0] = cross_page_phrase[1] + ' ' + pages[page_number + 1][0]
+            planted = planted + 1
+        write_pdf(os.path.join(folder, f'synthetic_{file_number:04d}.pdf'), pages, f'Synthetic report {file_number}')
+    details = {'settings': settings, 'pages': files * pages_per_file,
+               'bytes': sum(entry.stat().st_size for entry in os.scandir(folder) if entry.name.endswith('.pdf')),
+               'planted_cross_page_phrases': planted}
+    with open(details_path, 'w', encoding = 'utf-8') as details_file:
+        json.dump(details, details_file, indent = 1)
+    return details
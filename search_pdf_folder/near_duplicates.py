@@ -0,0 +1,154 @@
+# Finds PDF files in a folder which are copies of each other - the same file under another name, a second download,
+# or the same report saved again (e.g. with different metadata) - so that only one file of each group needs searching
+# Each file is fingerprinted by the hash of its contents (identical files) and by a simhash of the word shingles on its
+# first pages (near-identical files, whose simhashes differ in at most max_simhash_distance of their 64 bits)
+# Simhashes that close must have at least one of simhash_blocks blocks of bits the same, so only files sharing a block are compared
+
+import hashlib
+import os
+import re
+
+import text_store
+
+fingerprint_pages = 2 # pages read from the start of each file for its simhash
+shingle_words = 3 # words in each shingle
+simhash_bits = 64
+max_simhash_distance = 3 # bits which may differ between near-identical files
+simhash_blocks = max_simhash_distance + 1
+min_fingerprint_words = 50 # files with fewer words on their first pages (e.g. scanned pages without text) are only matched by their hash
+fingerprint_chunk_size = 8 # files sent to a worker process at once, fingerprinting a file is quick
+word_regex = re.compile(r'\w+')
+
+def simhash(text):
+    """
+    Calculates the simhash of a text: each bit is set if more of the text's word shingles have that bit set in their hash than not,
+    so texts sharing most of their shingles have simhashes differing in only a few bits.
+
+    Parameters:
+    text (str): The text of the first pages of a PDF file.
+
+    Returns:
+    simhash (int): The simhash, or None if the text has fewer than min_fingerprint_words words.
+    """
+    words = word_regex.findall(text.lower())
+    if len(words) < min_fingerprint_words:
+        return None
+    shingles = {' '.join(words[start:start + shingle_words]) for start in range(len(words) - shingle_words + 1)}
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size = simhash_bits // 8).digest(), 'big') for shingle in shingles]
+    simhash = 0
+    for bit in range(simhash_bits):
+        if 2 * sum((value >> bit) & 1 for value in hashes) > len(hashes):
+            simhash |= 1 << bit
+    return simhash
+
+def first_pages_text(path):
+    """
+    Extracts the text of the first fingerprint_pages pages of a PDF file.
+    This uses pdfminer (which pdfplumber is built on) directly, a few times faster than pdfplumber as only the words are needed
+    and not the position of every character. The text of every file is extracted this way (never taken from the text store)
+    so that copies always get the same text.
+    """
+    from pdfminer.high_level import extract_text
+    return extract_text(path, maxpages = fingerprint_pages)
+
+def fingerprint_file(working_folder, filename, store_folder = None, store_entry = None):
+    """
+    Fingerprints one PDF file, the unit of work sent to each worker process.
+
+    Parameters:
+    working_folder (str): The path to the folder containing the PDF file.
+    filename (str): The name of the PDF file.
+    store_folder (str): The path to the text store folder, or None if no store is used.
+    store_entry (dict): The text store index entry for the file from the last run, or None.
+
+    Returns:
+    fingerprint (tuple): (content_hash, simhash) - the SHA-256 hash of the file, or None if it could not be read,
+                         and the simhash of the text of its first pages, or None if it has too little text or could not be read.
+    store_entry (dict): The up to date text store index entry for the file, or None if no store is used or the file could not be read.
+    """
+    try:
+        if store_folder is not None:
+            # The store keeps the hash of unchanged files, so they are not read again
+            store_entry = text_store.current_entry(os.path.join(working_folder, filename), store_entry)
+            content_hash = store_entry['hash']
+        else:
+            content_hash = text_store.file_hash(os.path.join(working_folder, filename))
+    except OSError:
+        return (None, None), None
+    try:
+        return (content_hash, simhash(first_pages_text(os.path.join(working_folder, filename)))), store_entry
+    except Exception: # e.g. corrupt or encrypted PDF files, reported when the file is searched
+        return (content_hash, None), store_entry
+
+def group_files(pdf_filenames, fingerprints):
+    """
+    Groups files with the same content hash or near-identical simhashes.
+
+    Parameters:
+    pdf_filenames (list): The names of the PDF files.
+    fingerprints (iterable): (content_hash, simhash) for each file, as returned by fingerprint_file.
+
+    Returns:
+    aliases (dict): For the first file of each group of more than one file, the other files of the group, in the order of pdf_filenames.
+    """
+    parents = list(range(len(pdf_filenames)))
+
+    def find(file_number):
+        while parents[file_number] != file_number:
+            parents[file_number] = parents[parents[file_number]]
+            file_number = parents[file_number]
+        return file_number
+
+    def union(first, second):
+        first_root, second_root = find(first), find(second)
+        if first_root != second_root:
+            # The root is the earliest file, which is the one searched
+            parents[max(first_root, second_root)] = min(first_root, second_root)
+
+    block_bits = simhash_bits // simhash_blocks
+    block_mask = (1 << block_bits) - 1
+    files_by_hash = {}
+    files_by_block = [{} for block in range(simhash_blocks)]
+    for file_number, (content_hash, file_simhash) in enumerate(fingerprints):
+        if content_hash is not None:
+            union(files_by_hash.setdefault(content_hash, file_number), file_number)
+        if file_simhash is None:
+            continue
+        compared = set()
+        for block, files in enumerate(files_by_block):
+            block_files = files.setdefault((file_simhash >> (block * block_bits)) & block_mask, [])
+            for other_number, other_simhash in block_files:
+                if other_number not in compared:
+                    compared.add(other_number)
+                    if bin(file_simhash ^ other_simhash).count('1') <= max_simhash_distance:
+                        union(other_number, file_number)
+            block_files.append((file_number, file_simhash))
+
+    aliases = {}
+    for file_number, filename in enumerate(pdf_filenames):
+        root = find(file_number)
+        if root != file_number:
+            aliases.setdefault(pdf_filenames[root], []).append(filename)
+    return aliases
+
+def find_duplicates(working_folder, pdf_filenames, executor = None, store_folder = None, store_entries = None):
+    """
+    Fingerprints PDF files and groups the copies of each other.
+
+    Parameters:
+    working_folder (str): The path to the folder containing the PDF files.
+    pdf_filenames (list): The names of the PDF files.
+    executor (ProcessPoolExecutor): A pool to fingerprint the files in, or None to fingerprint them in this process.
+    store_folder (str): The path to the text store folder, or None if no store is used.
+    store_entries (list): The text store index entry for each file from the last run, or None.
+
+    Returns:
+    aliases (dict): For the first file of each group of copies, the other files of the group (see group_files).
+    store_entries (list): The up to date text store index entry for each file (None if no store is used), so files are not hashed again when searched.
+    """
+    arguments = [[working_folder] * len(pdf_filenames), pdf_filenames, [store_folder] * len(pdf_filenames), store_entries or [None] * len(pdf_filenames)]
+    if executor is not None:
+        file_fingerprints = list(executor.map(fingerprint_file, *arguments, chunksize = fingerprint_chunk_size))
+    else:
+        file_fingerprints = list(map(fingerprint_file, *arguments))
+    return group_files(pdf_filenames, [fingerprint for fingerprint, store_entry in file_fingerprints]), [store_entry for fingerprint, store_entry in file_fingerprints]
@@ -0,0 +1,415 @@
+# Positional inverted index over the PDF files in a folder, for fast repeated searching of large archives
+# Build or update the index once (only new and changed files are read), then queries take milliseconds
+# rather than running regexes over the text of every file
+# Usage:
+# python pdf_index.py update "C:\path\to\folder"
+# python pdf_index.py search "C:\path\to\folder" "(prostate or bowel) adj3 cancer*" -o results.csv
+# Output has the same columns as search_in_files.py, with the query in the term column
+
+# Query syntax (similar to Ovid):
+# words are matched whole and ignoring case, e.g. cancer
+# truncation and wildcards - * or $ for any number of letters (e.g. canc*), ? for zero or one letter (e.g. tumo?r), # for exactly one letter (e.g. wom#n)
+# "quoted phrases" match the words next to each other in order, hyphenated words (e.g. covid-19) are treated as phrases
+# a adjN b - a and b within N words of each other in any order (adj1 is next to each other), a adj b - b straight after a
+# a and b, a or b, a not b - whether documents contain the words, matches of both sides are listed
+# Precedence is adjN, then not, then and, then or; use brackets to group, e.g. (prostate or bowel) adj3 cancer
+
+import argparse
+import os
+import re
+import sqlite3
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, repeat
+
+import search_in_files
+from result_writers import SearchResult, open_result_writer
+
+index_filename = '.search_index.sqlite' # created inside the target folder unless another path is given
+word_regex = re.compile(r'\w+')
+
+# Storage
+
+def compress_positions(positions):
+    """
+    Compresses a sorted list of integers by storing the gaps between them, which are small and compress well with zlib.
+    """
+    return zlib.compress(array('I', [position - previous for previous, position in zip([0] + positions[:-1], positions)]).tobytes())
+
+def decompress_positions(blob):
+    gaps = array('I')
+    gaps.frombytes(zlib.decompress(blob))
+    return list(accumulate(gaps))
+
+def tokenize(text):
+    """
+    Splits text into lower case words.
+
+    Parameters:
+    text (str): The cleaned text of a document.
+
+    Returns:
+    word_starts (list): The position in the text of the start of each word.
+    postings (dict): For each distinct word, the word numbers (positions) where it occurs.
+    """
+    word_starts = []
+    postings = {}
+    for position, match in enumerate(word_regex.finditer(text)):
+        word_starts.append(match.start())
+        postings.setdefault(match.group(0).lower(), []).append(position)
+    return word_starts, postings
+
+def index_file(working_folder, filename, store_folder = None, store_entry = None):
+    """
+    Reads and tokenizes one PDF file, the unit of work sent to each worker process when building an index.
+
+    Returns:
+    document (tuple): (title, compressed text, compressed page ends, compressed word starts, {word: compressed positions}), or None if the file could not be read.
+    store_entry (dict): The up to date text store index entry for the file, or None.
+    error (str): A description of the problem if the file could not be read, otherwise None.
+    """
+    try:
+        concatenated_pages, page_sizes, title, store_entry = search_in_files.get_document(working_folder, filename, store_folder, store_entry)
+    except Exception as error: # e.g. corrupt or encrypted PDF files
+        return None, None, f'{type(error).__name__}: {error}'
+    word_starts, postings = tokenize(concatenated_pages)
+    document = (title if title is None or isinstance(title, str) else str(title),
+                zlib.compress(concatenated_pages.encode('utf-8')),
+                compress_positions(list(accumulate(page_sizes))),
+                compress_positions(word_starts),
+                {word: compress_positions(positions) for word, positions in postings.items()})
+    return document, store_entry, None
+
+class PDFIndex:
+    """
+    An SQLite database holding, for each document, its compressed text, page ends and word start positions,
+    and for each word the documents and word positions where it occurs.
+    """
+    def __init__(self, index_path):
+        self.connection = sqlite3.connect(index_path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, filename TEXT UNIQUE, size INTEGER, mtime_ns INTEGER,
+                                                  title TEXT, text BLOB, page_ends BLOB, word_starts BLOB);
+            CREATE TABLE IF NOT EXISTS postings (word TEXT, document_id INTEGER, positions BLOB, PRIMARY KEY (word, document_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_by_document ON postings (document_id);
+        ''')
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, working_folder, pdf_filenames, workers = 1, store_folder = None):
+        """
+        Brings the index up to date with the files in a folder, only reading files which are new or have changed.
+
+        Parameters:
+        working_folder (str): The path to the folder containing the PDF files.
+        pdf_filenames (list): The PDF files now in the folder, relative to working_folder.
+        workers (int): The number of PDF files to read at once.
+        store_folder (str): The path to a text store folder to reuse extracted text from, or None.
+
+        Returns:
+        failed_files (list): (filename, error) pairs for the files which could not be read.
+        """
+        from tqdm import tqdm #for progress bar
+        indexed = {filename: (document_id, size, mtime_ns) for document_id, filename, size, mtime_ns
+                   in self.connection.execute('SELECT id, filename, size, mtime_ns FROM documents')}
+        stats = {filename: os.stat(os.path.join(working_folder, filename)) for filename in pdf_filenames}
+        changed_filenames = [filename for filename in pdf_filenames
+                             if indexed.get(filename, (None,))[1:] != (stats[filename].st_size, stats[filename].st_mtime_ns)]
+        current_filenames = set(pdf_filenames)
+        with self.connection:
+            for filename, (document_id, size, mtime_ns) in indexed.items():
+                if filename not in current_filenames or filename in changed_filenames:
+                    self.remove_document(document_id)
+        store = search_in_files.text_store.TextStore(store_folder) if store_folder is not None else None
+        store_entries = [store.entry(filename) for filename in changed_filenames] if store is not None else repeat(None)
+        arguments = zip(repeat(working_folder), changed_filenames, repeat(store_folder), store_entries)
+        failed_files = []
+        with search_in_files.ProcessPoolExecutor(max_workers = workers) if workers > 1 else search_in_files.nullcontext() as executor:
+            if workers > 1:
+                file_results = search_in_files.ordered_map(executor, index_file, arguments, window = 4 * workers)
+            else:
+                file_results = (index_file(*file_arguments) for file_arguments in arguments)
+            for filename, (document, store_entry, error) in zip(changed_filenames, tqdm(file_results, total = len(changed_filenames))):
+                if error is not None:
+                    failed_files.append((filename, error))
+                    continue
+                with self.connection: # one transaction per file so an interrupted update keeps the files already done
+                    self.add_document(filename, stats[filename], document)
+                if store is not None:
+                    store.index[filename] = store_entry
+        if store is not None:
+            store.save({filename: store.index[filename] for filename in pdf_filenames if filename in store.index})
+        return failed_files
+
+    def remove_document(self, document_id):
+        self.connection.execute('DELETE FROM postings WHERE document_id = ?', (document_id,))
+        self.connection.execute('DELETE FROM documents WHERE id = ?', (document_id,))
+
+    def add_document(self, filename, stat, document):
+        title, text, page_ends, word_starts, postings = document
+        cursor = self.connection.execute('INSERT INTO documents (filename, size, mtime_ns, title, text, page_ends, word_starts) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                         (filename, stat.st_size, stat.st_mtime_ns, title, text, page_ends, word_starts))
+        document_id = cursor.lastrowid
+        self.connection.executemany('INSERT INTO postings (word, document_id, positions) VALUES (?, ?, ?)',
+                                    ((word, document_id, positions) for word, positions in postings.items()))
+
+    def matching_words(self, pattern):
+        """
+        Finds the indexed words matching a query word, which may contain wildcards.
+
+        Parameters:
+        pattern (str): A lower case query word.
+
+        Returns:
+        words (list): The matching indexed words.
+        """
+        wildcard = re.search(r'[*$?#]', pattern)
+        if wildcard is None:
+            return [pattern]
+        # Words sharing the letters before the first wildcard are a range of the primary key, then the rest is checked with a regex
+        prefix = pattern[:wildcard.start()]
+        word_pattern = re.compile(''.join({'*': r'\w*', '$': r'\w*', '?': r'\w?', '#': r'\w'}.get(character, re.escape(character)) for character in pattern))
+        candidates = self.connection.execute('SELECT DISTINCT word FROM postings WHERE word >= ? AND word < ?', (prefix, prefix + '\U0010ffff'))
+        return [word for (word,) in candidates if word_pattern.fullmatch(word)]
+
+    def word_hits(self, pattern):
+        """
+        Finds where a query word occurs.
+
+        Returns:
+        hits (dict): For each document id, a sorted list of (first word, last word) positions.
+        """
+        hits = {}
+        for word in self.matching_words(pattern):
+            for document_id, positions in self.connection.execute('SELECT document_id, positions FROM postings WHERE word = ?', (word,)):
+                hits.setdefault(document_id, []).extend((position, position) for position in decompress_positions(positions))
+        return {document_id: sorted(document_hits) for document_id, document_hits in hits.items()}
+
+    def documents(self, document_ids):
+        """
+        Yields (document id, filename, title, text, page ends, word starts) for documents, in filename order.
+        """
+        for (document_id,) in self.connection.execute('SELECT id FROM documents ORDER BY filename').fetchall():
+            if document_id not in document_ids:
+                continue
+            filename, title, text, page_ends, word_starts = self.connection.execute(
+                'SELECT filename, title, text, page_ends, word_starts FROM documents WHERE id = ?', (document_id,)).fetchone()
+            yield document_id, filename, title, zlib.decompress(text).decode('utf-8'), decompress_positions(page_ends), decompress_positions(word_starts)
+
+# Queries
+
+class QueryError(ValueError):
+    def __init__(self, message, position):
+        super().__init__(f'{message} at position {position + 1}')
+        self.position = position
+
+query_token_regex = re.compile(r'\s*(?:(?P<open>\()|(?P<close>\))|"(?P<phrase>[^"]*)"|(?P<word>[^\s()"]+))')
+operator_regex = re.compile(r'(and|or|not|adj\d*)$', re.IGNORECASE)
+operator_precedence = {'or': 1, 'and': 2, 'not': 3, 'adj': 4}
+
+def parse_query(query):
+    """
+    Parses a query into a tree of tuples:
+    ('word', pattern), ('phrase', [word nodes]), (operator, left, right, distance) for and/or/not/adj.
+
+    Parameters:
+    query (str): The query.
+
+    Returns:
+    tree (tuple): The parsed query.
+    """
+    tokens = []
+    position = 0
+    while position < len(query):
+        match = query_token_regex.match(query, position)
+        if match is None or match.end() == position:
+            if query[position:].strip() == '':
+                break
+            raise QueryError('Unmatched quote', query.index('"', position))
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind), match.start(kind)))
+        position = match.end()
+    tokens.append(('end', None, len(query)))
+
+    def word_node(text, start):
+        words = re.findall(r'[\w*$?#]+', text.lower())
+        if not words:
+            raise QueryError(f'No words to search for in "{text}"', start)
+        if len(words) == 1:
+            return ('word', words[0])
+        return ('phrase', [('word', word) for word in words])
+
+    index = 0
+    def parse_expression(minimum_precedence):
+        # Precedence climbing: read an operand, then operators binding at least as tightly as minimum_precedence
+        nonlocal index
+        left = parse_operand()
+        while True:
+            kind, text, start = tokens[index]
+            if kind != 'word' or not operator_regex.match(text):
+                return left
+            operator = text.lower()
+            name = 'adj' if operator.startswith('adj') else operator
+            if operator_precedence[name] < minimum_precedence:
+                return left
+            index = index + 1
+            right = parse_expression(operator_precedence[name] + 1)
+            distance = int(operator[3:]) if name == 'adj' and operator[3:] else None
+            left = (name, left, right, distance)
+
+    def parse_operand():
+        nonlocal index
+        kind, text, start = tokens[index]
+        index = index + 1
+        if kind == 'open':
+            inner = parse_expression(0)
+            if tokens[index][0] != 'close':
+                raise QueryError('Missing closing bracket', tokens[index][2])
+            index = index + 1
+            return inner
+        if kind == 'phrase':
+            node = word_node(text, start)
+            return node if node[0] == 'phrase' else ('phrase', [node])
+        if kind == 'word' and not operator_regex.match(text):
+            return word_node(text, start)
+        raise QueryError('Expected a word, phrase or bracket' if kind != 'end' else 'Query ended early', start)
+
+    tree = parse_expression(0)
+    if tokens[index][0] != 'end':
+        raise QueryError('Unexpected ' + (tokens[index][1] or 'text'), tokens[index][2])
+    return tree
+
+def near(left_hits, right_hits, distance):
+    """
+    Pairs up hits within distance words of each other (any order), or with the right hit straight after the left one if distance is None.
+
+    Returns:
+    hits (list): The sorted (first word, last word) spans covering each pair.
+    """
+    right_starts = [start for start, end in right_hits]
+    widest_right = max(end - start for start, end in right_hits)
+    pairs = set()
+    for left_start, left_end in left_hits:
+        if distance is None:
+            low, high = left_end + 1, left_end + 1
+        else:
+            low, high = left_start - distance - widest_right, left_end + distance
+        for right_index in range(bisect_left(right_starts, low), bisect_right(right_starts, high)):
+            right_start, right_end = right_hits[right_index]
+            if distance is None or (max(right_start - left_end, left_start - right_end) <= distance and (right_start, right_end) != (left_start, left_end)):
+                pairs.add((min(left_start, right_start), max(left_end, right_end)))
+    return sorted(pairs)
+
+def evaluate(index, tree):
+    """
+    Runs a parsed query against an index.
+
+    Returns:
+    hits (dict): For each matching document id, a sorted list of (first word, last word) spans.
+    """
+    kind = tree[0]
+    if kind == 'word':
+        return index.word_hits(tree[1])
+    if kind == 'phrase':
+        hits = evaluate(index, tree[1][0])
+        for word in tree[1][1:]:
+            hits = combine('adj', hits, evaluate(index, word), None)
+        return hits
+    operator, left, right, distance = tree
+    left_hits = evaluate(index, left)
+    if not left_hits and operator != 'or':
+        return {}
+    return combine(operator, left_hits, evaluate(index, right), distance)
+
+def combine(operator, left_hits, right_hits, distance):
+    if operator == 'not':
+        return {document_id: hits for document_id, hits in left_hits.items() if document_id not in right_hits}
+    if operator == 'or':
+        return {document_id: sorted(set(left_hits.get(document_id, [])) | set(right_hits.get(document_id, [])))
+                for document_id in left_hits.keys() | right_hits.keys()}
+    combined = {}
+    for document_id in left_hits.keys() & right_hits.keys():
+        if operator == 'and':
+            combined[document_id] = sorted(set(left_hits[document_id]) | set(right_hits[document_id]))
+        else:
+            document_hits = near(left_hits[document_id], right_hits[document_id], distance)
+            if document_hits:
+                combined[document_id] = document_hits
+    return combined
+
+def search_index(index, queries, trees, results_per_file_and_term, writer):
+    """
+    Runs queries against an index and writes a SearchResult for each match, listed by file and then query.
+
+    Parameters:
+    index (PDFIndex): The index to search.
+    queries (list): The queries.
+    trees (list): The parsed queries, from parse_query.
+    results_per_file_and_term (int): The maximum number of matches to return for each query in each file, 0 returns all.
+    writer (CSVResultWriter or ParquetResultWriter): Where to write the results.
+    """
+    hits_by_query = [evaluate(index, tree) for tree in trees]
+    for document_id, filename, title, text, page_ends, word_starts in index.documents(set().union(*hits_by_query)):
+        results = []
+        for query, query_hits in zip(queries, hits_by_query):
+            document_hits = query_hits.get(document_id, [])
+            if results_per_file_and_term > 0:
+                document_hits = document_hits[:results_per_file_and_term]
+            for i, (first_word, last_word) in enumerate(document_hits):
+                start = word_starts[first_word]
+                end = word_regex.match(text, word_starts[last_word]).end()
+                context = text[max(start - search_in_files.spacing_around_context, 0):end + search_in_files.spacing_around_context]
+                results.append(SearchResult(filename, title, query, text[start:end], i + 1, search_in_files.get_page(page_ends, start), context))
+        writer.write_results(results)
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = 'Build a word index of the PDF files in a folder and search it.')
+    parser.add_argument('--index', help = f'index file to use (default: {index_filename} in the folder)')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    update_parser = commands.add_parser('update', help = 'create the index or bring it up to date with the folder')
+    update_parser.add_argument('folder', help = 'folder containing the PDF files')
+    update_parser.add_argument('-r', '--recursive', action = 'store_true', help = 'also index PDF files in subfolders')
+    update_parser.add_argument('--include', action = 'append', metavar = 'GLOB', help = 'only index files matching this pattern (can be repeated)')
+    update_parser.add_argument('--exclude', action = 'append', metavar = 'GLOB', help = 'skip files or folders matching this pattern (can be repeated)')
+    update_parser.add_argument('-w', '--workers', type = int, default = os.cpu_count() or 1, help = 'number of PDF files to read at once')
+    update_parser.add_argument('--no-store', action = 'store_true', help = 'do not use the text store of search_in_files.py')
+    search_parser = commands.add_parser('search', help = 'search the index')
+    search_parser.add_argument('folder', help = 'folder the index was built for')
+    search_parser.add_argument('queries', nargs = '*', help = 'queries to run')
+    search_parser.add_argument('-f', '--queries-file', help = 'file with one query per line')
+    search_parser.add_argument('-o', '--output', required = True, help = 'CSV file to write (overwritten if it exists), or a .parquet file')
+    search_parser.add_argument('-n', '--results', type = int, default = 0, help = 'number of results to return for each file and query, 0 returns all (default)')
+    parsed = parser.parse_args(arguments)
+
+    if parsed.command == 'search':
+        queries = list(parsed.queries)
+        if parsed.queries_file is not None:
+            queries.extend(query for query in search_in_files.read_terms(parsed.queries_file) if query.strip())
+        # Every query is checked before anything is opened, so a mistake in one does not leave an empty output file
+        trees = []
+        for query in queries:
+            try:
+                trees.append(parse_query(query))
+            except QueryError as error:
+                parser.error(f'could not understand the query {query}: {error}')
+
+    index = PDFIndex(parsed.index or os.path.join(parsed.folder, index_filename))
+    try:
+        if parsed.command == 'update':
+            pdf_filenames = search_in_files.find_pdf_files(parsed.folder, parsed.recursive, parsed.include, parsed.exclude)
+            store_folder = None if parsed.no_store or not search_in_files.use_text_store else os.path.join(parsed.folder, search_in_files.text_store_foldername)
+            for filename, error in index.update(parsed.folder, pdf_filenames, max(parsed.workers, 1), store_folder):
+                print(f'Could not process {filename}: {error}')
+        else:
+            writer = open_result_writer(parsed.output)
+            try:
+                search_index(index, queries, trees, parsed.results, writer)
+            finally:
+                writer.close()
+    finally:
+        index.close()
+
+if __name__ == '__main__':
+    main()
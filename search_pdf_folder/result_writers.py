@@ -0,0 +1,111 @@
+# Writers for search results, rows are written out as each file is finished rather than collected until the end
+# so memory use does not grow with the number of results and the output fills up while a long search runs
+
+import csv
+from collections import namedtuple
+
+SearchResult = namedtuple('SearchResult', ['filename', 'title', 'term', 'matched_term', 'occurence_of_term', 'page', 'context'])
+
+parquet_batch_rows = 50000 # rows collected before a row group is written to a Parquet file
+
+class CSVResultWriter:
+    """
+    Writes results to a CSV file laid out as the pandas to_csv output this replaced,
+    including the unnamed first column holding the position of each match within its file and term (starting from 0).
+    """
+    def __init__(self, output_file, alias_column = False):
+        """
+        Parameters:
+        output_file (file): A text file opened for writing.
+        alias_column (bool): Whether to add an aliases column, listing the copies of each file which were not searched.
+        """
+        self.output_file = output_file
+        self.alias_column = alias_column
+        self.csv_writer = csv.writer(output_file, lineterminator = '\n')
+        self.csv_writer.writerow([''] + list(SearchResult._fields) + (['aliases'] if alias_column else []))
+
+    def write_results(self, results, aliases = ()):
+        if self.alias_column:
+            alias_text = '; '.join(aliases)
+            self.csv_writer.writerows([result.occurence_of_term - 1] + list(result) + [alias_text] for result in results)
+        else:
+            self.csv_writer.writerows([result.occurence_of_term - 1] + list(result) for result in results)
+
+    def close(self):
+        self.output_file.close()
+
+class ParquetResultWriter:
+    """
+    Writes results to a Parquet file, with the filename, title and term columns dictionary encoded
+    as each value is repeated for many rows. Requires the pyarrow package (py -m pip install pyarrow).
+    """
+    def __init__(self, output_path, alias_column = False):
+        """
+        Parameters:
+        output_path (str): The path of the Parquet file to create (overwritten if it exists).
+        alias_column (bool): Whether to add an aliases column, listing the copies of each file which were not searched.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        repeated_string = pa.dictionary(pa.int32(), pa.string())
+        self.schema = pa.schema([('filename', repeated_string), ('title', repeated_string), ('term', repeated_string),
+                                 ('matched_term', pa.string()), ('occurence_of_term', pa.int32()), ('page', pa.int32()),
+                                 ('context', pa.string())] + ([('aliases', pa.string())] if alias_column else []))
+        self.alias_column = alias_column
+        self.parquet_writer = pq.ParquetWriter(output_path, self.schema)
+        self.batch = []
+
+    def write_results(self, results, aliases = ()):
+        if self.alias_column:
+            alias_text = '; '.join(aliases)
+            results = [tuple(result) + (alias_text,) for result in results]
+        self.batch.extend(results)
+        if len(self.batch) >= parquet_batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        columns = dict(zip(self.schema.names, map(list, zip(*self.batch))))
+        # Titles are not always strings in PDF metadata
+        columns['title'] = [title if title is None or isinstance(title, str) else str(title) for title in columns['title']]
+        arrays = [self.pa.array(columns[field.name], type = field.type) for field in self.schema]
+        self.parquet_writer.write_table(self.pa.Table.from_arrays(arrays, schema = self.schema))
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        self.parquet_writer.close()
+
+def read_csv_results(output_path):
+    """
+    Reads back the results from a CSV file written by CSVResultWriter.
+
+    Parameters:
+    output_path (str): The path of the CSV file.
+
+    Returns:
+    results (generator): Yields a SearchResult for each row.
+    """
+    with open(output_path, 'r', newline = '') as output_file:
+        csv_reader = csv.reader(output_file)
+        next(csv_reader) # header
+        for row in csv_reader:
+            result = SearchResult(*row[1:])
+            yield result._replace(occurence_of_term = int(result.occurence_of_term), page = int(result.page))
+
+def open_result_writer(output_path, alias_column = False):
+    """
+    Opens a writer for the output file, choosing the format from its extension.
+
+    Parameters:
+    output_path (str): The path of the output file, .parquet for Parquet and CSV for anything else.
+    alias_column (bool): Whether to add an aliases column, listing the copies of each file which were not searched.
+
+    Returns:
+    writer (CSVResultWriter or ParquetResultWriter): The writer, which must be closed at the end of the search.
+    """
+    if output_path.lower().endswith('.parquet'):
+        return ParquetResultWriter(output_path, alias_column)
+    return CSVResultWriter(open(output_path, 'w'), alias_column)
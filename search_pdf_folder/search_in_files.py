@@ -2,6 +2,8 @@
 # Outputs a csv in the folder with 
 # Terms, files, first 10 pages with term, first 3 contexts of term
 # Requires pdfplumber (install with pip install pdfplumber)
+# Run without arguments for prompts, or see python search_in_files.py --help to run from the command line
+# Can also be imported, e.g. from search_in_files import search_folder
 # Known limitation - some effort is made to extract terms which overlap between pages but there may be bugs
 
 
@@ -18,19 +20,36 @@
 
 # All inline comments provided by https://chat.openai.com/chat (ChatGPT)
 
-import pandas as pd
-import pdfplumber
+import argparse
 import os
 import re
-from itertools import accumulate, islice
-from tqdm import tqdm #for progress bar
+import time
+from fnmatch import fnmatchcase
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import accumulate, repeat
+import near_duplicates
+import search_timing
+import term_matching
+import text_store
+from result_writers import SearchResult, open_result_writer
+from search_state import SearchState, MergedResults
 
 spacing_around_context = 150 #characters
 terms_filename = 'terms.txt'
+pdf_file_pattern = '*.pdf' # files searched when no include patterns are given
 search_flags = re.IGNORECASE
+use_text_store = True # keep the extracted text so later searches of the same folder skip reading the PDF files
+text_store_foldername = '.search_text_store' # created inside the target folder
+stream_pages = True # when a results limit is set, read PDF files a page at a time and stop once every term has enough results
+                    # (files read this way are not added to the text store)
+page_overlap = 2000 #characters kept from previous pages when streaming, matches longer than this may be missed across pages
 
 # term, file, pages found
 # term, file, index of context, page, context
+# pdfplumber, tqdm and tkinter are imported where they are used so that the command line starts quickly
 
 def extract_pages(working_folder, filename):
     """
@@ -43,14 +62,34 @@ def extract_pages(working_folder, filename):
     Returns:
     extracted_text (list): A list of strings, where each string is the text from a page in the PDF file.
     """
+    import pdfplumber
     with pdfplumber.open(os.path.join(working_folder, filename)) as pdf:
-        extracted_text = [page.extract_text() for page in pdf.pages]
-        try:
-            title = pdf.metadata['Title']
-        except:
-            title = 'No title metadata field'
+        extracted_text = list(iter_pages(pdf))
+        title = get_title(pdf)
     return extracted_text, title
 
+def iter_pages(pdf):
+    """
+    Extracts the text from the pages of an open PDF file one page at a time.
+
+    Parameters:
+    pdf (PDF): The PDF file opened with pdfplumber.
+
+    Returns:
+    page_texts (generator): Yields the text of each page in turn.
+    """
+    for page in pdf.pages:
+        page_text = page.extract_text()
+        page.flush_cache() # the layout objects of earlier pages are not needed again
+        yield page_text
+
+def get_title(pdf):
+    try:
+        title = pdf.metadata['Title']
+    except:
+        title = 'No title metadata field'
+    return title
+
 def clean_page(page_string):
     """
     Cleans the text from a page to aid in text matching.
@@ -66,74 +105,477 @@ def clean_page(page_string):
     cleaned_string = re.sub(r'\n', ' ', page_string, count = 0)
     return cleaned_string
 
-def process_file(filename, results_per_file_and_term):
+def get_document(working_folder, filename, store_folder = None, store_entry = None):
     """
-    Processes a PDF file by extracting text, cleaning the text, searching for specified terms, and outputting the results to a CSV file.
+    Gets the cleaned text of a PDF file, from the text store if it has already been extracted.
 
     Parameters:
-    filename (str): The name of the PDF file to be processed.
+    working_folder (str): The path to the folder containing the PDF file.
+    filename (str): The name of the PDF file.
+    store_folder (str): The path to the text store folder, or None to always extract the text.
+    store_entry (dict): The text store index entry for the file from the last run, or None.
 
     Returns:
-    result_dataframes (list): A list of dataframes containing the results of the search for each term in the file.
+    concatenated_pages (str): The cleaned text of all pages joined with spaces.
+    page_sizes (list): The length of each page in concatenated_pages including the joining space.
+    title (str): The title of the PDF file.
+    store_entry (dict): The up to date text store index entry for the file, or None if no store is used.
     """
-
-    extracted_text, title = extract_pages(working_folder, filename)
-    cleaned_pages = [clean_page(page) for page in extracted_text]
+    if store_folder is not None:
+        with search_timing.stage('text_store'):
+            store_entry = text_store.current_entry(os.path.join(working_folder, filename), store_entry)
+            document = text_store.read_document(store_folder, store_entry['hash'])
+        if document is not None:
+            search_timing.add_pages(len(document[1]))
+            search_timing.add_text(document[0])
+            return document + (store_entry,)
+    with search_timing.stage('extraction'):
+        extracted_text, title = extract_pages(working_folder, filename)
+    with search_timing.stage('cleaning'):
+        cleaned_pages = [clean_page(page) for page in extracted_text]
+    search_timing.add_pages(len(cleaned_pages))
+    if store_folder is not None:
+        with search_timing.stage('text_store'):
+            document = text_store.write_document(store_folder, store_entry['hash'], cleaned_pages, title)
+        search_timing.add_text(document[0])
+        return document + (store_entry,)
     page_sizes = [len(page) + 1 for page in cleaned_pages]
-    cumulative_page_sizes = list(accumulate(page_sizes))
-    page_ranges = list(enumerate(zip([0]+cumulative_page_sizes[:-1], cumulative_page_sizes)))
     concatenated_pages = ' '.join(cleaned_pages)
+    search_timing.add_text(concatenated_pages)
+    return concatenated_pages, page_sizes, title, None
 
-    def get_page(position):
-        page = min([page_range[0] for page_range in page_ranges if position >= page_range[1][0] and position < page_range[1][1]])
-        return page + 1
+def get_page(cumulative_page_sizes, position):
+    """
+    Finds the page number of a position in the cleaned text of a PDF file.
+
+    Parameters:
+    cumulative_page_sizes (list): The position of the end of each page, including the space joining it to the next page.
+    position (int): A position in the text.
+
+    Returns:
+    page (int): The page number, starting from 1.
+    """
+    return bisect_right(cumulative_page_sizes, position) + 1
+
+def search_pages_lazily(working_folder, filename, terms, results_per_file_and_term, flags = search_flags):
+    """
+    Searches a PDF file while extracting it page by page, stopping once every term has results_per_file_and_term matches.
+
+    Parameters:
+    working_folder (str): The path to the folder containing the PDF file.
+    filename (str): The name of the PDF file to be processed.
+    terms (list): The search terms (regexes) to look for.
+    results_per_file_and_term (int): The maximum number of matches to return for each term.
+    flags (int): The re flags to search with.
+
+    Returns:
+    results (list): A SearchResult for each match.
+    """
+    import pdfplumber
+    matcher = term_matching.get_matcher(tuple(terms), flags)
+    search = term_matching.DocumentSearch(matcher, results_per_file_and_term, spacing_around_context, page_overlap)
+    cumulative_page_sizes = []
+    with pdfplumber.open(os.path.join(working_folder, filename)) as pdf:
+        title = get_title(pdf)
+        page_count = len(pdf.pages)
+        for page_number, page_text in enumerate(search_timing.timed(iter_pages(pdf), 'extraction'), start = 1):
+            with search_timing.stage('cleaning'):
+                cleaned_page = clean_page(page_text)
+            search_timing.add_pages(1)
+            search_timing.add_text(cleaned_page)
+            # Pages are joined with a space, as in the text searched when the whole file is read
+            with search_timing.stage('matching'):
+                search.add_text(cleaned_page if page_number == 1 else ' ' + cleaned_page, final = page_number == page_count)
+            cumulative_page_sizes.append((cumulative_page_sizes[-1] if cumulative_page_sizes else 0) + len(cleaned_page) + 1)
+            if search.finished:
+                break
+    search_timing.add_matches(terms, search.matches)
+    with search_timing.stage('page_lookup'):
+        pages_by_term = [[get_page(cumulative_page_sizes, start) for start, matched_term, context in term_matches] for term_matches in search.matches]
+    with search_timing.stage('record_building'):
+        return [SearchResult(filename, title, term, matched_term, i + 1, page, context)
+                for term, term_matches, pages in zip(terms, search.matches, pages_by_term)
+                for i, ((start, matched_term, context), page) in enumerate(zip(term_matches, pages))]
+
+def process_file(working_folder, filename, terms, results_per_file_and_term, store_folder = None, store_entry = None, flags = search_flags):
+    """
+    Processes a PDF file by extracting text, cleaning the text and searching for specified terms.
+
+    Parameters:
+    working_folder (str): The path to the folder containing the PDF file.
+    filename (str): The name of the PDF file to be processed.
+    terms (list): The search terms (regexes) to look for.
+    results_per_file_and_term (int): The maximum number of matches to return for each term, 0 returns all.
+    store_folder (str): The path to the text store folder, or None to always extract the text.
+    store_entry (dict): The text store index entry for the file from the last run, or None.
+    flags (int): The re flags to search with.
+
+    Returns:
+    results (list): A SearchResult for each match.
+    store_entry (dict): The up to date text store index entry for the file, or None if no store is used.
+    """
+
+    if stream_pages and results_per_file_and_term > 0:
+        # Only the first pages may be needed so read the file lazily, unless its text is already stored
+        if store_folder is not None:
+            with search_timing.stage('text_store'):
+                store_entry = text_store.current_entry(os.path.join(working_folder, filename), store_entry)
+        if store_folder is None or not text_store.has_document(store_folder, store_entry['hash']):
+            return search_pages_lazily(working_folder, filename, terms, results_per_file_and_term, flags), store_entry
+
+    concatenated_pages, page_sizes, title, store_entry = get_document(working_folder, filename, store_folder, store_entry)
+    cumulative_page_sizes = list(accumulate(page_sizes))
 
     def get_context(span):
         start = max(span[0] - spacing_around_context, 0)
         end = min(span[1] + spacing_around_context, cumulative_page_sizes[-1]-1)
         return concatenated_pages[start:end]
 
-    def search_for_term(term):
-        if results_per_file_and_term > 0:
-            matches = list(islice(re.finditer(term, concatenated_pages, flags = search_flags), results_per_file_and_term))
-        else: 
-            matches = list(re.finditer(term, concatenated_pages, flags = search_flags))
-        pages = [get_page(match.start(0)) for match in matches]
-        contexts = [get_context(match.span(0)) for match in matches]
-        return pd.DataFrame(data = {
-            'filename': [filename for match in matches],
-            'title': [title for match in matches],
-            'term': [term for match in matches],
-            'matched_term': [match.group(0) for match in matches],
-            'occurence_of_term': [i + 1 for i, match in enumerate(matches)],
-            'page': pages,
-            'context': contexts
-        })
-
-    result_dataframes = [search_for_term(term) for term in terms]
-    file_processed_dataframe = pd.concat(result_dataframes)
-    return file_processed_dataframe
-
-# Prompts for a folder and goes from there
-
-from tkinter import Tk     # from tkinter import Tk for Python 3.x
-from tkinter.filedialog import askdirectory, asksaveasfile
-from tkinter.simpledialog import askinteger
-
-Tk().withdraw() # we don't want a full GUI, so keep the root window from appearing
-
-working_folder = askdirectory(title = "Select directory with PDF files", mustexist=True)
-
-with open(os.path.join(working_folder, terms_filename), 'r') as terms_file:
-    terms = terms_file.read().split('\n')
-
-results_per_file_and_term = askinteger(title = "Results to return", prompt = "Number of results to return, 0 returns all", initialvalue = 0)
-
-files = list(os.scandir(working_folder))
-pdf_filenames = [entry.name for entry in files if entry.is_file() and entry.name.endswith('.pdf')]
-processed_file_dataframes = [process_file(filename, results_per_file_and_term) for filename in tqdm(pdf_filenames)]
-full_dataframe = pd.concat(processed_file_dataframes)
-
-output_file = asksaveasfile(title = "Save output csv", defaultextension=".csv", filetypes=(("comma separated values", "*.csv"),("All Files", "*.*") ))
-full_dataframe.to_csv(output_file, lineterminator = '\n')
-output_file.close()
+    # All terms are found in one pass over the text, the rows are then listed term by term
+    with search_timing.stage('matching'):
+        matcher = term_matching.get_matcher(tuple(terms), flags)
+        spans_by_term = matcher.find_matches(concatenated_pages, results_per_file_and_term)
+    search_timing.add_matches(terms, spans_by_term)
+    with search_timing.stage('page_lookup'):
+        pages_by_term = [[get_page(cumulative_page_sizes, span[0]) for span in spans] for spans in spans_by_term]
+    with search_timing.stage('record_building'):
+        results = [SearchResult(filename, title, term, concatenated_pages[span[0]:span[1]], i + 1, page, get_context(span))
+                   for term, spans, pages in zip(terms, spans_by_term, pages_by_term) for i, (span, page) in enumerate(zip(spans, pages))]
+    return results, store_entry
+
+def search_file(working_folder, filename, terms, results_per_file_and_term, store_folder = None, store_entry = None, flags = search_flags,
+                timed = False, profiled = False):
+    """
+    Runs process_file for one PDF file without letting a failure stop the rest of the run.
+    This is the unit of work sent to each worker process.
+
+    Parameters:
+    working_folder (str): The path to the folder containing the PDF file.
+    filename (str): The name of the PDF file to be processed.
+    terms (list): The search terms (regexes) to look for.
+    results_per_file_and_term (int): The maximum number of matches to return for each term, 0 returns all.
+    store_folder (str): The path to the text store folder, or None to always extract the text.
+    store_entry (dict): The text store index entry for the file from the last run, or None.
+    flags (int): The re flags to search with.
+    timed (bool): Whether to time each stage of processing the file (see search_timing).
+    profiled (bool): Whether to also run the file under cProfile, when timed.
+
+    Returns:
+    results (list): The results found by process_file, empty if the file could not be processed.
+    store_entry (dict): The up to date text store index entry for the file, None if no store is used or the file could not be processed.
+    error (str): A description of the problem if the file could not be processed, otherwise None.
+    timing (dict): The timings of the file if timed, otherwise None.
+    """
+    timing = None
+    try:
+        if timed:
+            file_result, timing, error = search_timing.time_file(
+                lambda: process_file(working_folder, filename, terms, results_per_file_and_term, store_folder, store_entry, flags), filename, profiled)
+            if error is not None:
+                raise error
+            return file_result + (None, timing)
+        return process_file(working_folder, filename, terms, results_per_file_and_term, store_folder, store_entry, flags) + (None, None)
+    except Exception as error: # e.g. corrupt or encrypted PDF files
+        return [], None, f'{type(error).__name__}: {error}', timing
+
+def ordered_map(executor, function, argument_tuples, window):
+    """
+    Runs a function over a pool of processes, returning the results in order
+    but with at most window calls submitted at once so finished results do not pile up in memory.
+
+    Parameters:
+    executor (ProcessPoolExecutor): The pool to run the calls in.
+    function (function): The function to call.
+    argument_tuples (iterable): The arguments for each call.
+    window (int): The greatest number of calls running or waiting to be collected.
+
+    Returns:
+    results (generator): Yields the result of each call in the order of argument_tuples.
+    """
+    pending = deque()
+    for arguments in argument_tuples:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(function, *arguments))
+    while pending:
+        yield pending.popleft().result()
+
+def search_files(working_folder, pdf_filenames, terms, results_per_file_and_term, writer, workers = 1, store_folder = None, flags = search_flags,
+                 file_terms = None, other_filenames = (), report = None, skip_duplicates = False):
+    """
+    Searches a list of PDF files, optionally spreading the files over a pool of worker processes.
+    The results of each file are written out as soon as it and all files before it are finished.
+
+    Parameters:
+    working_folder (str): The path to the folder containing the PDF files.
+    pdf_filenames (list): The names of the PDF files to be processed.
+    terms (list): The search terms (regexes) to look for.
+    results_per_file_and_term (int): The maximum number of matches to return for each term, 0 returns all.
+    writer (CSVResultWriter or ParquetResultWriter): Where to write the results, in the same order as pdf_filenames.
+    workers (int): The number of worker processes to use, 1 processes the files in this process.
+    store_folder (str): The path to a text store folder to reuse extracted text from, or None to always extract the text.
+    flags (int): The re flags to search with.
+    file_terms (list): The terms to search each file for, in place of terms, when updating earlier results.
+    other_filenames (iterable): Files in the folder not searched this time whose stored text should be kept.
+    report (SearchReport): Collects the timings of each file if given, see search_timing.
+    skip_duplicates (bool): Whether to only search the first file of each group of identical or near-identical files (see near_duplicates),
+                            writing the others to the aliases column of its results (the writer needs an aliases column). Not used with file_terms.
+
+    Returns:
+    failed_files (list): (filename, error) pairs for the files which could not be processed.
+    """
+    from tqdm import tqdm #for progress bar
+    term_matching.get_matcher(tuple(terms), flags) # check all the terms are valid regexes before starting
+    store = text_store.TextStore(store_folder) if store_folder is not None else None
+    store_entries = [store.entry(filename) for filename in pdf_filenames] if store is not None else repeat(None)
+    failed_files = []
+    new_store_entries = {filename: store.entry(filename) for filename in other_filenames if store.entry(filename) is not None} if store is not None else {}
+    with ProcessPoolExecutor(max_workers = workers) if workers > 1 else nullcontext() as executor:
+        aliases = {}
+        if skip_duplicates:
+            aliases, fingerprinted_entries = near_duplicates.find_duplicates(working_folder, pdf_filenames, executor, store_folder,
+                                                                             store_entries if store is not None else None)
+            alias_filenames = {alias for file_aliases in aliases.values() for alias in file_aliases}
+            # The copies are not searched, but their store entries (with the hash just worked out) are kept for later searches
+            new_store_entries.update((filename, store_entry) for filename, store_entry in zip(pdf_filenames, fingerprinted_entries)
+                                     if filename in alias_filenames and store_entry is not None)
+            searched_files = [(filename, store_entry) for filename, store_entry in zip(pdf_filenames, fingerprinted_entries) if filename not in alias_filenames]
+            pdf_filenames = [filename for filename, store_entry in searched_files]
+            store_entries = [store_entry for filename, store_entry in searched_files] if store is not None else repeat(None)
+        terms_for_files = file_terms if file_terms is not None else repeat(terms)
+        arguments = zip(repeat(working_folder), pdf_filenames, terms_for_files, repeat(results_per_file_and_term), repeat(store_folder), store_entries, repeat(flags),
+                        repeat(report is not None), repeat(report is not None and report.profiled))
+
+        def write_results(filename, results):
+            if skip_duplicates:
+                writer.write_results(results, aliases.get(filename, []))
+            else:
+                writer.write_results(results)
+
+        if workers > 1:
+            file_results = ordered_map(executor, search_file, arguments, window = 4 * workers)
+        else:
+            file_results = (search_file(*file_arguments) for file_arguments in arguments)
+        # The bar wraps the whole zip, as zip stops at the end of pdf_filenames without going back to file_results to count the last file
+        for filename, (results, store_entry, error, timing) in tqdm(zip(pdf_filenames, file_results), total = len(pdf_filenames)):
+            if report is not None:
+                report.add_file(timing, error)
+                writing_start = time.perf_counter()
+                write_results(filename, results)
+                report.add_writing(time.perf_counter() - writing_start)
+            else:
+                write_results(filename, results)
+            if error is not None:
+                failed_files.append((filename, error))
+            if store_entry is not None:
+                new_store_entries[filename] = store_entry
+    if store is not None:
+        # Only keep the files seen in this run, evicting text for files which have been removed or changed
+        store.save(new_store_entries)
+    return failed_files
+
+def read_terms(terms_path):
+    """
+    Reads search terms from a file, one term per line.
+    """
+    with open(terms_path, 'r') as terms_file:
+        return terms_file.read().split('\n')
+
+def find_pdf_files(working_folder, recursive = False, include = None, exclude = None):
+    """
+    Lists the PDF files in a folder.
+
+    Parameters:
+    working_folder (str): The path to the folder.
+    recursive (bool): Whether to look in subfolders too.
+    include (list): Glob patterns for the files to search, matched against the path relative to working_folder
+                    (with / between folders) and against the filename alone. Default is pdf_file_pattern.
+    exclude (list): Glob patterns for files or subfolders to skip, matched the same way.
+
+    Returns:
+    pdf_filenames (list): The paths of the files relative to working_folder, in the order the folders list them.
+    """
+    include = include or [pdf_file_pattern]
+    exclude = exclude or []
+
+    def matches(relative_path, patterns):
+        posix_path = relative_path.replace(os.sep, '/')
+        return any(fnmatchcase(posix_path, pattern) or fnmatchcase(os.path.basename(posix_path), pattern) for pattern in patterns)
+
+    pdf_filenames = []
+    for folder, subfolders, filenames in os.walk(working_folder):
+        relative_folder = os.path.relpath(folder, working_folder)
+        relative_folder = '' if relative_folder == os.curdir else relative_folder
+        relative_paths = [os.path.join(relative_folder, filename) for filename in filenames]
+        pdf_filenames.extend(path for path in relative_paths if matches(path, include) and not matches(path, exclude))
+        if not recursive:
+            break
+        # Skip the text store and excluded folders (changing subfolders in place stops os.walk going into them)
+        subfolders[:] = [subfolder for subfolder in subfolders
+                         if subfolder != text_store_foldername and not matches(os.path.join(relative_folder, subfolder), exclude)]
+    return pdf_filenames
+
+def search_folder(working_folder, output_path, terms = None, results_per_file_and_term = 0, flags = search_flags,
+                  workers = 1, use_store = use_text_store, recursive = False, include = None, exclude = None, incremental = False,
+                  report_path = None, profile = False, skip_duplicates = False):
+    """
+    Searches all PDF files in a folder for a list of terms and writes the results to a file.
+
+    Parameters:
+    working_folder (str): The path to the folder containing the PDF files.
+    output_path (str): The path of the CSV (or .parquet) file to write, overwritten if it exists.
+    terms (list): The search terms (regexes), read from the terms file in working_folder if None.
+    results_per_file_and_term (int): The maximum number of matches to return for each term in each file, 0 returns all.
+    flags (int): The re flags to search with, re.IGNORECASE by default.
+    workers (int): The number of PDF files to process at once, 1 processes them one at a time in this process.
+    use_store (bool): Whether to keep the extracted text in the folder's text store for later searches.
+    recursive (bool): Whether to search PDF files in subfolders too.
+    include (list): Glob patterns for the files to search (see find_pdf_files).
+    exclude (list): Glob patterns for files or subfolders to skip (see find_pdf_files).
+    incremental (bool): Whether to update an existing CSV output, only searching files and terms not already searched.
+    report_path (str): The path of a JSON report of the time spent on each file, stage and term to write, or None for no report.
+    profile (bool): Whether to also profile each file with cProfile for the report.
+    skip_duplicates (bool): Whether to only search one file of each group of identical or near-identical PDF files,
+                            listing the others in an aliases column of the output. Cannot be used with incremental.
+
+    Returns:
+    failed_files (list): (filename, error) pairs for the files which could not be processed.
+    """
+    if incremental and skip_duplicates:
+        raise ValueError('Skipping duplicate files needs a full search rather than an update of an output file')
+    if terms is None:
+        terms = read_terms(os.path.join(working_folder, terms_filename))
+    pdf_filenames = find_pdf_files(working_folder, recursive, include, exclude)
+    store_folder = os.path.join(working_folder, text_store_foldername) if use_store else None
+    report = None
+    if report_path is not None:
+        report = search_timing.SearchReport(report_path, profile, {'folder': working_folder, 'terms': len(terms), 'results_per_file_and_term': results_per_file_and_term,
+                                                                   'flags': int(flags), 'workers': workers, 'use_store': use_store, 'incremental': incremental})
+    if incremental:
+        failed_files = update_search(working_folder, output_path, pdf_filenames, terms, results_per_file_and_term, flags, workers, store_folder, report)
+    else:
+        writer = open_result_writer(output_path, skip_duplicates)
+        try:
+            failed_files = search_files(working_folder, pdf_filenames, terms, results_per_file_and_term, writer, workers, store_folder, flags, report = report,
+                                        skip_duplicates = skip_duplicates)
+        finally:
+            writer.close()
+    if report is not None:
+        report.write()
+    return failed_files
+
+def update_search(working_folder, output_path, pdf_filenames, terms, results_per_file_and_term, flags, workers, store_folder, report = None):
+    """
+    Updates an existing CSV output, only searching new or changed files and terms not searched before.
+    Results for removed files and terms are dropped. The output is only rewritten if something changed.
+
+    Returns:
+    failed_files (list): (filename, error) pairs for the files which could not be processed.
+    """
+    if output_path.lower().endswith('.parquet'):
+        raise ValueError('Updating an output file needs a CSV output file')
+    terms = list(dict.fromkeys(terms)) # results are merged by term so a repeated term would be listed twice
+    state = SearchState(output_path, {'results_per_file_and_term': results_per_file_and_term, 'flags': int(flags)})
+    terms_to_search, kept = state.plan(working_folder, pdf_filenames, terms)
+    previous_results = sum(len(file_state['terms']) for file_state in state.files.values())
+    if not terms_to_search and len(kept) == previous_results and len(state.files) == len(pdf_filenames):
+        return [] # nothing new, changed or removed
+    merged_results = MergedResults(output_path, kept)
+    filenames_to_search = list(terms_to_search)
+    failed_files = search_files(working_folder, filenames_to_search, terms, results_per_file_and_term, merged_results, workers, store_folder, flags,
+                                file_terms = [terms_to_search[filename] for filename in filenames_to_search],
+                                other_filenames = [filename for filename in pdf_filenames if filename not in terms_to_search], report = report)
+    merged_results.write_csv(output_path, pdf_filenames, terms)
+    state.save(pdf_filenames, terms, terms_to_search, kept, {filename for filename, error in failed_files})
+    return failed_files
+
+def watch_folder(working_folder, output_path, interval, terms_path = None, **search_options):
+    """
+    Keeps a CSV output up to date with a folder, checking for new or changed files and terms every interval seconds until stopped (Ctrl+C).
+
+    Parameters:
+    working_folder (str): The path to the folder containing the PDF files.
+    output_path (str): The path of the CSV file to keep up to date.
+    interval (float): The number of seconds to wait between checks.
+    terms_path (str): The file of search terms, re-read at each check. Default is the terms file in working_folder.
+    search_options: Other arguments for search_folder.
+    """
+    terms_path = terms_path or os.path.join(working_folder, terms_filename)
+    reported_files = set()
+    try:
+        while True:
+            failed_files = search_folder(working_folder, output_path, read_terms(terms_path), incremental = True, **search_options)
+            for filename, error in failed_files:
+                if filename not in reported_files: # failed files are retried at every check, only report them once
+                    print(f'Could not process {filename}: {error}')
+                    reported_files.add(filename)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+def run_with_prompts():
+    """
+    Prompts for a folder, the number of results and the output file, then searches the folder.
+    """
+    from tkinter import Tk     # from tkinter import Tk for Python 3.x
+    from tkinter.filedialog import askdirectory, asksaveasfilename
+    from tkinter.simpledialog import askinteger
+
+    Tk().withdraw() # we don't want a full GUI, so keep the root window from appearing
+
+    working_folder = askdirectory(title = "Select directory with PDF files", mustexist=True)
+    results_per_file_and_term = askinteger(title = "Results to return", prompt = "Number of results to return, 0 returns all", initialvalue = 0)
+    workers = askinteger(title = "Worker processes", prompt = "Number of PDF files to process at once, 1 uses a single process", initialvalue = os.cpu_count() or 1, minvalue = 1)
+    # Results are written as the search goes so the output file is chosen first
+    output_path = asksaveasfilename(title = "Save output csv", defaultextension=".csv", filetypes=(("comma separated values", "*.csv"),("Parquet (requires pyarrow)", "*.parquet"),("All Files", "*.*") ))
+    return search_folder(working_folder, output_path, results_per_file_and_term = results_per_file_and_term, workers = workers)
+
+def main(arguments = None):
+    """
+    Runs a search from the command line, or with prompts if no arguments are given.
+
+    Parameters:
+    arguments (list): The command line arguments, sys.argv[1:] if None.
+    """
+    parser = argparse.ArgumentParser(description = 'Search all PDF files in a folder for a list of terms (regexes) and write the matches to a CSV file. Run without arguments to be prompted instead.')
+    parser.add_argument('folder', nargs = '?', help = 'folder containing the PDF files')
+    parser.add_argument('-o', '--output', help = 'CSV file to write (overwritten if it exists), or a .parquet file (requires pyarrow)')
+    parser.add_argument('-t', '--terms', help = f'file with one search term per line (default: {terms_filename} in the folder)')
+    parser.add_argument('-n', '--results', type = int, default = 0, help = 'number of results to return for each file and term, 0 returns all (default)')
+    parser.add_argument('-w', '--workers', type = int, default = os.cpu_count() or 1, help = 'number of PDF files to process at once (default: number of processor cores)')
+    parser.add_argument('--case-sensitive', action = 'store_true', help = 'match the case of the terms (default is to ignore case)')
+    parser.add_argument('--no-store', action = 'store_true', help = 'do not keep the extracted text in the folder for later searches')
+    parser.add_argument('-r', '--recursive', action = 'store_true', help = 'also search PDF files in subfolders')
+    parser.add_argument('--include', action = 'append', metavar = 'GLOB', help = f'only search files matching this pattern, e.g. "reports/*.pdf" (can be repeated, default: {pdf_file_pattern})')
+    parser.add_argument('--exclude', action = 'append', metavar = 'GLOB', help = 'skip files or folders matching this pattern, e.g. "drafts/*" (can be repeated)')
+    parser.add_argument('-u', '--update', action = 'store_true', help = 'update an existing CSV output, only searching new or changed files and new terms')
+    parser.add_argument('--watch', type = float, metavar = 'SECONDS', help = 'keep updating the output, checking the folder for changes every SECONDS')
+    parser.add_argument('--report', metavar = 'JSON_FILE', help = 'write a report of the time spent on each file, stage and term to this file')
+    parser.add_argument('--profile', action = 'store_true', help = 'also profile the search with cProfile, listing the slowest functions in the report (needs --report)')
+    parser.add_argument('--skip-duplicates', action = 'store_true', help = 'only search one of each group of identical or near-identical PDF files, listing the others in an aliases column')
+    parsed = parser.parse_args(arguments)
+
+    if parsed.folder is None:
+        failed_files = run_with_prompts()
+    else:
+        if parsed.output is None:
+            parser.error('an output file (-o) is needed when a folder is given')
+        if parsed.profile and parsed.report is None:
+            parser.error('--profile needs a report file (--report)')
+        if parsed.skip_duplicates and (parsed.update or parsed.watch is not None):
+            parser.error('--skip-duplicates cannot be used with --update or --watch')
+        flags = 0 if parsed.case_sensitive else search_flags
+        search_options = dict(results_per_file_and_term = parsed.results, flags = flags, workers = max(parsed.workers, 1), use_store = not parsed.no_store,
+                              recursive = parsed.recursive, include = parsed.include, exclude = parsed.exclude,
+                              report_path = parsed.report, profile = parsed.profile)
+        if parsed.watch is not None:
+            watch_folder(parsed.folder, parsed.output, parsed.watch, parsed.terms, **search_options)
+            return
+        terms = read_terms(parsed.terms) if parsed.terms is not None else None
+        failed_files = search_folder(parsed.folder, parsed.output, terms, incremental = parsed.update, skip_duplicates = parsed.skip_duplicates, **search_options)
+    for filename, error in failed_files:
+        print(f'Could not process {filename}: {error}')
+
+# Worker processes import this file to find search_file, so only run when started as a script
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# Remembers which files have been searched for which terms for an output file,
+# so that updating the output only searches new or changed files and new terms
+# The state is kept in a JSON file next to the output: <output>.state.json
+
+import json
+import os
+
+from result_writers import CSVResultWriter, read_csv_results
+
+def state_path_for(output_path):
+    return output_path + '.state.json'
+
+class SearchState:
+    """
+    The size, modification time and terms already searched for each file in an output file.
+    """
+    def __init__(self, output_path, settings):
+        """
+        Parameters:
+        output_path (str): The path of the CSV output file the state belongs to.
+        settings (dict): The search settings (e.g. results per term, flags), if they have changed everything is searched again.
+        """
+        self.state_path = state_path_for(output_path)
+        self.settings = settings
+        self.files = {}
+        if os.path.exists(output_path):
+            try:
+                with open(self.state_path, 'r', encoding = 'utf-8') as state_file:
+                    state = json.load(state_file)
+            except (OSError, ValueError):
+                state = None
+            if state is not None and state['settings'] == settings:
+                self.files = state['files']
+
+    def plan(self, working_folder, pdf_filenames, terms):
+        """
+        Works out what needs searching.
+
+        Parameters:
+        working_folder (str): The path to the folder containing the PDF files.
+        pdf_filenames (list): The PDF files now in the folder.
+        terms (list): The search terms now in use.
+
+        Returns:
+        terms_to_search (dict): For each file needing a search, the terms to search it for.
+        kept (set): (filename, term) pairs whose results in the existing output are still up to date.
+        """
+        terms_to_search = {}
+        kept = set()
+        self.current_stats = {}
+        for filename in pdf_filenames:
+            stat = os.stat(os.path.join(working_folder, filename))
+            self.current_stats[filename] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            previous = self.files.get(filename)
+            if previous is not None and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+                searched_terms = set(previous['terms'])
+            else:
+                searched_terms = set()
+            kept.update((filename, term) for term in terms if term in searched_terms)
+            new_terms = [term for term in terms if term not in searched_terms]
+            if new_terms:
+                terms_to_search[filename] = new_terms
+        return terms_to_search, kept
+
+    def save(self, pdf_filenames, terms, terms_to_search, kept, failed_filenames):
+        """
+        Records the files and terms searched, dropping removed files, removed terms and files which could not be searched.
+
+        Parameters:
+        pdf_filenames (list): The PDF files now in the folder.
+        terms (list): The search terms now in use.
+        terms_to_search (dict): The terms searched for each file in this run, from plan.
+        kept (set): (filename, term) pairs whose results were already up to date, from plan.
+        failed_filenames (set): The files which could not be searched in this run.
+        """
+        files = {}
+        for filename in pdf_filenames:
+            if filename in failed_filenames:
+                continue
+            searched_terms = set(terms_to_search.get(filename, []))
+            files[filename] = dict(self.current_stats[filename],
+                                   terms = [term for term in terms if term in searched_terms or (filename, term) in kept])
+        self.files = files
+        temporary_path = self.state_path + '.tmp'
+        with open(temporary_path, 'w', encoding = 'utf-8') as state_file:
+            json.dump({'settings': self.settings, 'files': files}, state_file, indent = 1)
+        os.replace(temporary_path, self.state_path)
+
+class MergedResults:
+    """
+    Collects new results alongside the still up to date results of an existing output file,
+    then writes them all back out in file and term order.
+    Used as the writer for search_files when updating an output file.
+    """
+    def __init__(self, output_path, kept):
+        """
+        Parameters:
+        output_path (str): The path of the existing CSV output file (may not exist yet).
+        kept (set): (filename, term) pairs whose existing results are still up to date.
+        """
+        self.results = {}
+        if os.path.exists(output_path):
+            for result in read_csv_results(output_path):
+                if (result.filename, result.term) in kept:
+                    self.results.setdefault((result.filename, result.term), []).append(result)
+
+    def write_results(self, results):
+        for result in results:
+            self.results.setdefault((result.filename, result.term), []).append(result)
+
+    def write_csv(self, output_path, pdf_filenames, terms):
+        # Write to a new file and swap it in so the existing output is not lost if this fails part way
+        temporary_path = output_path + '.tmp'
+        writer = CSVResultWriter(open(temporary_path, 'w'))
+        try:
+            for filename in pdf_filenames:
+                for term in terms:
+                    writer.write_results(self.results.get((filename, term), []))
+        finally:
+            writer.close()
+        os.replace(temporary_path, output_path)
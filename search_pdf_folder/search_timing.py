@@ -0,0 +1,206 @@
+# Optional instrumentation of search runs, to find out where the time goes when a search is slow
+# Records for each file the wall and CPU time spent in each stage, the pages and bytes of text read
+# and the matches (and regex time) for each term, and writes it all to a JSON report
+# Optionally also runs each file under cProfile to show the slowest functions
+# Timing is only switched on for a file while it is being processed (see search_in_files.search_file),
+# the rest of the time stage() and the other functions here do nothing
+
+import cProfile
+import json
+import pstats
+import time
+from contextlib import contextmanager, nullcontext
+
+stages = ('extraction', 'cleaning', 'text_store', 'matching', 'page_lookup', 'record_building')
+slowest_count = 10 # files and terms listed as the slowest in the report
+profile_function_count = 30 # functions listed from the profile
+
+current = None # the FileTiming of the file being processed in this process, None when not timing
+
+class FileTiming:
+    """
+    The time spent in each stage of processing one file, plus counts of what was read and found.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.wall_seconds = dict.fromkeys(stages, 0.0)
+        self.cpu_seconds = dict.fromkeys(stages, 0.0)
+        self.pages = 0
+        self.text_bytes = 0
+        self.term_matches = {}
+        self.term_seconds = {} # time spent running each regex term, literal terms are searched together and not timed separately
+
+    @contextmanager
+    def stage(self, name):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.wall_seconds[name] += time.perf_counter() - wall_start
+            self.cpu_seconds[name] += time.process_time() - cpu_start
+
+    def as_dict(self):
+        return {'filename': self.filename, 'pages': self.pages, 'text_bytes': self.text_bytes,
+                'wall_seconds': self.wall_seconds, 'cpu_seconds': self.cpu_seconds,
+                'term_matches': self.term_matches, 'term_seconds': self.term_seconds}
+
+def stage(name):
+    """
+    Times a block of code as part of a stage of the current file, e.g. with search_timing.stage('matching'): ...
+    """
+    return current.stage(name) if current is not None else nullcontext()
+
+def timed(iterable, name):
+    """
+    Times the fetching of each item of an iterable as part of a stage, e.g. extracting each page of a PDF file.
+    """
+    if current is None:
+        return iterable
+    def timed_items():
+        iterator = iter(iterable)
+        while True:
+            with stage(name):
+                item = next(iterator, stop)
+            if item is stop:
+                return
+            yield item
+    stop = object()
+    return timed_items()
+
+def add_pages(count):
+    if current is not None:
+        current.pages += count
+
+def add_text(text):
+    if current is not None:
+        current.text_bytes += len(text.encode('utf-8'))
+
+def add_matches(terms, spans_by_term):
+    if current is not None:
+        for term, spans in zip(terms, spans_by_term):
+            current.term_matches[term] = current.term_matches.get(term, 0) + len(spans)
+
+def add_term_time(term, seconds):
+    if current is not None:
+        current.term_seconds[term] = current.term_seconds.get(term, 0.0) + seconds
+
+def time_file(function, filename, profiled = False):
+    """
+    Runs a function with timing switched on for a file.
+
+    Parameters:
+    function (function): The function to run, taking no arguments.
+    filename (str): The name of the file being processed.
+    profiled (bool): Whether to also run the function under cProfile.
+
+    Returns:
+    result: The result of the function.
+    timing (dict): The timings for the file from FileTiming.as_dict, including the total wall and CPU time,
+                   plus the raw profile statistics under 'profile' if profiled.
+    error (Exception): The exception raised by the function, or None. The exception is passed back rather than raised so the timings are not lost.
+    """
+    global current
+    current = FileTiming(filename)
+    profiler = cProfile.Profile() if profiled else None
+    result, error = None, None
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        result = function()
+    except Exception as exception:
+        error = exception
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        timing = dict(current.as_dict(), total_wall_seconds = time.perf_counter() - wall_start, total_cpu_seconds = time.process_time() - cpu_start)
+        current = None
+    if profiler is not None:
+        profiler.create_stats()
+        timing['profile'] = profiler.stats # a plain dict, so it can be sent back from a worker process
+    return result, timing, error
+
+class _ProfileData:
+    # What pstats.Stats needs to load statistics collected in another process
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+class SearchReport:
+    """
+    Collects the timings of each file in a run and writes the JSON report.
+    """
+    def __init__(self, report_path, profiled = False, settings = None):
+        """
+        Parameters:
+        report_path (str): The path of the JSON report to write.
+        profiled (bool): Whether to run each file under cProfile. The combined profile is also saved to <report_path>.prof for tools like snakeviz.
+        settings (dict): Settings of the run to record in the report.
+        """
+        self.report_path = report_path
+        self.profiled = profiled
+        self.settings = settings or {}
+        self.files = []
+        self.writing_seconds = 0.0
+        self.profile_stats = None
+        self.start = time.perf_counter()
+
+    def add_file(self, timing, error = None):
+        profile = timing.pop('profile', None)
+        if profile is not None:
+            if self.profile_stats is None:
+                self.profile_stats = pstats.Stats(_ProfileData(profile))
+            else:
+                self.profile_stats.add(_ProfileData(profile))
+        self.files.append(dict(timing, error = error))
+
+    def add_writing(self, seconds):
+        self.writing_seconds += seconds
+
+    def summary(self):
+        wall_seconds = time.perf_counter() - self.start
+        pages = sum(file['pages'] for file in self.files)
+        text_bytes = sum(file['text_bytes'] for file in self.files)
+        terms = {}
+        for file in self.files:
+            for term, matches in file['term_matches'].items():
+                term_summary = terms.setdefault(term, {'term': term, 'matches': 0, 'files_with_matches': 0, 'regex_seconds': 0.0})
+                term_summary['matches'] += matches
+                term_summary['files_with_matches'] += matches > 0
+            for term, seconds in file['term_seconds'].items():
+                terms.setdefault(term, {'term': term, 'matches': 0, 'files_with_matches': 0, 'regex_seconds': 0.0})['regex_seconds'] += seconds
+        for file in self.files:
+            file['pages_per_second'] = file['pages'] / file['total_wall_seconds'] if file['total_wall_seconds'] > 0 else None
+        report = {
+            'settings': self.settings,
+            'totals': {'wall_seconds': wall_seconds, 'files': len(self.files), 'failed_files': sum(file['error'] is not None for file in self.files),
+                       'pages': pages, 'text_bytes': text_bytes,
+                       'pages_per_second': pages / wall_seconds if wall_seconds > 0 else None,
+                       'text_bytes_per_second': text_bytes / wall_seconds if wall_seconds > 0 else None,
+                       # Summed over files, so with several workers these add up to more than the wall time of the run
+                       'stage_wall_seconds': {name: sum(file['wall_seconds'][name] for file in self.files) for name in stages},
+                       'stage_cpu_seconds': {name: sum(file['cpu_seconds'][name] for file in self.files) for name in stages},
+                       'writing_seconds': self.writing_seconds},
+            'slowest_files': [{'filename': file['filename'], 'wall_seconds': file['total_wall_seconds'], 'pages': file['pages']}
+                              for file in sorted(self.files, key = lambda file: file['total_wall_seconds'], reverse = True)[:slowest_count]],
+            'slowest_terms': sorted(terms.values(), key = lambda term: term['regex_seconds'], reverse = True)[:slowest_count],
+            'terms': list(terms.values()),
+            'files': self.files,
+        }
+        if self.profile_stats is not None:
+            report['slowest_functions'] = self.slowest_functions()
+        return report
+
+    def slowest_functions(self):
+        functions = []
+        for (path, line, name), (primitive_calls, calls, own_seconds, cumulative_seconds, callers) in self.profile_stats.stats.items():
+            functions.append({'function': f'{path}:{line}({name})', 'calls': calls, 'own_seconds': own_seconds, 'cumulative_seconds': cumulative_seconds})
+        return sorted(functions, key = lambda function: function['own_seconds'], reverse = True)[:profile_function_count]
+
+    def write(self):
+        with open(self.report_path, 'w', encoding = 'utf-8') as report_file:
+            json.dump(self.summary(), report_file, indent = 1)
+        if self.profile_stats is not None:
+            self.profile_stats.dump_stats(self.report_path + '.prof')
@@ -0,0 +1,139 @@
+# Persistent store of the cleaned text of PDF files, so repeat searches of a folder skip pdfplumber
+# Layout of the store folder:
+# index.json - maps each PDF filename to its size, modification time and content hash
+# <hash>.txt - the cleaned pages of a PDF joined with spaces (the text that is searched), UTF-8
+# <hash>.json - the title of the PDF and the size of each page in the text, for finding page numbers
+# Text is stored by content hash so renamed or copied PDF files share one entry
+
+import hashlib
+import json
+import mmap
+import os
+
+index_filename = 'index.json'
+hash_chunk_size = 1024 * 1024 #bytes
+
+def file_hash(path):
+    """
+    Calculates the SHA-256 hash of the contents of a file.
+
+    Parameters:
+    path (str): The path to the file.
+
+    Returns:
+    hex_digest (str): The hash as a hexadecimal string.
+    """
+    file_hasher = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(hash_chunk_size), b''):
+            file_hasher.update(chunk)
+    return file_hasher.hexdigest()
+
+def current_entry(path, previous_entry = None):
+    """
+    Works out the index entry for a file, only rehashing it if its size or modification time have changed.
+
+    Parameters:
+    path (str): The path to the PDF file.
+    previous_entry (dict): The entry for the file from the last run, or None if it is new.
+
+    Returns:
+    entry (dict): The size, modification time (in nanoseconds) and content hash of the file.
+    """
+    stat = os.stat(path)
+    if previous_entry is not None and previous_entry['size'] == stat.st_size and previous_entry['mtime_ns'] == stat.st_mtime_ns:
+        return previous_entry
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': file_hash(path)}
+
+def _write_atomically(path, data):
+    # Several worker processes can write the same entry at once (copies of the same PDF)
+    # so write to a private temporary file and move it into place
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(data)
+    os.replace(temporary_path, path)
+
+def has_document(store_folder, content_hash):
+    return os.path.exists(os.path.join(store_folder, content_hash + '.json'))
+
+def read_document(store_folder, content_hash):
+    """
+    Reads the stored text of a PDF file by memory-mapping it.
+
+    Parameters:
+    store_folder (str): The path to the store folder.
+    content_hash (str): The content hash of the PDF file.
+
+    Returns:
+    document (tuple): (concatenated_pages, page_sizes, title), or None if the file is not in the store.
+    """
+    try:
+        with open(os.path.join(store_folder, content_hash + '.json'), 'r', encoding = 'utf-8') as details_file:
+            details = json.load(details_file)
+        with open(os.path.join(store_folder, content_hash + '.txt'), 'rb') as text_file:
+            if details['text_bytes'] == 0:
+                concatenated_pages = '' # mmap cannot map an empty file
+            else:
+                with mmap.mmap(text_file.fileno(), 0, access = mmap.ACCESS_READ) as mapped_text:
+                    # Regexes are run over str rather than the mapped bytes so that
+                    # re.IGNORECASE and \w keep their Unicode meaning for non-ASCII text
+                    concatenated_pages = str(mapped_text, 'utf-8')
+    except (OSError, ValueError, KeyError):
+        # Missing or partly written entries are treated as not stored and get re-extracted
+        return None
+    return concatenated_pages, details['page_sizes'], details['title']
+
+def write_document(store_folder, content_hash, cleaned_pages, title):
+    """
+    Stores the cleaned text of a PDF file.
+
+    Parameters:
+    store_folder (str): The path to the store folder.
+    content_hash (str): The content hash of the PDF file.
+    cleaned_pages (list): The cleaned text of each page of the PDF file.
+    title (str): The title of the PDF file.
+
+    Returns:
+    document (tuple): (concatenated_pages, page_sizes, title), as returned by read_document.
+    """
+    concatenated_pages = ' '.join(cleaned_pages)
+    page_sizes = [len(page) + 1 for page in cleaned_pages]
+    text_bytes = concatenated_pages.encode('utf-8')
+    details = {'title': title, 'page_sizes': page_sizes, 'text_bytes': len(text_bytes)}
+    # The text goes first so that a details file is never left pointing at missing text
+    _write_atomically(os.path.join(store_folder, content_hash + '.txt'), text_bytes)
+    _write_atomically(os.path.join(store_folder, content_hash + '.json'), json.dumps(details).encode('utf-8'))
+    return concatenated_pages, page_sizes, title
+
+class TextStore:
+    """
+    The index of a store folder, held in the main process while a folder is searched.
+    Worker processes only read and write the per-hash files, the index is saved once at the end of a run.
+    """
+    def __init__(self, store_folder):
+        self.store_folder = store_folder
+        os.makedirs(store_folder, exist_ok = True)
+        try:
+            with open(os.path.join(store_folder, index_filename), 'r', encoding = 'utf-8') as index_file:
+                self.index = json.load(index_file)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def entry(self, filename):
+        return self.index.get(filename)
+
+    def save(self, entries):
+        """
+        Replaces the index with the entries from the latest run and deletes any stored text no longer used.
+        Files which were removed from the folder, or could not be processed, drop out of the index.
+
+        Parameters:
+        entries (dict): The entries for the files searched in this run, keyed by filename.
+        """
+        self.index = dict(entries)
+        _write_atomically(os.path.join(self.store_folder, index_filename), json.dumps(self.index, indent = 1).encode('utf-8'))
+        current_hashes = {entry['hash'] for entry in self.index.values()}
+        for store_entry in os.scandir(self.store_folder):
+            content_hash, extension = os.path.splitext(store_entry.name)
+            if extension in ('.txt', '.json', '.tmp') and store_entry.name != index_filename and content_hash not in current_hashes:
+                os.remove(store_entry.path)